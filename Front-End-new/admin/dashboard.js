@@ -22,16 +22,25 @@ class DashboardService {
 
     async loadRevenueData() {
         try {
-            // Use all invoices (admin view)
-            const invoices = await db.getAllInvoices();
-            const normalize = s => (s || '').toString().toLowerCase();
-            const paidStatuses = new Set(['paid', 'completed', 'success', 'settled']);
-            const paid = (invoices || []).filter(inv => paidStatuses.has(normalize(inv.status)));
-
-            const sumAmount = arr => arr.reduce((sum, inv) => sum + (inv.total_amount || 0), 0);
-
-            const totalRevenue = sumAmount(paid);
-            const averageOrderValue = paid.length > 0 ? totalRevenue / paid.length : 0;
+            const paidStatuses = ['paid', 'completed', 'success', 'settled'];
+            let totalRevenue, averageOrderValue;
+            try {
+                // Server-side rollup: cost does not grow with the invoices table
+                const stats = await db.getRevenueStats({ statuses: paidStatuses });
+                totalRevenue = stats.total.revenue;
+                averageOrderValue = stats.total.aov;
+            } catch (apiError) {
+                // Invoice API not reachable: fall back to summing every invoice here
+                console.warn('Revenue stats API unavailable, using invoices table:', apiError);
+                const invoices = await db.getAllInvoices();
+                const normalize = s => (s || '').toString().toLowerCase();
+                const paid = (invoices || []).filter(inv => paidStatuses.includes(normalize(inv.status)));
+
+                const sumAmount = arr => arr.reduce((sum, inv) => sum + (inv.total_amount || 0), 0);
+
+                totalRevenue = sumAmount(paid);
+                averageOrderValue = paid.length > 0 ? totalRevenue / paid.length : 0;
+            }
 
             this.revenueData = { total: totalRevenue || 0, average: averageOrderValue || 0 };
 
@@ -161,10 +161,29 @@ class OperationsService {
             this.updateCartTimestamps();
         }, 30000);
 
-        // Refresh cart data every 2 minutes
-        setInterval(async () => {
-            await this.loadVirtualCarts();
-        }, 120000);
+        // New invoices and status changes are pushed by the invoice API
+        // instead of re-reading every invoice on a timer
+        this.invoiceStream = db.subscribeInvoices({
+            onInvoice: (invoice) => this.applyInvoiceEvent(invoice),
+            onResync: () => this.loadVirtualCarts(),
+        });
+    }
+
+    applyInvoiceEvent(invoice) {
+        const status = (invoice.status || '').toLowerCase();
+        const isActive = status === 'pending' || status === 'active';
+        const index = (this.virtualCarts || []).findIndex(c => c.id === invoice.id);
+
+        if (index >= 0 && isActive) {
+            this.virtualCarts[index] = { ...this.virtualCarts[index], ...invoice };
+        } else if (index >= 0) {
+            this.virtualCarts.splice(index, 1);
+        } else if (isActive) {
+            this.virtualCarts = [invoice, ...(this.virtualCarts || [])];
+        } else {
+            return;
+        }
+        this.updateVirtualCartsDisplay();
     }
 
     updateCartTimestamps() {
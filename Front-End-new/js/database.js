@@ -8,6 +8,9 @@ const SUPABASE_KEY = 'eyJhbGciOiJIUzI1NiIsInR5cCI6IkpXVCJ9.eyJpc3MiOiJzdXBhYmFzZ
 // Create Supabase client
 const supabase = createClient(SUPABASE_URL, SUPABASE_KEY)
 
+// Invoice API (Track-Model-with-QR/api.py) for server-side aggregates
+const INVOICE_API_URL = 'http://localhost:8000'
+
 // Test user ID for local development
 const TEST_USER_ID = 'test-user-123'
 
@@ -279,6 +282,32 @@ class DatabaseService {
 
 
 
+    // ===== STATS (server-side rollups) =====
+    async getRevenueStats({ groupBy = '', statuses = [], start = null, end = null } = {}) {
+        const params = new URLSearchParams({ group_by: groupBy })
+        if (statuses.length) params.set('status', statuses.join(','))
+        if (start) params.set('start', start)
+        if (end) params.set('end', end)
+        const response = await fetch(`${INVOICE_API_URL}/stats/revenue?${params}`)
+        if (!response.ok) {
+            throw new Error(`Revenue stats failed: ${response.status}`)
+        }
+        return response.json()
+    }
+
+    // ===== LIVE INVOICES (server-sent events) =====
+    // onInvoice gets {seq, op, id, user_id, branch_id, timestamp, total_amount, status, items_count}
+    // for each new invoice or status change; onResync means events were missed, reload once.
+    // Returns the EventSource (call .close() to stop); it reconnects by itself.
+    subscribeInvoices({ userId = null, onInvoice, onResync } = {}) {
+        const params = userId ? `?${new URLSearchParams({ user_id: userId })}` : ''
+        const source = new EventSource(`${INVOICE_API_URL}/invoices/stream${params}`)
+        source.addEventListener('invoice', (event) => onInvoice?.(JSON.parse(event.data)))
+        source.addEventListener('resync', () => onResync?.())
+        source.onerror = () => console.warn('Invoice stream interrupted; reconnecting...')
+        return source
+    }
+
     // ===== ADDITIONAL METHODS =====
     async getInvoiceById(invoiceId) {
         const { data, error } = await this.supabase
@@ -1,6 +1,8 @@
 // ===== INVOICES MANAGEMENT WITH DATABASE INTEGRATION =====
 import { db } from './database.js'
 
+let currentInvoices = []
+
 document.addEventListener('DOMContentLoaded', async function() {
     console.log('Invoices management page loaded');
     
@@ -15,8 +17,26 @@ document.addEventListener('DOMContentLoaded', async function() {
     await loadInvoicesFromDatabase();
     setupPrintButtons();
     setupComplaintButtons();
+    subscribeToNewInvoices(JSON.parse(currentUserStr).id);
 });
 
+// New invoices arrive from the invoice API as they are created, no re-query
+function subscribeToNewInvoices(userId) {
+    db.subscribeInvoices({
+        userId,
+        onInvoice: (invoice) => {
+            const index = currentInvoices.findIndex(i => i.id === invoice.id);
+            if (index >= 0) {
+                currentInvoices[index] = { ...currentInvoices[index], ...invoice };
+            } else {
+                currentInvoices = [invoice, ...currentInvoices];
+            }
+            displayInvoicesTable(currentInvoices);
+        },
+        onResync: () => loadInvoicesFromDatabase(),
+    });
+}
+
 
 
 // Load invoices from database
@@ -49,7 +69,8 @@ async function loadInvoicesFromDatabase() {
         }
 
         console.log('Invoices loaded:', invoices);
-        displayInvoicesTable(invoices || []);
+        currentInvoices = invoices || [];
+        displayInvoicesTable(currentInvoices);
         
     } catch (error) {
         console.error('Error loading invoices:', error);
@@ -20,6 +20,24 @@ from supabase import create_client, Client
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Arabic names by product/class name, used until (or when) detector_classes cannot
+# be read; same list as Track-Model-with-QR/class_map.py seeds display_name with
+DEFAULT_DISPLAY_NAMES = {
+    'Almarai_juice': 'عصير المراعي',
+    'alrabie_juice': 'عصير الربيع',
+    'Nadec_Mlik': 'حليب نادك',
+    'Sun_top': 'صن توب',
+    'barni': 'بارني',
+    'biskrem': 'بسكريم',
+    'loacker': 'لويكر',
+    'oreos': 'أوريو',
+    'galaxy': 'جالكسي',
+    'green_skittles': 'سكيتلز أخضر',
+    'kit_kat': 'كيت كات',
+    'pink_skittles': 'سكيتلز وردي',
+    'protein_bar': 'بروتين بار',
+}
+
 @dataclass
 class RAGConfig:
     openai_api_key: str
@@ -42,6 +60,7 @@ class SupabaseRAG:
         self.vector_store = None
         self.chain = None
         self.memory = None
+        self._display_names: Optional[Dict[str, str]] = None  # class_name -> Arabic, loaded on first use
         self._initialize()
 
     def _initialize(self):
@@ -212,22 +231,16 @@ class SupabaseRAG:
 
     def translate_product_name(self, name: str) -> str:
         """Translate product name from English to Arabic"""
-        translations = {
-            'Almarai_juice': 'عصير المراعي',
-            'alrabie_juice': 'عصير الربيع',
-            'Nadec_Mlik': 'حليب نادك',
-            'Sun_top': 'صن توب',
-            'barni': 'بارني',
-            'biskrem': 'بسكريم',
-            'loacker': 'لويكر',
-            'oreos': 'أوريو',
-            'galaxy': 'جالكسي',
-            'green_skittles': 'سكيتلز أخضر',
-            'kit_kat': 'كيت كات',
-            'pink_skittles': 'سكيتلز وردي',
-            'protein_bar': 'بروتين بار'
-        }
-        return translations.get(name, name)
+        if self._display_names is None:
+            # Same display names the vision nodes get (detector_classes, see class_map.py)
+            names = dict(DEFAULT_DISPLAY_NAMES)
+            try:
+                rows = self.supabase.table("detector_classes").select("class_name, display_name").execute().data or []
+                names.update({r["class_name"]: r["display_name"] for r in rows if r.get("display_name")})
+            except Exception as e:
+                logger.error(f"Error loading display names: {e}")
+            self._display_names = names
+        return self._display_names.get(name, name)
 
     def format_products(self, products: List[Dict], show_prices: bool = True) -> str:
         """Format products for display"""
@@ -1,233 +1,33 @@
 import os
+import sys
+import time
+import uuid
 import cv2
 import numpy as np
 from ultralytics import YOLO
+from ultralytics.trackers.byte_tracker import BYTETracker
+from ultralytics.utils import IterableSimpleNamespace, yaml_load
+from ultralytics.utils.checks import check_yaml
 from collections import defaultdict
-from api import *
-import requests
-from typing import List 
+from schemas import InvoiceItem, InvoiceCreate
+from typing import List
 import torch
+from capture import CONFIG_PATH, load_config, open_camera
+from frame import Frame
+from detections import to_records, from_tracks, class_names, compute_missing, zone_rects, assign_zones, draw_records, NO_ZONE
+from analytics import StoreAnalytics
+from clips import EvidenceRecorder
+from invoicing import InvoiceSender, SENT
+from class_map import ClassMap
 
-INVOICE_API_URL = "http://127.0.0.1:8000/invoices"
-
-MOTION_CAM_INDEX = 0        # YOLO tracking camera
-QR_CAM_INDEX = 1            # QR scanning camera
-TABLE_A_CAM_INDEX = 2       # snapshot camera for Table A
-TABLE_B_CAM_INDEX = 3       # snapshot camera for Table B (unused for now)
-
-MODEL_WEIGHTS = "yolov8n.pt"
 PERSON_CLASS_ID = 0
 NEAR_MARGIN_PX = 30
-
-# Hard-coded table zones by pixel
-TABLES = {
-    "Table A": (229, 202, 302, 296),
-    "Table B": (0, 0, 0, 0),
-}
+TRACKER_CFG = "bytetrack.yaml"
+TRACKER_FPS = 30
+WARMUP_SHAPE = (720, 1280, 3)   # dummy frame size when a camera has no configured resolution
 
 CLEAR_LATEST_ON_EXIT = False
 
-# Maps (track_id, zone) → baseline snapshot list
-baseline_snapshots: dict[tuple[int, str], list[str]] = {}
-
-# Create separate model for item detection (same weights)
-device = "cuda" if torch.cuda.is_available() else "cpu"
-item_model = YOLO(r"C:\Users\Rakan\Desktop\Capstone\TuwaiqPick\Track-Model-with-QR\weights.pt")
-item_model.to(device)
-
-def capture_snapshot(table_name: str) -> list[str]:
-    """
-    Capture a frame from the table camera, run object detection,
-    and return a list of class names (duplicates allowed).
-    """
-    if table_name == "Table A":
-        cam = cap_table_a
-    elif table_name == "Table B":
-        #cam = cap_table_b
-        print("hello B")
-    else:
-        return []
-
-    ret, frame = cam.read()
-    if not ret:
-        print(f"[snapshot] Failed to read from {table_name} camera.")
-        return []
-
-    # Run detection on the snapshot frame
-    results = item_model(
-        frame,
-        conf=0.30,
-        iou=0.45,
-        agnostic_nms=True,
-        verbose=False
-    )
-
-    if results and results[0].boxes is not None:
-        return [item_model.names[int(box.cls[0])] for box in results[0].boxes]
-    return []
-
-def compute_missing(baseline: list[str], current: list[str]) -> list[str]:
-    """
-    Compare baseline and current lists and return items missing
-    from the current list (duplicates preserved).
-    """
-    current_copy = list(current)
-    missing = []
-    for item in baseline:
-        if item in current_copy:
-            current_copy.remove(item)
-        else:
-            missing.append(item)
-    return missing
-
-def on_zone_enter(track_id: int, zone: str):
-    """
-    Fired when a person ENTERS a zone (including switching from another zone).
-    Captures a baseline snapshot of items on that table.
-    """
-    print(f"[enter] track {track_id} -> {zone} | LatestA={TableALatestID} LatestB={TableBLatestID}")
-    if zone in ["Table A", "Table B"]:
-        # Take snapshot at moment of entering
-        baseline = capture_snapshot(zone)
-        baseline_snapshots[(track_id, zone)] = baseline
-        print(f"[snapshot] Baseline for {zone}, track {track_id}: {baseline}")
-
-def on_zone_exit(track_id: int, zone: str):
-    """
-    Fired when a person LEAVES a zone (including switching to another zone).
-    Captures current snapshot, computes missing items, and queues them.
-    """
-    global TableALatestID, TableBLatestID
-
-    # Process item differences if we have a baseline for this track in this zone
-    baseline = baseline_snapshots.pop((track_id, zone), None)
-    if baseline is not None:
-        current_items = capture_snapshot(zone)
-        missing = compute_missing(baseline, current_items)
-        if missing:
-            print(f"[snapshot] Missing items for {zone}, track {track_id}: {missing}")
-            for item_name in missing:
-                # Each duplicate item is queued separately
-                queue_invoice_item(track_id, item_name, 1)
-
-    # Maintain last user ID logic
-    user_id = identity_map.get(track_id, (str(track_id), ""))[0]
-    if zone == "Table A":
-        TableALatestID = user_id
-    elif zone == "Table B":
-        TableBLatestID = user_id
-
-    print(f"[leave] track {track_id} <- {zone} | LatestA={TableALatestID} LatestB={TableBLatestID}")
-
-def on_zone_change(track_id: int, new_zone: str | None, old_zone: str | None):
-    # No movement
-    if new_zone == old_zone:
-        return
-
-    # Left all zones
-    if old_zone is not None and new_zone is None:
-        on_zone_exit(track_id, old_zone)
-        return
-
-    # Entered from no zone
-    if old_zone is None and new_zone is not None:
-        on_zone_enter(track_id, new_zone)
-        return
-
-    # Switched zones (treat as exit then enter)
-    if old_zone is not None and new_zone is not None:
-        on_zone_exit(track_id, old_zone)
-        on_zone_enter(track_id, new_zone)
-        return
-
-def on_identity_linked(track_id: int, user_id: str, user_name: str):
-    print(f"[identity] track {track_id} linked to {user_name} ({user_id})")
-
-# ----------------------------
-# UTILS
-# ----------------------------
-
-def queue_invoice_item(track_id: int, name: str, quantity: int):
-    """
-    Call this whenever your shelf logic decides the person took an item.
-    Example: queue_invoice_item(track_id, "Pepsi 330ml", 1)
-    """
-    try:
-        item = InvoiceItem(name=name, quantity=quantity)
-        cart_items[track_id].append(item)
-        print(f"[cart] track {track_id}: +{quantity} x {name} (total items now {len(cart_items[track_id])})")
-    except Exception as e:
-        print(f"[cart] Failed to queue item for track {track_id}: {e}")
-
-def _get_user_id_for_track(track_id: int) -> str | None:
-    """
-    Extract user_id previously linked via QR. Returns None if not linked.
-    """
-    if track_id in identity_map:
-        return identity_map[track_id][0]  # (user_id, user_name)
-    return None
-
-def _flush_invoice_for_track(track_id: int):
-    """
-    Build and POST InvoiceCreate for this track if possible.
-    Clears the cart on success (or leaves it intact on failure).
-    """
-    user_id = _get_user_id_for_track(track_id)
-    items = cart_items.get(track_id, [])
-
-    if not user_id:
-        print(f"[invoice] track {track_id}: no user_id bound; skipping invoice.")
-        return
-
-    if not items:
-        print(f"[invoice] track {track_id}: no items; nothing to invoice.")
-        return
-
-    # Build pydantic model then POST as JSON
-    try:
-        payload = InvoiceCreate(user_id=user_id, items=items)
-        print(payload.model_dump())
-        resp = requests.post(INVOICE_API_URL, json=payload.model_dump())
-        if resp.status_code >= 200 and resp.status_code < 300:
-            print(f"[invoice] track {track_id}: SUCCESS {resp.status_code}")
-            cart_items.pop(track_id, None)  # clear on success
-        else:
-            print(f"[invoice] track {track_id}: FAILED {resp.status_code} - {resp.text}")
-    except Exception as e:
-        print(f"[invoice] track {track_id}: ERROR posting invoice: {e}")
-
-def on_person_left(track_id: int):
-    """
-    Called when a track disappears from the frame.
-    """
-    print(f"[leave] track {track_id} left the frame; attempting to flush invoice.")
-    _flush_invoice_for_track(track_id)
-
-    # Clean up identity map and last_zone to avoid growth
-    identity_map.pop(track_id, None)
-    last_zone.pop(track_id, None)
-
-def point_in_rect_with_margin(pt, rect, margin=0):
-    x, y = pt
-    x1, y1, x2, y2 = rect
-    return (x1 - margin) <= x <= (x2 + margin) and (y1 - margin) <= y <= (y2 + margin)
-
-def rect_center(rect):
-    x1, y1, x2, y2 = rect
-    return ((x1 + x2) // 2, (y1 + y2) // 2)
-
-def choose_zone_for_point(pt):
-    candidates = []
-    for name, rect in TABLES.items():
-        if point_in_rect_with_margin(pt, rect, NEAR_MARGIN_PX):
-            cx, cy = rect_center(rect)
-            dist2 = (pt[0] - cx) ** 2 + (pt[1] - cy) ** 2
-            candidates.append((dist2, name))
-    if not candidates:
-        return None
-    candidates.sort(key=lambda t: t[0])
-    return candidates[0][1]
-
 # ---- OpenCV QR helpers (version-safe)
 def decode_multi(detector, frame):
     out = detector.detectAndDecodeMulti(frame)
@@ -253,29 +53,380 @@ def decode_single(detector, frame):
             return text, points
     return str(out) if out is not None else "", None
 
-clicked_points_qr = []            # show clicks on QR window
-selected_track_id = [None]        
-last_zone = defaultdict(lambda: None)
-identity_map = {}                 # track_id -> (user_id, user_name)
-TableALatestID = ""
-TableBLatestID = ""
-cart_items = defaultdict(list) 
-_active_ids_prev = set()
-
-# mouse: QR window
-def mouse_qr(event, x, y, flags, param):
-    if event == cv2.EVENT_LBUTTONDOWN:
-        print(f"[QR window] Clicked at: x={x}, y={y}")
-        clicked_points_qr.append((x, y))
-
-# motion window select nearest track under click
-def mouse_motion_factory(current_tracks_ref):
-    # current_tracks_ref(): returns list of (track_id, cx, cy, bbox)
-    def cb(event, x, y, flags, param):
+def _placeholder(text: str):
+    img = np.zeros((360, 480, 3), dtype=np.uint8)
+    cv2.putText(img, text, (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 255), 2)
+    return img
+
+# ----------------------------
+# MODELS (shared by every store)
+# ----------------------------
+
+class SharedModels:
+    """
+    Person detector and item detector loaded once per process.
+    Every StoreSession borrows them; each inference call is batched
+    across all sessions' frames for that tick.
+    Weights load on first use; call warmup() before the main loop so the
+    first real frame does not pay for loading and CUDA/cuDNN initialisation.
+    """
+
+    def __init__(self, models_cfg: dict):
+        self.weights = models_cfg
+        self.device = "cuda" if torch.cuda.is_available() else "cpu"
+        self._person_model = None
+        self._item_model = None
+        self._class_map = None
+
+    @property
+    def person_model(self):
+        if self._person_model is None:
+            self._person_model = YOLO(self.weights["tracker"])
+            self._person_model.to(self.device)
+        return self._person_model
+
+    @property
+    def item_model(self):
+        if self._item_model is None:
+            self._item_model = YOLO(self.weights["items"])
+            self._item_model.to(self.device)
+        return self._item_model
+
+    @property
+    def class_map(self) -> ClassMap:
+        """
+        Item class name -> product ID map for the item model, from the invoice API.
+        """
+        if self._class_map is None:
+            self._class_map = ClassMap(os.path.basename(self.weights["items"]))
+        return self._class_map
+
+    def warmup(self, motion_shapes: list[tuple], table_shapes: list[tuple]):
+        """
+        Load both models and run them once on black frames of the shapes the
+        cameras will deliver, through the same batched paths as the main loop.
+        """
+        t0 = time.perf_counter()
+        self.class_map  # fetch (or load the cached) class map before the loop
+        self.detect_people([Frame(np.zeros(s, dtype=np.uint8)) for s in motion_shapes])
+        if table_shapes:
+            self.detect_items([Frame(np.zeros(s, dtype=np.uint8)) for s in table_shapes])
+        print(f"[models] warm-up done on {self.device} in {time.perf_counter() - t0:.1f}s")
+
+    def detect_people(self, frames: list[Frame]) -> list:
+        """
+        One batched person-detection call for all stores. Tracking is done
+        per session (see StoreSession.tracker) so track IDs never mix.
+        Low conf on purpose: ByteTrack uses low-score boxes in its second pass.
+        """
+        if not frames:
+            return []
+        return self.person_model.predict(
+            [f.image for f in frames],
+            classes=[PERSON_CLASS_ID],
+            conf=0.1,
+            verbose=False
+        )
+
+    def detect_items(self, frames: list[Frame]):
+        """
+        Run item detection on every frame that has no cached detections yet,
+        batching frames whose letterboxed tensors share a shape.
+        Results are cached on each frame as a structured array (see detections.py).
+        """
+        groups = defaultdict(list)
+        for f in frames:
+            if not f.has("items"):
+                groups[tuple(f.tensor().shape)].append(f)
+
+        for group in groups.values():
+            results = self.item_model(
+                torch.cat([f.tensor() for f in group]),
+                conf=0.30,
+                iou=0.45,
+                agnostic_nms=True,
+                verbose=False
+            )
+            for f, r in zip(group, results):
+                f.store("items", to_records(r, f))
+
+    def items_for(self, frame: Frame):
+        self.detect_items([frame])
+        return frame.get("items")
+
+def make_tracker():
+    args = IterableSimpleNamespace(**yaml_load(check_yaml(TRACKER_CFG)))
+    return BYTETracker(args=args, frame_rate=TRACKER_FPS)
+
+# ----------------------------
+# STORE SESSION
+# ----------------------------
+
+class StoreSession:
+    """
+    All per-store state: zones, cameras, tracker, identities and carts.
+    Several sessions can run in one process on the same SharedModels.
+    """
+
+    def __init__(self, config: dict, models: SharedModels):
+        self.name = config["store"]
+        self.models = models
+        self.zones = config["zones"]
+        self.zone_names, self.zone_rects = zone_rects(
+            {name: z["rect"] for name, z in self.zones.items()})
+        self.tracker = make_tracker()
+        # Track IDs restart with every run; this makes invoice idempotency keys unique
+        self.run_id = uuid.uuid4().hex[:12]
+
+        # Heatmap / dwell accumulator fed from the tracking loop (flushes to ./analytics/<store>)
+        self.analytics = StoreAnalytics(self.name, self.zone_names)
+        # Rolling per-camera buffers; clips are written around pick/leave events
+        self.evidence = EvidenceRecorder(self.name)
+        # Invoices are POSTed (and retried) off the vision loop
+        self.invoices = InvoiceSender(self.log)
+
+        # Maps (track_id, zone) → baseline snapshot list
+        self.baseline_snapshots: dict[tuple[int, str], list[str]] = {}
+        # Latest processed frame per table; its views and detections are shared
+        self.table_frames: dict[str, Frame] = {}
+
+        self.clicked_points_qr = []            # show clicks on QR window
+        self.selected_track_id = None
+        self.last_zone = defaultdict(lambda: None)
+        self.identity_map = {}                 # track_id -> (user_id, user_name)
+        self.latest_user = {name: "" for name in self.zone_names}
+        self.cart_items = defaultdict(list)
+        self.cart_keys: dict[int, str] = {}    # track_id -> idempotency key of the open cart
+        self._active_ids_prev = set()
+        self.current_tracks = []               # list of (track_id, cx, cy, (x1,y1,x2,y2))
+
+        self.detector = cv2.QRCodeDetector()
+        self.seen_qr = set()  # avoid spamming duplicates
+
+        # cameras: motion, QR, and one per zone that names an enabled camera
+        cameras = config["cameras"]
+        self.cap_motion = open_camera(f"{self.name}/motion", cameras["motion"])
+        self.cap_qr = open_camera(f"{self.name}/qr", cameras["qr"])
+        self.table_caps = {}
+        for zone, z in self.zones.items():
+            cam = cameras.get(z["camera"]) if z["camera"] else None
+            if cam is not None and cam.enabled:
+                self.table_caps[zone] = open_camera(f"{self.name}/{z['camera']}", cam)
+
+        # prepare windows
+        self.motion_win = f"{self.name} | Proximity Tracker (click to select track, q to quit)"
+        self.qr_win = f"{self.name} | QR Scanner (click shows x,y)"
+        self.table_wins = {zone: f"{self.name} | {zone} Cam" for zone in self.table_caps}
+        cv2.namedWindow(self.motion_win)
+        cv2.namedWindow(self.qr_win)
+        for win in self.table_wins.values():
+            cv2.namedWindow(win)
+        cv2.setMouseCallback(self.qr_win, self.mouse_qr)
+        cv2.setMouseCallback(self.motion_win, self.mouse_motion)
+
+        self.frame_motion = None
+        self.frame_qr = None
+
+    @staticmethod
+    def _frame_shape(cam) -> tuple:
+        if cam.width and cam.height:
+            return (cam.height, cam.width, 3)
+        return WARMUP_SHAPE
+
+    def warmup_shapes(self, config: dict) -> tuple[list[tuple], list[tuple]]:
+        """
+        Expected (motion, table) frame shapes for SharedModels.warmup().
+        """
+        cameras = config["cameras"]
+        motion = [self._frame_shape(cameras["motion"])]
+        tables = [self._frame_shape(cameras[self.zones[z]["camera"]]) for z in self.table_caps]
+        return motion, tables
+
+    def log(self, msg: str):
+        print(f"[{self.name}] {msg}")
+
+    def _evidence_cameras(self, zone: str | None = None) -> list[str]:
+        cams = ["motion"]
+        if zone in self.table_caps:
+            cams.append(self.zones[zone]["camera"])
+        return cams
+
+    # ---- snapshots
+    def capture_snapshot(self, table_name: str) -> list[str]:
+        """
+        Return a list of class names (duplicates allowed) on the table, reusing the
+        latest frame the main loop already processed for that camera.
+        """
+        frame = self.table_frames.get(table_name)
+        if frame is None:
+            cam = self.table_caps.get(table_name)
+            if cam is None:
+                return []
+
+            ret, image = cam.read()
+            if not ret:
+                self.log(f"[snapshot] Failed to read from {table_name} camera.")
+                return []
+            frame = Frame(image)
+
+        return class_names(self.models.items_for(frame), self.models.item_model.names)
+
+    # ---- zone events
+    def on_zone_enter(self, track_id: int, zone: str):
+        """
+        Fired when a person ENTERS a zone (including switching from another zone).
+        Captures a baseline snapshot of items on that table.
+        """
+        self.log(f"[enter] track {track_id} -> {zone} | Latest={self.latest_user}")
+        self.evidence.trigger("zone_enter", track_id, self._evidence_cameras(zone))
+        if zone in self.table_caps:
+            # Take snapshot at moment of entering
+            baseline = self.capture_snapshot(zone)
+            self.baseline_snapshots[(track_id, zone)] = baseline
+            self.log(f"[snapshot] Baseline for {zone}, track {track_id}: {baseline}")
+
+    def on_zone_exit(self, track_id: int, zone: str):
+        """
+        Fired when a person LEAVES a zone (including switching to another zone).
+        Captures current snapshot, computes missing items, and queues them.
+        """
+        self.evidence.trigger("zone_exit", track_id, self._evidence_cameras(zone))
+
+        # Process item differences if we have a baseline for this track in this zone
+        baseline = self.baseline_snapshots.pop((track_id, zone), None)
+        if baseline is not None:
+            current_items = self.capture_snapshot(zone)
+            missing = compute_missing(baseline, current_items)
+            if missing:
+                self.log(f"[snapshot] Missing items for {zone}, track {track_id}: {missing}")
+                for item_name in missing:
+                    # Each duplicate item is queued separately
+                    self.queue_invoice_item(track_id, item_name, 1, zone)
+
+        # Maintain last user ID logic
+        self.latest_user[zone] = self.identity_map.get(track_id, (str(track_id), ""))[0]
+
+        self.log(f"[leave] track {track_id} <- {zone} | Latest={self.latest_user}")
+
+    def on_zone_change(self, track_id: int, new_zone: str | None, old_zone: str | None):
+        # No movement
+        if new_zone == old_zone:
+            return
+
+        # Left all zones
+        if old_zone is not None and new_zone is None:
+            self.on_zone_exit(track_id, old_zone)
+            return
+
+        # Entered from no zone
+        if old_zone is None and new_zone is not None:
+            self.on_zone_enter(track_id, new_zone)
+            return
+
+        # Switched zones (treat as exit then enter)
+        if old_zone is not None and new_zone is not None:
+            self.on_zone_exit(track_id, old_zone)
+            self.on_zone_enter(track_id, new_zone)
+            return
+
+    def on_identity_linked(self, track_id: int, user_id: str, user_name: str):
+        self.log(f"[identity] track {track_id} linked to {user_name} ({user_id})")
+
+    # ---- cart / invoice
+    def queue_invoice_item(self, track_id: int, name: str, quantity: int, zone: str | None = None):
+        """
+        Call this whenever your shelf logic decides the person took an item.
+        Example: session.queue_invoice_item(track_id, "Pepsi 330ml", 1)
+        """
+        try:
+            # Send the product ID so the API does not have to match class-name strings
+            item = InvoiceItem(name=name, product_id=self.models.class_map.product_id(name),
+                               quantity=quantity)
+            # A new cart gets a new key; retries of the same cart reuse it
+            self.cart_keys.setdefault(track_id, f"{self.name}:{self.run_id}:{track_id}:{uuid.uuid4().hex[:12]}")
+            self.cart_items[track_id].append(item)
+            self.evidence.trigger("item_queued", track_id, self._evidence_cameras(zone))
+            self.log(f"[cart] track {track_id}: +{quantity} x {name} (total items now {len(self.cart_items[track_id])})")
+        except Exception as e:
+            self.log(f"[cart] Failed to queue item for track {track_id}: {e}")
+
+    def _get_user_id_for_track(self, track_id: int) -> str | None:
+        """
+        Extract user_id previously linked via QR. Returns None if not linked.
+        """
+        if track_id in self.identity_map:
+            return self.identity_map[track_id][0]  # (user_id, user_name)
+        return None
+
+    def _flush_invoice_for_track(self, track_id: int):
+        """
+        Build InvoiceCreate for this track if possible and hand it to the
+        invoice sender. Clears the cart on success (or restores it on failure).
+        """
+        user_id = self._get_user_id_for_track(track_id)
+        items = self.cart_items.get(track_id, [])
+
+        if not user_id:
+            self.log(f"[invoice] track {track_id}: no user_id bound; skipping invoice.")
+            return
+
+        if not items:
+            self.log(f"[invoice] track {track_id}: no items; nothing to invoice.")
+            return
+
+        # Build pydantic model then POST as JSON. The idempotency key lets us
+        # retry a timed-out request without risking a second charge.
+        try:
+            payload = InvoiceCreate(user_id=user_id, items=items,
+                                    idempotency_key=self.cart_keys[track_id])
+        except Exception as e:
+            self.log(f"[invoice] track {track_id}: ERROR building invoice: {e}")
+            return
+        print(payload.model_dump())
+
+        # The cart goes with the invoice; _collect_invoices() puts it back on failure
+        self.cart_items.pop(track_id, None)
+        self.cart_keys.pop(track_id, None)
+        self.invoices.submit(track_id, payload)
+
+    def _collect_invoices(self, results: list[tuple]):
+        """
+        Apply the outcomes reported by the invoice sender (main thread only).
+        """
+        for track_id, outcome, invoice_id, payload in results:
+            if outcome == SENT:
+                if invoice_id:
+                    self.evidence.tag_invoice(track_id, invoice_id)
+            else:
+                self.cart_items[track_id] = list(payload.items) + self.cart_items.get(track_id, [])
+                # Same cart, same key: a request that did go through is not charged twice
+                self.cart_keys[track_id] = payload.idempotency_key
+
+    def on_person_left(self, track_id: int):
+        """
+        Called when a track disappears from the frame.
+        """
+        self.log(f"[leave] track {track_id} left the frame; attempting to flush invoice.")
+        self.evidence.trigger("person_left", track_id, self._evidence_cameras())
+        self._flush_invoice_for_track(track_id)
+        self.analytics.close_track(track_id)
+
+        # Clean up identity map and last_zone to avoid growth
+        self.identity_map.pop(track_id, None)
+        self.last_zone.pop(track_id, None)
+
+    # ---- mouse
+    def mouse_qr(self, event, x, y, flags, param):
         if event == cv2.EVENT_LBUTTONDOWN:
-            tracks = current_tracks_ref()
+            self.log(f"[QR window] Clicked at: x={x}, y={y}")
+            self.clicked_points_qr.append((x, y))
+
+    def mouse_motion(self, event, x, y, flags, param):
+        # select nearest track under click
+        if event == cv2.EVENT_LBUTTONDOWN:
+            tracks = list(self.current_tracks)
             if not tracks:
-                print("[motion] No tracks to select.")
+                self.log("[motion] No tracks to select.")
                 return
             # choose nearest center
             best = None
@@ -285,139 +436,94 @@ def mouse_motion_factory(current_tracks_ref):
                 if d2 < best_d2:
                     best_d2 = d2
                     best = tid
-            selected_track_id[0] = int(best)
-            print(f"[motion] Selected track ID: {selected_track_id[0]}")
-    return cb
-
-def main():
-    os.environ["ULTRALYTICS_LAP"] = "scipy"
-
-    # prepare QR camera (1)
-    cap_qr = cv2.VideoCapture(QR_CAM_INDEX, cv2.CAP_DSHOW)
-    if not cap_qr.isOpened():
-        raise RuntimeError("Could not open QR camera (index 1).")
-
-    # prepare table cameras
-    global cap_table_a, cap_table_b
-    cap_table_a = cv2.VideoCapture(TABLE_A_CAM_INDEX, cv2.CAP_DSHOW)
-    table_a_win = "Table A Cam"
-    cv2.namedWindow(table_a_win)
-    # table_b_win = "Table B Cam"  # if you later enable B
-    if not cap_table_a.isOpened():
-        raise RuntimeError("Could not open Table A camera (index 2).")
-    
-
-    # cap_table_b = cv2.VideoCapture(TABLE_B_CAM_INDEX, cv2.CAP_DSHOW)
-    # if not cap_table_b.isOpened():
-    #     raise RuntimeError("Could not open Table B camera (index 3).")
-
-    # set snapshot camera resolutions (optional)
-    cap_table_a.set(cv2.CAP_PROP_FRAME_WIDTH, 1280)
-    cap_table_a.set(cv2.CAP_PROP_FRAME_HEIGHT, 720)
-    # cap_table_b.set(cv2.CAP_PROP_FRAME_WIDTH, 1280)
-    # cap_table_b.set(cv2.CAP_PROP_FRAME_HEIGHT, 720)
-
-    # prepare windows
-    motion_win = "Proximity Tracker (click to select track, q to quit)"
-    qr_win = "QR Scanner (click shows x,y)"
-    cv2.namedWindow(motion_win)
-    cv2.namedWindow(qr_win)
-    cv2.setMouseCallback(qr_win, mouse_qr)
-
-    # the motion window needs current track data for selection:
-    current_tracks = []  # list of (track_id, cx, cy, (x1,y1,x2,y2))
-    def get_current_tracks():
-        return list(current_tracks)
-    
-    cv2.setMouseCallback(motion_win, mouse_motion_factory(get_current_tracks))
-
-    # YOLO model & stream from motion cam (0)
-    model = YOLO(MODEL_WEIGHTS)
-    results_stream = model.track(
-        source=MOTION_CAM_INDEX,
-        stream=True,
-        persist=True,
-        classes=[PERSON_CLASS_ID],
-        tracker="bytetrack.yaml",
-        verbose=False
-    )
-
-    detector = cv2.QRCodeDetector()
-    seen_qr = set()  # avoid spamming duplicates
-
-    print("Running. In the motion window, click a person to select their track.\n"
-          "In the QR window, click to see (x,y). Press 'q' in any window to quit.")
-
-    global _active_ids_prev
-    for result in results_stream:
-        # motion (cam 0) 
-        frame_motion = result.orig_img 
-        h0, w0 = frame_motion.shape[:2]
-        current_tracks.clear()
+            self.selected_track_id = int(best)
+            self.log(f"[motion] Selected track ID: {self.selected_track_id}")
+
+    # ---- per-tick processing
+    def read_motion(self) -> Frame | None:
+        ok, image = self.cap_motion.read()
+        if not ok:
+            self.log("[motion] Frame grab failed.")
+            return None
+        return Frame(image)
+
+    def process_motion(self, frame: Frame, result):
+        """
+        Update this store's tracker from the shared person detections,
+        fire zone/leave events and draw the motion view.
+        """
+        self._collect_invoices(self.invoices.poll())
+        # buffer the raw frame before anything is drawn on it
+        self.evidence.push("motion", frame)
+        frame_motion = frame.image
+        self.current_tracks.clear()
 
         # draw zones
-        for name, (x1, y1, x2, y2) in TABLES.items():
+        for name, (x1, y1, x2, y2) in zip(self.zone_names, self.zone_rects.tolist()):
             cv2.rectangle(frame_motion, (x1, y1), (x2, y2), (0, 255, 0), 2)
             cv2.rectangle(frame_motion, (x1 - NEAR_MARGIN_PX, y1 - NEAR_MARGIN_PX),
                           (x2 + NEAR_MARGIN_PX, y2 + NEAR_MARGIN_PX), (0, 255, 0), 1)
             cv2.putText(frame_motion, name, (x1, max(20, y1 - 8)),
                         cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2, cv2.LINE_AA)
 
-        boxes = result.boxes
-        if boxes is not None and boxes.id is not None:
-            ids = boxes.id.cpu().numpy().astype(int)
-            xyxy = boxes.xyxy.cpu().numpy().astype(int)
-            cls = boxes.cls.cpu().numpy().astype(int)
-
-            for i, box in enumerate(xyxy):
-                if cls[i] != PERSON_CLASS_ID:
-                    continue
-                track_id = int(ids[i])
-                x1, y1, x2, y2 = box
-                cx = (x1 + x2) // 2
-                cy = (y1 + y2) // 2
-
-                current_tracks.append((track_id, cx, cy, (x1, y1, x2, y2)))
-
-                zone = choose_zone_for_point((cx, cy))
-                if zone != last_zone[track_id]:
-                    on_zone_change(track_id, zone, last_zone[track_id])
-                    last_zone[track_id] = zone
-
-                # draw bbox
-                color = (255, 255, 255)
-                if selected_track_id[0] == track_id:
-                    color = (0, 255, 255) 
-                cv2.rectangle(frame_motion, (x1, y1), (x2, y2), color, 2)
-
-                # label show linked identity
-                if track_id in identity_map:
-                    user_id, user_name = identity_map[track_id]
-                    id_text = f"{user_name} ({user_id})"
-                else:
-                    id_text = f"ID {track_id}"
-                label = f"{id_text} | {zone or 'No table'}"
-                cv2.putText(frame_motion, label, (x1, max(20, y1 - 8)),
-                            cv2.FONT_HERSHEY_SIMPLEX, 0.65, color, 2, cv2.LINE_AA)
-
-                cv2.circle(frame_motion, (cx, cy), 4, color, -1)
+        # one transfer for all boxes, then keep tracked persons only
+        recs = from_tracks(self.tracker.update(result.boxes.cpu().numpy(), frame_motion))
+        recs = recs[(recs["cls"] == PERSON_CLASS_ID) & (recs["id"] >= 0)]
+        zone_idx = assign_zones(recs["center"], self.zone_rects, NEAR_MARGIN_PX)
+        self.analytics.update(recs["id"], recs["center"], zone_idx, frame_motion.shape)
+
+        for track_id, (x1, y1, x2, y2), (cx, cy), zi in zip(
+                recs["id"].tolist(), recs["xyxy"].tolist(),
+                recs["center"].tolist(), zone_idx.tolist()):
+            self.current_tracks.append((track_id, cx, cy, (x1, y1, x2, y2)))
+
+            zone = self.zone_names[zi] if zi != NO_ZONE else None
+            if zone != self.last_zone[track_id]:
+                self.on_zone_change(track_id, zone, self.last_zone[track_id])
+                self.last_zone[track_id] = zone
+
+            # draw bbox
+            color = (255, 255, 255)
+            if self.selected_track_id == track_id:
+                color = (0, 255, 255)
+            cv2.rectangle(frame_motion, (x1, y1), (x2, y2), color, 2)
+
+            # label show linked identity
+            if track_id in self.identity_map:
+                user_id, user_name = self.identity_map[track_id]
+                id_text = f"{user_name} ({user_id})"
+            else:
+                id_text = f"ID {track_id}"
+            label = f"{id_text} | {zone or 'No table'}"
+            cv2.putText(frame_motion, label, (x1, max(20, y1 - 8)),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.65, color, 2, cv2.LINE_AA)
+
+            cv2.circle(frame_motion, (cx, cy), 4, color, -1)
 
         # Update active ID tracking
-        current_ids = {tid for (tid, cx, cy, box) in current_tracks}
-        left_ids = _active_ids_prev - current_ids
+        current_ids = {tid for (tid, cx, cy, box) in self.current_tracks}
+        left_ids = self._active_ids_prev - current_ids
         for tid in left_ids:
-            on_person_left(tid)
-        _active_ids_prev = current_ids
+            self.on_person_left(tid)
+        self._active_ids_prev = current_ids
+
+        self.frame_motion = frame_motion
 
-        # QR (cam 1)
-        ok_qr, frame_qr = cap_qr.read()
+    def _link_identity(self, text: str):
+        payload = text.strip()
+        user_id, user_name = payload, payload
+        self.identity_map[self.selected_track_id] = (user_id, user_name)
+        self.on_identity_linked(self.selected_track_id, user_id, user_name)
+        self.seen_qr.add(text)
+
+    def process_qr(self):
+        ok_qr, frame_qr = self.cap_qr.read()
         if not ok_qr:
-            frame_qr = np.zeros((360, 480, 3), dtype=np.uint8)
-            cv2.putText(frame_qr, "QR cam read failed", (10, 30),
-                        cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 255), 2)
+            frame_qr = _placeholder("QR cam read failed")
+        qr_frame = Frame(frame_qr)
 
-        # decode multi QR first
-        success, decoded_info, pts_list = decode_multi(detector, frame_qr)
+        # decode multi QR first (on the shared gray view; drawing stays on BGR)
+        success, decoded_info, pts_list = decode_multi(self.detector, qr_frame.gray)
         if success:
             for text, pts in zip(decoded_info, pts_list):
                 if pts is None:
@@ -431,14 +537,10 @@ def main():
                     cv2.putText(frame_qr, text, (x, max(y - 10, 0)),
                                 cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
                     #add this later : text not in seen_qr and
-                    if  selected_track_id[0] is not None:
-                        payload = text.strip()
-                        user_id, user_name = payload, payload
-                        identity_map[selected_track_id[0]] = (user_id, user_name)
-                        on_identity_linked(selected_track_id[0], user_id, user_name)
-                        seen_qr.add(text)
+                    if self.selected_track_id is not None:
+                        self._link_identity(text)
         else:
-            text, pts = decode_single(detector, frame_qr)
+            text, pts = decode_single(self.detector, qr_frame.gray)
             if pts is not None and text:
                 pts = pts.astype(int).reshape(-1, 2)
                 for i in range(len(pts)):
@@ -446,50 +548,111 @@ def main():
                 x, y = pts[0]
                 cv2.putText(frame_qr, text, (x, max(y - 10, 0)),
                             cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
-                if text not in seen_qr and selected_track_id[0] is not None:
-                    payload = text.strip()
-                    user_id, user_name = payload, payload
-                    identity_map[selected_track_id[0]] = (user_id, user_name)
-                    on_identity_linked(selected_track_id[0], user_id, user_name)
-                    seen_qr.add(text)
+                if text not in self.seen_qr and self.selected_track_id is not None:
+                    self._link_identity(text)
 
         # draw markers
-        for (qx, qy) in clicked_points_qr:
+        for (qx, qy) in self.clicked_points_qr:
             cv2.circle(frame_qr, (qx, qy), 4, (0, 0, 255), -1)
             cv2.putText(frame_qr, f"({qx},{qy})", (qx + 5, qy - 5),
                         cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 255), 1)
-            
-        ok_a, frame_a = cap_table_a.read()
-        if ok_a:
-            res_a = item_model(
-                frame_a,
-                conf=0.30,
-                iou=0.45,
-                agnostic_nms=True,
-                verbose=False
-            )
-            frame_a_annot = res_a[0].plot(line_width=2, labels=True, conf=True)
-            cv2.imshow(table_a_win, frame_a_annot)
-        else:
-            placeholder = np.zeros((360, 480, 3), dtype=np.uint8)
-            cv2.putText(placeholder, "Table A cam read failed", (10, 30),
-                        cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 255), 2)
-            cv2.imshow(table_a_win, placeholder)
 
+        self.frame_qr = frame_qr
+
+    def read_tables(self) -> list[Frame]:
+        """
+        Grab a frame from every table camera. A frame that looks the same as the
+        last processed one is replaced by it, so its cached detections are reused.
+        """
+        frames = []
+        for zone, cap in self.table_caps.items():
+            ok, image = cap.read()
+            if not ok:
+                self.table_frames.pop(zone, None)
+                continue
+            frame = Frame(image)
+            prev = self.table_frames.get(zone)
+            if prev is not None and not frame.differs_from(prev):
+                frame = prev
+            self.table_frames[zone] = frame
+            self.evidence.push(self.zones[zone]["camera"], frame)
+            frames.append(frame)
+        return frames
+
+    def show(self):
+        names = self.models.item_model.names
+        for zone, win in self.table_wins.items():
+            frame = self.table_frames.get(zone)
+            if frame is None:
+                cv2.imshow(win, _placeholder(f"{zone} cam read failed"))
+                continue
+            annotated = frame.cached("annotated", lambda f: draw_records(
+                f.image.copy(), self.models.items_for(f), names))
+            cv2.imshow(win, annotated)
+
+        if self.frame_motion is not None:
+            cv2.imshow(self.motion_win, self.frame_motion)
+        if self.frame_qr is not None:
+            cv2.imshow(self.qr_win, self.frame_qr)
+
+    def close(self):
+        self.analytics.flush()
+        self._collect_invoices(self.invoices.close())
+        self.evidence.close()
+        self.cap_motion.release()
+        self.cap_qr.release()
+        for cap in self.table_caps.values():
+            cap.release()
+
+def run(sessions: list[StoreSession], models: SharedModels):
+    """
+    Drive all sessions in lockstep: one batched person-detection call and one
+    batched item-detection call per tick, shared across stores.
+    """
+    print("Running. In a motion window, click a person to select their track.\n"
+          "In a QR window, click to see (x,y). Press 'q' in any window to quit.")
 
-        # If/when you enable Table B:
-        # ok_b, frame_b = cap_table_b.read()
-        # if ok_b: cv2.imshow(table_b_win, frame_b)
-        cv2.imshow(motion_win, frame_motion)
-        cv2.imshow(qr_win, frame_qr)
+    while True:
+        frames = [s.read_motion() for s in sessions]
+        if any(f is None for f in frames):
+            break
+
+        for session, frame, result in zip(sessions, frames, models.detect_people(frames)):
+            session.process_motion(frame, result)
+
+        for session in sessions:
+            session.process_qr()
+
+        models.detect_items([f for s in sessions for f in s.read_tables()])
+
+        for session in sessions:
+            session.show()
 
         if (cv2.waitKey(1) & 0xFF) == ord('q'):
             break
 
-    cap_qr.release()
-    cap_table_a.release()
-    # cap_table_b.release()
-    cv2.destroyAllWindows()
+def main():
+    os.environ["ULTRALYTICS_LAP"] = "scipy"
+
+    # One config file per store (default: cameras.json / $CAMERA_CONFIG);
+    # models are loaded once, from the first store's config
+    configs = [load_config(p) for p in (sys.argv[1:] or [CONFIG_PATH])]
+    models = SharedModels(configs[0]["models"])
+    sessions = [StoreSession(cfg, models) for cfg in configs]
+
+    motion_shapes, table_shapes = [], []
+    for session, cfg in zip(sessions, configs):
+        m, t = session.warmup_shapes(cfg)
+        motion_shapes += m
+        table_shapes += t
+    models.warmup(motion_shapes, table_shapes)
+
+    try:
+        run(sessions, models)
+    finally:
+        for session in sessions:
+            session.close()
+        cv2.destroyAllWindows()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
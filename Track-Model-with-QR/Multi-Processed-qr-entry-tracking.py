@@ -3,16 +3,17 @@ import cv2
 import numpy as np
 from ultralytics import YOLO
 from collections import defaultdict
-from api import *
+from schemas import InvoiceItem, InvoiceCreate
 import requests
 from typing import List 
+from capture import load_config, open_camera
+from frame import Frame
+from detections import to_records, zone_rects, assign_zones, NO_ZONE
 
 INVOICE_API_URL = "http://127.0.0.1:8000/invoices"  # FastAPI endpoint
 
-
-MOTION_CAM_INDEX = 0        #YOLO tracking camera
-QR_CAM_INDEX = 1            #QR scanning camera
-MODEL_WEIGHTS = "yolov8n.pt"
+#cameras and weights come from cameras.json (or $CAMERA_CONFIG)
+CONFIG = load_config()
 PERSON_CLASS_ID = 0
 NEAR_MARGIN_PX = 30
 
@@ -21,6 +22,7 @@ TABLES = {
     "Table A": (125, 195, 175, 225),
     "Table B": (410, 225, 500, 250),
 }
+TABLE_NAMES, TABLE_RECTS = zone_rects(TABLES)
 
 # Optionally keep the "latest user" value even after they leave.
 CLEAR_LATEST_ON_EXIT = False
@@ -139,27 +141,6 @@ def on_person_left(track_id: int):
     last_zone.pop(track_id, None)
 
 
-def point_in_rect_with_margin(pt, rect, margin=0):
-    x, y = pt
-    x1, y1, x2, y2 = rect
-    return (x1 - margin) <= x <= (x2 + margin) and (y1 - margin) <= y <= (y2 + margin)
-
-def rect_center(rect):
-    x1, y1, x2, y2 = rect
-    return ((x1 + x2) // 2, (y1 + y2) // 2)
-
-def choose_zone_for_point(pt):
-    candidates = []
-    for name, rect in TABLES.items():
-        if point_in_rect_with_margin(pt, rect, NEAR_MARGIN_PX):
-            cx, cy = rect_center(rect)
-            dist2 = (pt[0] - cx) ** 2 + (pt[1] - cy) ** 2
-            candidates.append((dist2, name))
-    if not candidates:
-        return None
-    candidates.sort(key=lambda t: t[0])
-    return candidates[0][1]
-
 # ---- OpenCV QR helpers (version-safe)
 def decode_multi(detector, frame):
     out = detector.detectAndDecodeMulti(frame)
@@ -230,10 +211,8 @@ def mouse_motion_factory(current_tracks_ref):
 def main():
     os.environ["ULTRALYTICS_LAP"] = "scipy"
 
-    #prrepare QR camera (1)
-    cap_qr = cv2.VideoCapture(QR_CAM_INDEX, cv2.CAP_DSHOW)
-    if not cap_qr.isOpened():
-        raise RuntimeError("Could not open QR camera (index 1).")
+    #prepare QR camera
+    cap_qr = open_camera("qr", CONFIG["cameras"]["qr"])
 
     #prepare windows
     motion_win = "Proximity Tracker (click to select track, q to quit)"
@@ -255,16 +234,9 @@ def main():
     
     cv2.setMouseCallback(motion_win, mouse_motion_factory(get_current_tracks))
 
-    #YOLO model & stream from motion cam (0)
-    model = YOLO(MODEL_WEIGHTS)
-    results_stream = model.track(
-        source=MOTION_CAM_INDEX,
-        stream=True,
-        persist=True,
-        classes=[PERSON_CLASS_ID],
-        tracker="bytetrack.yaml",
-        verbose=False
-    )
+    #YOLO model & motion camera, fed frame by frame through the capture backend
+    model = YOLO(CONFIG["models"]["tracker"])
+    cap_motion = open_camera("motion", CONFIG["cameras"]["motion"])
 
     detector = cv2.QRCodeDetector()
     seen_qr = set()  #avoid spamming duplicates
@@ -272,9 +244,22 @@ def main():
     print("Running. In the motion window, click a person to select their track.\n"
           "In the QR window, click to see (x,y). Press 'q' in any window to quit.")
 
-    for result in results_stream:
-        # motion (cam 0) 
-        frame_motion = result.orig_img 
+    while True:
+        ok_motion, frame = cap_motion.read()
+        if not ok_motion:
+            print("[motion] Frame grab failed; exiting.")
+            break
+
+        result = model.track(
+            frame,
+            persist=True,
+            classes=[PERSON_CLASS_ID],
+            tracker="bytetrack.yaml",
+            verbose=False
+        )[0]
+
+        # motion
+        frame_motion = frame
         h0, w0 = frame_motion.shape[:2]
         current_tracks.clear()
 
@@ -286,44 +271,38 @@ def main():
             cv2.putText(frame_motion, name, (x1, max(20, y1 - 8)),
                         cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2, cv2.LINE_AA)
 
-        boxes = result.boxes
-        if boxes is not None and boxes.id is not None:
-            ids = boxes.id.cpu().numpy().astype(int)
-            xyxy = boxes.xyxy.cpu().numpy().astype(int)
-            cls = boxes.cls.cpu().numpy().astype(int)
-
-            for i, box in enumerate(xyxy):
-                if cls[i] != PERSON_CLASS_ID:
-                    continue
-                track_id = int(ids[i])
-                x1, y1, x2, y2 = box
-                cx = (x1 + x2) // 2
-                cy = (y1 + y2) // 2
-
-                current_tracks.append((track_id, cx, cy, (x1, y1, x2, y2)))
-
-                zone = choose_zone_for_point((cx, cy))
-                if zone != last_zone[track_id]:
-                    on_zone_change(track_id, zone, last_zone[track_id])
-                    last_zone[track_id] = zone
-
-                # draw bbox
-                color = (255, 255, 255)
-                if selected_track_id[0] == track_id:
-                    color = (0, 255, 255) 
-                cv2.rectangle(frame_motion, (x1, y1), (x2, y2), color, 2)
-
-                # label show linked identity
-                if track_id in identity_map:
-                    user_id, user_name = identity_map[track_id]
-                    id_text = f"{user_name} ({user_id})"
-                else:
-                    id_text = f"ID {track_id}"
-                label = f"{id_text} | {zone or 'No table'}"
-                cv2.putText(frame_motion, label, (x1, max(20, y1 - 8)),
-                            cv2.FONT_HERSHEY_SIMPLEX, 0.65, color, 2, cv2.LINE_AA)
-
-                cv2.circle(frame_motion, (cx, cy), 4, color, -1)
+        # one transfer for all boxes, then keep tracked persons only
+        recs = to_records(result)
+        recs = recs[(recs["cls"] == PERSON_CLASS_ID) & (recs["id"] >= 0)]
+        zone_idx = assign_zones(recs["center"], TABLE_RECTS, NEAR_MARGIN_PX)
+
+        for track_id, (x1, y1, x2, y2), (cx, cy), zi in zip(
+                recs["id"].tolist(), recs["xyxy"].tolist(),
+                recs["center"].tolist(), zone_idx.tolist()):
+            current_tracks.append((track_id, cx, cy, (x1, y1, x2, y2)))
+
+            zone = TABLE_NAMES[zi] if zi != NO_ZONE else None
+            if zone != last_zone[track_id]:
+                on_zone_change(track_id, zone, last_zone[track_id])
+                last_zone[track_id] = zone
+
+            # draw bbox
+            color = (255, 255, 255)
+            if selected_track_id[0] == track_id:
+                color = (0, 255, 255) 
+            cv2.rectangle(frame_motion, (x1, y1), (x2, y2), color, 2)
+
+            # label show linked identity
+            if track_id in identity_map:
+                user_id, user_name = identity_map[track_id]
+                id_text = f"{user_name} ({user_id})"
+            else:
+                id_text = f"ID {track_id}"
+            label = f"{id_text} | {zone or 'No table'}"
+            cv2.putText(frame_motion, label, (x1, max(20, y1 - 8)),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.65, color, 2, cv2.LINE_AA)
+
+            cv2.circle(frame_motion, (cx, cy), 4, color, -1)
 
         # QR (cam 1)
         ok_qr, frame_qr = cap_qr.read()
@@ -333,8 +312,10 @@ def main():
             cv2.putText(frame_qr, "QR cam read failed", (10, 30),
                         cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 255), 2)
 
-        #decode multi first
-        success, decoded_info, pts_list = decode_multi(detector, frame_qr)
+        qr_frame = Frame(frame_qr)
+
+        #decode multi first (shared gray view; drawing stays on BGR)
+        success, decoded_info, pts_list = decode_multi(detector, qr_frame.gray)
         if success:
             for text, pts in zip(decoded_info, pts_list):
                 if pts is None:
@@ -355,7 +336,7 @@ def main():
                         on_identity_linked(selected_track_id[0], user_id, user_name)
                         seen_qr.add(text)
         else:
-            text, pts = decode_single(detector, frame_qr)
+            text, pts = decode_single(detector, qr_frame.gray)
             if pts is not None and text:
                 pts = pts.astype(int).reshape(-1, 2)
                 for i in range(len(pts)):
@@ -382,6 +363,7 @@ def main():
         if (cv2.waitKey(1) & 0xFF) == ord('q'):
             break
 
+    cap_motion.release()
     cap_qr.release()
     cv2.destroyAllWindows()
 
@@ -0,0 +1,120 @@
+import os
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+
+from supabase import POOL_MAX
+
+ADMISSION_LIMIT = int(os.getenv("ADMISSION_LIMIT", str(POOL_MAX)))        # requests running at once
+ADMISSION_QUEUE_MAX = int(os.getenv("ADMISSION_QUEUE_MAX", str(POOL_MAX * 4)))  # waiting beyond that
+ADMISSION_WAIT_S = float(os.getenv("ADMISSION_WAIT_S", "2"))   # longest a request waits for a slot
+ADMISSION_RETRY_AFTER_S = 1    # Retry-After sent with a 503
+
+WRITE, READ = "write", "read"
+
+
+class Overloaded(Exception):
+    """
+    Raised by AdmissionLimiter.admit() when a request is shed.
+    """
+
+    def __init__(self, reason: str, retry_after_s: int = ADMISSION_RETRY_AFTER_S):
+        super().__init__(reason)
+        self.retry_after_s = retry_after_s
+
+
+class AdmissionLimiter:
+    """
+    Bounds how many requests touch the database at once. At most `limit`
+    run (sized to the connection pool, so admitted requests never wait on
+    the pool); up to `queue_max` more wait at most `wait_s` for a slot, and
+    anything beyond that is shed at once instead of piling up until every
+    request times out together.
+
+    Writes (invoices) go first: a freed slot is handed to the oldest waiting
+    write before any read, and a write arriving at a full queue displaces the
+    newest waiting read.
+    """
+
+    def __init__(self, limit: int = ADMISSION_LIMIT, queue_max: int = ADMISSION_QUEUE_MAX,
+                 wait_s: float = ADMISSION_WAIT_S):
+        self.limit = limit
+        self.queue_max = queue_max
+        self.wait_s = wait_s
+        self._active = 0
+        self._waiters = {WRITE: deque(), READ: deque()}
+        self._counts = {k: {"admitted": 0, "queued": 0, "shed_full": 0, "shed_timeout": 0}
+                        for k in (WRITE, READ)}
+
+    @asynccontextmanager
+    async def admit(self, kind: str):
+        """
+        async with limiter.admit(WRITE): ...   # raises Overloaded if shed
+        """
+        await self._acquire(kind)
+        try:
+            yield
+        finally:
+            self._release()
+
+    def stats(self) -> dict:
+        return {
+            "limit": self.limit,
+            "queue_max": self.queue_max,
+            "active": self._active,
+            "waiting": {k: len(q) for k, q in self._waiters.items()},
+            **{k: dict(c) for k, c in self._counts.items()},
+        }
+
+    async def _acquire(self, kind: str):
+        counts = self._counts[kind]
+        waiting = len(self._waiters[WRITE]) + len(self._waiters[READ])
+        # Reads may not overtake queued writes; writes only wait behind writes
+        ahead = len(self._waiters[WRITE]) if kind == WRITE else waiting
+        if self._active < self.limit and not ahead:
+            self._active += 1
+            counts["admitted"] += 1
+            return
+
+        if waiting >= self.queue_max:
+            if kind == READ or not self._waiters[READ]:
+                counts["shed_full"] += 1
+                raise Overloaded("Server busy; queue full")
+            bumped = self._waiters[READ].pop()
+            bumped.set_exception(Overloaded("Server busy; displaced by a write"))
+            self._counts[READ]["shed_full"] += 1
+
+        fut = asyncio.get_running_loop().create_future()
+        self._waiters[kind].append(fut)
+        counts["queued"] += 1
+        try:
+            # shield: a timeout must not cancel a slot that was handed over meanwhile
+            await asyncio.wait_for(asyncio.shield(fut), self.wait_s)
+        except Overloaded:
+            raise
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if fut.done() and not fut.cancelled() and fut.exception() is None:
+                self._release()  # the slot arrived as we gave up; pass it on
+            else:
+                fut.cancel()
+                try:
+                    self._waiters[kind].remove(fut)
+                except ValueError:
+                    pass
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            counts["shed_timeout"] += 1
+            raise Overloaded(f"Server busy; no slot within {self.wait_s:.1f}s")
+        counts["admitted"] += 1
+
+    def _release(self):
+        # Hand the slot straight to the next waiter (writes first) so a newcomer
+        # cannot grab it between release and wake-up
+        for kind in (WRITE, READ):
+            q = self._waiters[kind]
+            while q:
+                fut = q.popleft()
+                if not fut.done():
+                    fut.set_result(None)
+                    return
+        self._active -= 1
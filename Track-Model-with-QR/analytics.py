@@ -0,0 +1,151 @@
+import os
+import time
+import json
+from pathlib import Path
+
+import numpy as np
+
+from detections import NO_ZONE
+
+ANALYTICS_DIR = os.getenv("ANALYTICS_DIR", str(Path(__file__).with_name("analytics")))
+HEATMAP_CELL_PX = 16        # one heatmap cell per 16x16 pixel block
+FLUSH_INTERVAL_S = 300      # write a snapshot every 5 minutes
+# Upper edges (seconds) of the dwell histogram bins; last bin is open-ended
+DWELL_BIN_EDGES_S = np.array([2, 5, 10, 20, 30, 60, 120, 300], dtype=np.float64)
+
+
+class StoreAnalytics:
+    """
+    Incremental store-layout analytics built from the tracker's per-frame output:
+    - occupancy heatmap of track centers on a downsampled grid
+    - per-zone visit counts, occupied seconds and dwell-time histograms
+    Accumulators cover one window and are written out and reset on flush,
+    so no raw video or per-frame history is kept. Each store writes to its
+    own subdirectory of out_dir.
+    """
+
+    def __init__(self, store: str, zone_names: list[str], out_dir: str = ANALYTICS_DIR,
+                 cell_px: int = HEATMAP_CELL_PX, flush_interval_s: float = FLUSH_INTERVAL_S):
+        self.store = store
+        self.zone_names = list(zone_names)
+        self.out_dir = Path(out_dir) / store.replace(" ", "_")
+        self.cell_px = cell_px
+        self.flush_interval_s = flush_interval_s
+
+        self.heatmap = None  # allocated on first frame, once the frame size is known
+        n = len(self.zone_names)
+        self.visits = np.zeros(n, dtype=np.int64)
+        self.occupied_s = np.zeros(n, dtype=np.float64)
+        self.dwell_hist = np.zeros((n, len(DWELL_BIN_EDGES_S) + 1), dtype=np.int64)
+
+        self._open = {}  # track_id -> (zone index, time entered)
+        self._last_ts = None
+        self._window_start = time.time()
+        self._next_flush = self._window_start + flush_interval_s
+
+    def update(self, ids: np.ndarray, centers: np.ndarray, zone_idx: np.ndarray,
+               frame_shape: tuple, ts: float | None = None):
+        """
+        Add one frame of tracks: ids (N,), centers (N, 2) in pixels, zone_idx (N,)
+        as returned by detections.assign_zones.
+        """
+        ts = time.time() if ts is None else ts
+        if self.heatmap is None:
+            h, w = frame_shape[:2]
+            self.heatmap = np.zeros((-(-h // self.cell_px), -(-w // self.cell_px)), dtype=np.uint32)
+
+        if len(centers):
+            gh, gw = self.heatmap.shape
+            cells = centers // self.cell_px
+            rows = np.clip(cells[:, 1], 0, gh - 1)
+            cols = np.clip(cells[:, 0], 0, gw - 1)
+            np.add.at(self.heatmap, (rows, cols), 1)
+
+            # every track in a zone accrues the time since the previous frame
+            if self._last_ts is not None:
+                in_zone = zone_idx[zone_idx != NO_ZONE]
+                self.occupied_s += np.bincount(in_zone, minlength=len(self.zone_names)) * (ts - self._last_ts)
+
+        for tid, zi in zip(ids.tolist(), zone_idx.tolist()):
+            cur = self._open.get(tid)
+            if cur is not None and cur[0] == zi:
+                continue
+            if cur is not None:
+                self._close(tid, ts)
+            if zi != NO_ZONE:
+                self._open[tid] = (zi, ts)
+                self.visits[zi] += 1
+
+        self._last_ts = ts
+        if ts >= self._next_flush:
+            self.flush(ts)
+
+    def _close(self, track_id: int, ts: float):
+        zi, entered = self._open.pop(track_id)
+        b = np.searchsorted(DWELL_BIN_EDGES_S, ts - entered, side="right")
+        self.dwell_hist[zi, b] += 1
+
+    def close_track(self, track_id: int, ts: float | None = None):
+        """
+        Finish any open visit for a track that left the frame.
+        """
+        if track_id in self._open:
+            self._close(track_id, time.time() if ts is None else ts)
+
+    def snapshot(self) -> dict:
+        """
+        Compact summary of the current window (heatmap as a nested list).
+        """
+        return {
+            "window_start": self._window_start,
+            "window_end": self._last_ts or self._window_start,
+            "cell_px": self.cell_px,
+            "zones": self.zone_names,
+            "visits": self.visits.tolist(),
+            "occupied_s": self.occupied_s.round(1).tolist(),
+            "dwell_bin_edges_s": DWELL_BIN_EDGES_S.tolist(),
+            "dwell_hist": self.dwell_hist.tolist(),
+            "heatmap": self.heatmap.tolist() if self.heatmap is not None else [],
+        }
+
+    def flush(self, ts: float | None = None) -> Path | None:
+        """
+        Write the current window to out_dir as a compressed .npz (arrays) and
+        reset the accumulators. Open visits carry over into the next window.
+        """
+        ts = time.time() if ts is None else ts
+        # on failure the window keeps accumulating and is retried next interval
+        self._next_flush = ts + self.flush_interval_s
+        if self.heatmap is None:
+            self._window_start = ts
+            return None
+
+        path = self.out_dir / f"analytics_{int(self._window_start)}_{int(ts)}.npz"
+        try:
+            self.out_dir.mkdir(parents=True, exist_ok=True)
+            np.savez_compressed(
+                path,
+                heatmap=self.heatmap,
+                visits=self.visits,
+                occupied_s=self.occupied_s,
+                dwell_hist=self.dwell_hist,
+                dwell_bin_edges_s=DWELL_BIN_EDGES_S,
+                meta=np.array(json.dumps({
+                    "store": self.store,
+                    "window_start": self._window_start,
+                    "window_end": ts,
+                    "cell_px": self.cell_px,
+                    "zones": self.zone_names,
+                })),
+            )
+            print(f"[analytics] wrote {path.name} (visits={self.visits.tolist()})")
+        except Exception as e:
+            print(f"[analytics] Failed to write snapshot: {e}")
+            return None
+
+        self.heatmap[:] = 0
+        self.visits[:] = 0
+        self.occupied_s[:] = 0
+        self.dwell_hist[:] = 0
+        self._window_start = ts
+        return path
@@ -1,35 +1,225 @@
-from fastapi import FastAPI, HTTPException, Query
-from supabase import get_connection
-from pydantic import BaseModel, Field, constr
-from typing import List
-from psycopg2.extras import Json
-from datetime import datetime
+import os
+import time
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Query, Request, Response, Header
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse
+from supabase import open_async_pool, close_async_pool, async_connection, read_connection, note_write, replica_status
+from schemas import InvoiceCreate, InvoiceBatch
+from catalog import ProductCatalog
+from feed import InvoiceFeed
+from admission import AdmissionLimiter, Overloaded, WRITE, READ
+from psycopg import sql
+from psycopg.rows import dict_row
+from psycopg.types.json import Jsonb
+from datetime import datetime, date
+from decimal import Decimal
+import json
+import uuid
+
+
+catalog = ProductCatalog()
+invoice_feed = InvoiceFeed()
+admission = AdmissionLimiter()
+
+# Fixed until branches/payments are sent by the vision nodes
+BRANCH_ID = "130df862-b9e2-4233-8d67-d87a3d3b8323"
+PAYMENT_ID = "2067d440-e179-4d2a-a0bd-6a1c7cd18a86"
+INVOICE_COLUMNS = "id, user_id, branch_id, payment_id, timestamp, total_amount, products_and_quantities, status, idempotency_key"
+
+# Columns /users may return; password is deliberately not one of them
+USER_FIELDS = ["id", "email", "phone", "is_admin", "num_visits", "owed_balance", "first_name", "last_name", "city"]
+USERS_PAGE_MAX = 1000
+USERS_STREAM_BATCH = 500    # rows per server-side cursor fetch when streaming
+# History rows hold only columns covered by invoices_user_ts_idx (sql/004) so
+# the page is an index-only scan; ?items=true adds the JSONB (heap fetch)
+INVOICE_HISTORY_COLUMNS = 'id, "timestamp", total_amount, status, branch_id'
+INVOICE_HISTORY_MAX = 100
+# GET /stats/revenue: ?group_by= names -> revenue_daily columns (sql/005)
+REVENUE_DIMENSIONS = {"day": "day", "branch": "branch_id", "status": "status"}
+# GET /stats/products: ?group_by= -> expression over invoice_lines l / products p (sql/006)
+PRODUCT_DIMENSIONS = {
+    "product": ["l.product_id", "p.name"],
+    "shelf": ["p.shelf"],
+    "category": ["p.category"],
+}
+PRODUCT_ORDER = {"units": "units", "revenue": "revenue"}
+STATS_CACHE_TTL_S = float(os.getenv("STATS_CACHE_TTL_S", "30"))
+LOW_STOCK_THRESHOLD = int(os.getenv("LOW_STOCK_THRESHOLD", "5"))  # stock at or below this is reported
+STATS_CACHE_MAX = 256
+# Browser origins allowed to call the routes in CORS_PATHS (comma-separated);
+# the default is the dashboard as served locally (README: http.server / Live Server)
+CORS_ORIGINS = [o.strip() for o in os.getenv(
+    "CORS_ORIGINS", "http://localhost:5500,http://127.0.0.1:5500").split(",") if o.strip()]
+CORS_PATHS = ("/stats/", "/invoices/stream")   # all the dashboard calls from the browser
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await open_async_pool()
+    await catalog.start()
+    await invoice_feed.start()
+    yield
+    await invoice_feed.stop()
+    await catalog.stop()
+    await close_async_pool()
+
+app = FastAPI(lifespan=lifespan)
+
+
+def _admission_kind(request: Request) -> str | None:
+    """
+    WRITE / READ for routes that need a database connection; None for the
+    ones served from memory (products, class maps, status, the invoice feed).
+    """
+    path = request.url.path
+    if request.method == "POST" and path.startswith("/invoices"):
+        return WRITE
+    if request.method == "GET" and path.startswith(("/users", "/stats/")):
+        return READ
+    return None
+
+
+class AdmissionControl:
+    """
+    Plain ASGI rather than @app.middleware("http"): there call_next() returns
+    once the headers are out, so a streamed body (/users?stream=true keeps its
+    pool connection until the last row) would run after its slot was freed.
+    Here the slot is held until the whole response has been sent.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        kind = _admission_kind(Request(scope)) if scope["type"] == "http" else None
+        if kind is None:
+            await self.app(scope, receive, send)
+            return
+        try:
+            async with admission.admit(kind):
+                await self.app(scope, receive, send)
+        except Overloaded as e:
+            response = JSONResponse({"detail": str(e)}, status_code=503,
+                                    headers={"Retry-After": str(e.retry_after_s)})
+            await response(scope, receive, send)
+
+
+app.add_middleware(AdmissionControl)
+
+
+# Added last, so it wraps admission control and 503s carry CORS headers too
+class DashboardCORS:
+    """
+    CORSMiddleware for CORS_PATHS only: the admin dashboard reads /stats and
+    the invoice stream from the browser, while users and invoice creation stay
+    closed to cross-origin pages.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.cors = CORSMiddleware(
+            app,
+            allow_origins=CORS_ORIGINS,
+            allow_credentials=False,
+            allow_methods=["GET"],
+            allow_headers=["Last-Event-ID"],
+        )
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"].startswith(CORS_PATHS):
+            await self.cors(scope, receive, send)
+        else:
+            await self.app(scope, receive, send)
+
+
+app.add_middleware(DashboardCORS)
+
+def _json_default(o):
+    if isinstance(o, Decimal):
+        return float(o)
+    if isinstance(o, (uuid.UUID, datetime)):
+        return str(o)
+    raise TypeError(f"{type(o).__name__} is not JSON serializable")
+
+
+def _user_fields(fields: str | None) -> list[str]:
+    if not fields:
+        return USER_FIELDS
+    wanted = [f.strip() for f in fields.split(",") if f.strip()]
+    unknown = [f for f in wanted if f not in USER_FIELDS]
+    if unknown:
+        raise HTTPException(status_code=422, detail=f"Unknown fields: {', '.join(unknown)}")
+    # id is always returned: it is the pagination cursor
+    return ["id"] + [f for f in wanted if f != "id"]
+
+
+def _users_query(cols: list[str], after: uuid.UUID | None, limit: int | None) -> tuple[sql.Composed, list]:
+    query = sql.SQL("SELECT {} FROM users").format(sql.SQL(", ").join(map(sql.Identifier, cols)))
+    params = []
+    if after is not None:
+        query += sql.SQL(" WHERE id > %s")
+        params.append(after)
+    query += sql.SQL(" ORDER BY id")
+    if limit is not None:
+        query += sql.SQL(" LIMIT %s")
+        params.append(limit)
+    return query, params
 
-app = FastAPI()
 
 @app.get("/users")
-def get_all_users():
+async def get_all_users(
+    after: uuid.UUID | None = None,
+    limit: int = Query(100, ge=1, le=USERS_PAGE_MAX),
+    fields: str | None = Query(None, description="comma-separated subset of USER_FIELDS"),
+    stream: bool = False,
+):
+    """
+    Users ordered by id, with keyset pagination: pass the previous page's
+    next_after as ?after= to get the next one.
+    - fields: project only these columns (id is always included)
+    - stream=true: every user after ?after= as one JSON array, read through a
+      server-side cursor and written out batch by batch, so memory stays
+      bounded however many users there are (limit is ignored)
+    """
+    cols = _user_fields(fields)
+    if stream:
+        return StreamingResponse(_stream_users(cols, after), media_type="application/json")
     try:
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute("SELECT * FROM users;")
-        rows = cur.fetchall()
-        colnames = [desc[0] for desc in cur.description]
-        cur.close()
-        conn.close()
-        return [dict(zip(colnames, row)) for row in rows]
+        async with read_connection() as conn:
+            cur = conn.cursor(row_factory=dict_row)
+            await cur.execute(*_users_query(cols, after, limit))
+            rows = await cur.fetchall()
+        next_after = str(rows[-1]["id"]) if len(rows) == limit else None
+        return {"users": rows, "next_after": next_after}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+
+async def _stream_users(cols: list[str], after: uuid.UUID | None):
+    # Holds one pooled connection for as long as the client keeps reading
+    async with read_connection() as conn:
+        cur = conn.cursor(name="users_stream", row_factory=dict_row)
+        cur.itersize = USERS_STREAM_BATCH
+        await cur.execute(*_users_query(cols, after, None))
+        chunk, sep = ["["], ""
+        async for row in cur:
+            chunk.append(sep + json.dumps(row, default=_json_default, ensure_ascii=False))
+            sep = ","
+            if len(chunk) >= USERS_STREAM_BATCH:
+                yield "".join(chunk)
+                chunk = []
+        chunk.append("]")
+        yield "".join(chunk)
+        await cur.close()
+
+
 @app.get("/users/{user_id}/name")
-def get_first_name(user_id: str):
+async def get_first_name(user_id: str):
     try:
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute("SELECT first_name FROM users WHERE id = %s;", (user_id,))
-        row = cur.fetchone()
-        cur.close()
-        conn.close()
+        async with read_connection(user_id) as conn:
+            cur = await conn.execute("SELECT first_name FROM users WHERE id = %s;", (user_id,))
+            row = await cur.fetchone()
         if row:
             return {row[0]}
         else:
@@ -38,149 +228,647 @@ def get_first_name(user_id: str):
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.get("/products/{name}")
-def get_product_by_name(name: str):
+def _parse_history_cursor(before: str) -> tuple[datetime, uuid.UUID]:
+    try:
+        # an unencoded "+" in the UTC offset arrives as a space
+        ts, invoice_id = before.replace(" ", "+").rsplit("|", 1)
+        return datetime.fromisoformat(ts), uuid.UUID(invoice_id)
+    except ValueError:
+        raise HTTPException(status_code=422, detail="Invalid cursor")
+
+
+@app.get("/users/{user_id}/invoices")
+async def get_user_invoices(
+    user_id: uuid.UUID,
+    before: str | None = Query(None, description="next_before from the previous page"),
+    limit: int = Query(20, ge=1, le=INVOICE_HISTORY_MAX),
+    items: bool = False,
+):
     """
-    Retrieve a single product by its unique name.
+    A user's invoices, newest first, keyset-paginated on (timestamp, id)
+    along invoices_user_ts_idx. Pass next_before back as ?before= for the next page.
     """
     try:
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute(
-            """
-            SELECT id, name, price, shelf, category, calories
-            FROM products
-            WHERE name = %s
-            """,
-            (name,),
-        )
-        row = cur.fetchone()
-        cur.close()
-        conn.close()
+        cols = INVOICE_HISTORY_COLUMNS + (", products_and_quantities" if items else "")
+        query = f'SELECT {cols} FROM invoices WHERE user_id = %s'
+        params: list = [user_id]
+        if before:
+            # The plain "timestamp" bound is redundant with the row comparison but
+            # lets the planner skip the newer monthly partitions (sql/007)
+            before_ts, before_id = _parse_history_cursor(before)
+            query += ' AND "timestamp" <= %s AND ("timestamp", id) < (%s, %s)'
+            params += [before_ts, before_ts, before_id]
+        query += ' ORDER BY "timestamp" DESC, id DESC LIMIT %s;'
+        params.append(limit)
+
+        async with read_connection(user_id) as conn:
+            cur = conn.cursor(row_factory=dict_row)
+            await cur.execute(query, params)
+            rows = await cur.fetchall()
+
+        next_before = None
+        if len(rows) == limit:
+            last = rows[-1]
+            next_before = f"{last['timestamp'].isoformat()}|{last['id']}"
+        return {"invoices": rows, "next_before": next_before}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 
-        if not row:
+@app.get("/users/{user_id}/summary")
+async def get_user_summary(user_id: uuid.UUID):
+    """
+    Invoice count, lifetime spend and first/last visit for a user: one
+    primary-key read of user_invoice_summary (kept by trigger, see sql/004).
+    """
+    try:
+        async with read_connection(user_id) as conn:
+            cur = conn.cursor(row_factory=dict_row)
+            await cur.execute(
+                """
+                SELECT invoice_count, lifetime_spend, first_visit, last_visit
+                FROM user_invoice_summary
+                WHERE user_id = %s;
+                """,
+                (user_id,),
+            )
+            row = await cur.fetchone()
+        summary = row or {"invoice_count": 0, "lifetime_spend": 0, "first_visit": None, "last_visit": None}
+        return {"user_id": user_id, **summary}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/products/{name}")
+async def get_product_by_name(name: str):
+    """
+    Retrieve a single product by its unique name (served from the catalog cache).
+    """
+    try:
+        product = await catalog.by_name(name)
+        if not product:
             raise HTTPException(status_code=404, detail="Product not found")
+        return product
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 
-        colnames = ["id", "name", "price", "shelf", "category", "calories"]
-        return dict(zip(colnames, row))
+@app.get("/catalog/classes")
+async def get_class_map(model: str, if_none_match: str | None = Header(default=None)):
+    """
+    Detector class -> product map for one item model (weights file name):
+    {"model", "version", "columns", "classes": [[class_index, class_name,
+    product_id, price, display_name], ...]}. Vision nodes cache it and send
+    If-None-Match: <version> to get a 304 when nothing changed.
+    """
+    try:
+        payload = await catalog.class_map(model)
+        if payload is None:
+            raise HTTPException(status_code=404, detail=f"No class map for model {model}")
+        etag = f'"{payload["version"]}"'
+        if if_none_match in (etag, payload["version"]):
+            return Response(status_code=304, headers={"ETag": etag})
+        return JSONResponse(payload, headers={"ETag": etag})
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.get("/db/status")
+async def get_db_status():
+    """
+    Read routing state (replica lag as last sampled, and how many reads went
+    to the replica vs. the primary, and why) and admission control counters
+    (running / waiting now; admitted, queued and shed so far, per kind),
+    and the invoice feed (connected clients, events fanned out so far).
+    """
+    return {"replica": replica_status(), "admission": admission.stats(), "feed": invoice_feed.stats()}
+
+
+# =========================
+# Dashboard stats
+# =========================
+_stats_cache: dict[tuple, tuple[float, dict]] = {}  # key -> (expires_at, result)
+
+
+def _stats_cached(key: tuple) -> dict | None:
+    hit = _stats_cache.get(key)
+    return hit[1] if hit and hit[0] > time.monotonic() else None
+
+
+def _stats_store(key: tuple, result: dict) -> dict:
+    now = time.monotonic()
+    if len(_stats_cache) >= STATS_CACHE_MAX:
+        for k in [k for k, (exp, _) in _stats_cache.items() if exp <= now] or list(_stats_cache)[:1]:
+            del _stats_cache[k]
+    _stats_cache[key] = (now + STATS_CACHE_TTL_S, result)
+    return result
+
+
+@app.get("/stats/revenue")
+async def get_revenue_stats(
+    start: date | None = None,
+    end: date | None = None,
+    group_by: str = Query("day", description="comma-separated: day, branch, status; empty = totals only"),
+    status: str | None = Query(None, description="comma-separated statuses to include"),
+):
+    """
+    Revenue, order count and average order value from the revenue_daily
+    rollup (sql/005), so the cost depends on days x branches x statuses and
+    not on how many invoices exist. Results are cached for STATS_CACHE_TTL_S.
+    """
+    dims = [d.strip() for d in group_by.split(",") if d.strip()]
+    unknown = [d for d in dims if d not in REVENUE_DIMENSIONS]
+    if unknown:
+        raise HTTPException(status_code=422, detail=f"Unknown group_by: {', '.join(unknown)}")
+    statuses = sorted({x.strip() for x in status.split(",") if x.strip()}) if status else None
+
+    key = ("revenue", start, end, tuple(dims), tuple(statuses or ()))
+    hit = _stats_cached(key)
+    if hit is not None:
+        return hit
+
+    try:
+        cols = [sql.Identifier(REVENUE_DIMENSIONS[d]) for d in dims]
+        where, params = [], []
+        if start:
+            where.append(sql.SQL("day >= %s"))
+            params.append(start)
+        if end:
+            where.append(sql.SQL("day <= %s"))
+            params.append(end)
+        if statuses:
+            where.append(sql.SQL("status = ANY(%s)"))
+            params.append(statuses)
+
+        query = sql.SQL("SELECT {}sum(revenue) AS revenue, sum(orders) AS orders FROM revenue_daily").format(
+            sql.SQL("").join(c + sql.SQL(", ") for c in cols))
+        if where:
+            query += sql.SQL(" WHERE ") + sql.SQL(" AND ").join(where)
+        if cols:
+            query += sql.SQL(" GROUP BY {0} ORDER BY {0}").format(sql.SQL(", ").join(cols))
+
+        async with read_connection() as conn:
+            cur = conn.cursor(row_factory=dict_row)
+            await cur.execute(query, params)
+            rows = await cur.fetchall()
+
+        total_revenue, total_orders = 0.0, 0
+        for r in rows:
+            r["revenue"] = float(r["revenue"] or 0)
+            r["orders"] = int(r["orders"] or 0)
+            r["aov"] = r["revenue"] / r["orders"] if r["orders"] else 0.0
+            total_revenue += r["revenue"]
+            total_orders += r["orders"]
+
+        result = {
+            "group_by": dims,
+            "rows": rows if dims else [],
+            "total": {
+                "revenue": total_revenue,
+                "orders": total_orders,
+                "aov": total_revenue / total_orders if total_orders else 0.0,
+            },
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    return _stats_store(key, result)
+
+
+@app.get("/stats/products")
+async def get_product_sales(
+    start: date | None = None,
+    end: date | None = None,
+    group_by: str = Query("product", description="product, shelf or category"),
+    order_by: str = Query("units", description="units or revenue"),
+    limit: int = Query(20, ge=1, le=500),
+):
+    """
+    Units sold, revenue and invoice count per product (or shelf / category)
+    from invoice_lines (sql/006). The date range is served by
+    invoice_lines_ts_idx; nothing reads the invoices JSONB.
+    Results are cached for STATS_CACHE_TTL_S.
+    """
+    if group_by not in PRODUCT_DIMENSIONS:
+        raise HTTPException(status_code=422, detail=f"Unknown group_by: {group_by}")
+    if order_by not in PRODUCT_ORDER:
+        raise HTTPException(status_code=422, detail=f"Unknown order_by: {order_by}")
+
+    key = ("products", start, end, group_by, order_by, limit)
+    hit = _stats_cached(key)
+    if hit is not None:
+        return hit
+
+    try:
+        dims = PRODUCT_DIMENSIONS[group_by]
+        where, params = [], []
+        if start:
+            where.append("l.invoice_ts >= %s")
+            params.append(start)
+        if end:
+            where.append("l.invoice_ts < %s::date + 1")
+            params.append(end)
+        params.append(limit)
+
+        query = f"""
+            SELECT {", ".join(dims)},
+                   sum(l.qty) AS units,
+                   sum(l.qty * l.unit_price) AS revenue,
+                   count(DISTINCT l.invoice_id) AS invoices
+            FROM invoice_lines l
+            LEFT JOIN products p ON p.id = l.product_id
+            {"WHERE " + " AND ".join(where) if where else ""}
+            GROUP BY {", ".join(dims)}
+            ORDER BY {PRODUCT_ORDER[order_by]} DESC
+            LIMIT %s;
+        """
+        async with read_connection() as conn:
+            cur = conn.cursor(row_factory=dict_row)
+            await cur.execute(query, params)
+            rows = await cur.fetchall()
+
+        for r in rows:
+            r["units"] = int(r["units"] or 0)
+            r["revenue"] = float(r["revenue"] or 0)
+        result = {"group_by": group_by, "order_by": order_by, "rows": rows}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    return _stats_store(key, result)
+
+
 # =========================
 # Invoices
 # =========================
-class InvoiceItem(BaseModel):
-    # Using product name as requested; quantity must be positive integer
-    name: constr(strip_whitespace=True, min_length=1)
-    quantity: int = Field(..., gt=0)
+async def _invoices_by_key(conn, keys: list[str]) -> dict[str, dict]:
+    """
+    Existing invoices for idempotency keys that were already claimed.
+    Runs as its own statement so it sees rows committed by a concurrent request.
+    """
+    cur = conn.cursor(row_factory=dict_row)
+    await cur.execute(
+        f"""
+        SELECT {INVOICE_COLUMNS}
+        FROM invoice_idempotency_keys k
+        JOIN invoices ON invoices.id = k.invoice_id AND invoices."timestamp" = k.invoice_ts
+        WHERE k.key = ANY(%s);
+        """,
+        (keys,),
+    )
+    return {row["idempotency_key"]: row for row in await cur.fetchall()}
 
 
-class InvoiceCreate(BaseModel):
-    user_id: constr(strip_whitespace=True, min_length=1)
-    items: List[InvoiceItem] = Field(..., min_items=1)
+# Decrement stock for the CTE `sold(product_id, qty)` (one row per product) in
+# one UPDATE. Rows are locked in product_id order first, so concurrent invoices
+# sharing products always take their locks in the same order and cannot deadlock.
+DECREMENT_INVENTORY_CTES = f"""
+locked AS (
+    SELECT i.product_id
+    FROM inventory i
+    JOIN sold s ON s.product_id = i.product_id
+    ORDER BY i.product_id
+    FOR UPDATE OF i
+),
+stock AS (
+    UPDATE inventory i
+    SET quantity = i.quantity - s.qty
+    FROM sold s
+    JOIN locked l ON l.product_id = s.product_id
+    WHERE i.product_id = s.product_id
+    RETURNING i.product_id, i.quantity
+),
+low_stock AS (
+    SELECT jsonb_agg(jsonb_build_object('product_id', product_id, 'quantity', quantity)
+                     ORDER BY product_id) AS items
+    FROM stock
+    WHERE quantity <= {LOW_STOCK_THRESHOLD}
+)"""
+
+# One round-trip: price the items against products, aggregate, claim the
+# idempotency key, insert, decrement inventory, and report missing products,
+# an already-used key or low stock, all in SQL. invoices is partitioned by
+# "timestamp" (sql/007), so keys live in invoice_idempotency_keys and point at
+# (id, timestamp); both are fixed up front in new_invoice.
+CREATE_INVOICE_SQL = f"""
+WITH req AS (
+    SELECT r.product_id, r.name, r.quantity, r.ord
+    FROM ROWS FROM (jsonb_to_recordset(%(items)s::jsonb) AS (product_id text, name text, quantity int))
+         WITH ORDINALITY AS r(product_id, name, quantity, ord)
+),
+resolved AS (
+    -- product_id from the class map when the client sent one, else look up by name
+    SELECT req.*, p.id AS pid, p.name AS pname, p.price
+    FROM req
+    LEFT JOIN products p
+      ON p.id = COALESCE(req.product_id, (SELECT n.id FROM products n WHERE n.name = req.name))
+),
+priced AS (
+    SELECT ord, pid AS product_id, pname AS name, quantity,
+           price AS unit_price, price * quantity AS line_total
+    FROM resolved
+    WHERE pid IS NOT NULL
+),
+missing AS (
+    SELECT array_agg(COALESCE(name, product_id) ORDER BY ord) AS names
+    FROM resolved
+    WHERE pid IS NULL
+),
+new_invoice AS (
+    SELECT gen_random_uuid() AS id, localtimestamp AS ts
+),
+claim AS (
+    INSERT INTO invoice_idempotency_keys (key, invoice_id, invoice_ts)
+    SELECT %(idempotency_key)s::text, n.id, n.ts
+    FROM new_invoice n
+    WHERE %(idempotency_key)s::text IS NOT NULL
+      AND EXISTS (SELECT 1 FROM priced) AND (SELECT names FROM missing) IS NULL
+    ON CONFLICT (key) DO NOTHING
+    RETURNING invoice_id
+),
+ins AS (
+    INSERT INTO invoices (id, "timestamp", user_id, branch_id, payment_id, total_amount,
+                          products_and_quantities, status, idempotency_key)
+    SELECT n.id, n.ts, %(user_id)s::uuid, %(branch_id)s::uuid, %(payment_id)s::uuid, sum(p.line_total),
+           jsonb_agg(jsonb_build_object(
+               'product_id', p.product_id, 'name', p.name, 'quantity', p.quantity,
+               'unit_price', p.unit_price, 'line_total', p.line_total) ORDER BY p.ord),
+           'paid', %(idempotency_key)s::text
+    FROM priced p
+    CROSS JOIN new_invoice n
+    GROUP BY n.id, n.ts
+    HAVING (SELECT names FROM missing) IS NULL
+       AND (%(idempotency_key)s::text IS NULL OR EXISTS (SELECT 1 FROM claim))
+    RETURNING {INVOICE_COLUMNS}
+),
+sold AS (
+    SELECT product_id, sum(quantity)::int AS qty
+    FROM priced
+    WHERE EXISTS (SELECT 1 FROM ins)    -- replays and rejected invoices sell nothing
+    GROUP BY product_id
+),{DECREMENT_INVENTORY_CTES}
+SELECT
+    (SELECT to_jsonb(ins) FROM ins) AS created,
+    (SELECT items FROM low_stock) AS low_stock,
+    (SELECT to_jsonb(i) FROM (
+        SELECT {INVOICE_COLUMNS}
+        FROM invoice_idempotency_keys k
+        JOIN invoices ON invoices.id = k.invoice_id AND invoices."timestamp" = k.invoice_ts
+        WHERE k.key = %(idempotency_key)s::text
+     ) i) AS existing,
+    (SELECT names FROM missing) AS missing,
+    (SELECT count(*) FROM priced) AS priced
+"""
+
+
+@app.get("/invoices/stream")
+async def stream_invoices(
+    user_id: uuid.UUID | None = None,
+    last_event_id: str | None = Header(None),
+):
+    """
+    Server-Sent Events: one `invoice` event per new invoice or status change
+    (sql/008_invoice_notify.sql), for every user or only ?user_id=.
+    On `resync` the client has missed events and should reload once.
+    Served from the shared listener, so it holds no pool connection.
+    """
+    return StreamingResponse(
+        invoice_feed.stream(str(user_id) if user_id else None, last_event_id),
+        media_type="text/event-stream",
+        # no-transform / X-Accel-Buffering: keep proxies from buffering the stream
+        headers={"Cache-Control": "no-cache, no-transform", "X-Accel-Buffering": "no"},
+    )
 
 
 @app.post("/invoices")
-def create_invoice(payload: InvoiceCreate):
+async def create_invoice(payload: InvoiceCreate, response: Response):
     """
-        Create an invoice:
-        - Looks up each product by name
-        - Computes line totals and overall total_amount
-        - Inserts a row into `invoices` with products_and_quantites (JSONB)
+        Create an invoice in a single round-trip (CREATE_INVOICE_SQL):
+        - Matches items to `products` by product_id (vision nodes send it from
+          GET /catalog/classes) or else by name, and computes line totals
+          and total_amount in SQL
+        - Builds products_and_quantites (JSONB) with jsonb_agg and inserts the row
+        - Reports unknown product names (404) instead of inserting
+        - Decrements inventory for every line in the same statement; products
+          left at or below LOW_STOCK_THRESHOLD come back in "low_stock"
+        - With an idempotency_key, a retry returns the original invoice
+          (header Idempotent-Replayed: true) instead of charging twice
 
         Table schema reminder:
         invoices(
             id, user_id, branch_id, payment_id, timestamp,
-            total_amount, products_and_quantites JSONB, status
+            total_amount, products_and_quantites JSONB, status, idempotency_key
         )
     """
     try:
-        conn = get_connection()
-        cur = conn.cursor()
-
-        # 1) Fetch product data for all requested names in one query
-        names = [it.name for it in payload.items]
-        cur.execute(
-            """
-            SELECT id, name, price
-            FROM products
-            WHERE name = ANY(%s)
-            """,
-            (names,),
-        )
-        rows = cur.fetchall()
-        if not rows:
-            cur.close()
-            conn.close()
-            raise HTTPException(status_code=404, detail="None of the products were found")
-
-        # Build a lookup: name -> (id, price)
-        found = {r[1]: {"id": r[0], "price": float(r[2])} for r in rows}
-
-        # Ensure all requested names exist
-        missing = [n for n in names if n not in found]
-        if missing:
-            cur.close()
-            conn.close()
-            raise HTTPException(
-                status_code=404,
-                detail=f"Products not found: {', '.join(missing)}"
+        # Canonical form, so the ownership check below compares like with like
+        user_id = str(uuid.UUID(payload.user_id))
+    except ValueError:
+        raise HTTPException(status_code=422, detail=f"Invalid user_id: {payload.user_id}")
+    try:
+        async with async_connection() as conn:
+            cur = conn.cursor(row_factory=dict_row)
+            await cur.execute(
+                CREATE_INVOICE_SQL,
+                {
+                    "items": Jsonb([it.model_dump() for it in payload.items]),
+                    "user_id": user_id,
+                    "branch_id": BRANCH_ID,
+                    "payment_id": PAYMENT_ID,
+                    "idempotency_key": payload.idempotency_key,
+                },
             )
+            out = await cur.fetchone()
 
-        # 2) Build products_and_quantites JSON structure & compute totals
-        items_detailed = []
-        total_amount = 0.0
-        for it in payload.items:
-            info = found[it.name]
-            line_total = info["price"] * it.quantity
-            total_amount += line_total
-            items_detailed.append({
-                "product_id": info["id"],
-                "name": it.name,
-                "quantity": it.quantity,
-                "unit_price": info["price"],
-                "line_total": line_total,
-            })
-        
-        # 3) Insert invoice
-        # payment_id left NULL here; timestamp assumed default NOW() in DB
-
-        status = "paid"
-
-        cur.execute(
-            """
-            INSERT INTO invoices (user_id, branch_id, payment_id, total_amount, products_and_quantities, status)
-            VALUES (%s, %s, %s, %s, %s, %s)
-            RETURNING id, user_id, branch_id, payment_id, timestamp, total_amount, products_and_quantities, status
-            """,
-            (
-                payload.user_id,
-                "130df862-b9e2-4233-8d67-d87a3d3b8323",
-                "2067d440-e179-4d2a-a0bd-6a1c7cd18a86",
-                total_amount,
-                Json(items_detailed),  # psycopg2 will cast to JSON/JSONB
-                status,
-            ),
-        )
-        created = cur.fetchone()
-        conn.commit()
-        cur.close()
-        conn.close()
+            if out["missing"]:
+                if not out["priced"]:
+                    raise HTTPException(status_code=404, detail="None of the products were found")
+                raise HTTPException(
+                    status_code=404,
+                    detail=f"Products not found: {', '.join(out['missing'])}"
+                )
+
+            created = out["created"]
+            if created is not None:
+                created["low_stock"] = out["low_stock"] or []
+                await note_write(conn, [user_id])  # their next reads see this invoice
+            else:
+                # Replay: the invoice the first request created. It is only invisible
+                # to the statement above if that request committed while it ran.
+                created = out["existing"] or (
+                    await _invoices_by_key(conn, [payload.idempotency_key])).get(payload.idempotency_key)
+                if created is None:
+                    raise HTTPException(status_code=409, detail="Idempotency key conflict; retry the request")
+                if str(created["user_id"]) != user_id:
+                    raise HTTPException(status_code=409, detail="Idempotency key already used for another user")
+                response.headers["Idempotent-Replayed"] = "true"
+            # commit happens when async_connection() exits cleanly; errors roll back
 
-        colnames = ["id", "user_id", "branch_id", "payment_id", "timestamp", "total_amount", "products_and_quantities", "status"]
-        return dict(zip(colnames, created))
+        return created
 
     except HTTPException:
         raise
     except Exception as e:
-        # rollback if something goes wrong after BEGIN (implicit)
-        try:
-            conn.rollback()
-        except Exception:
-            pass
+        print("Error:", e)
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/invoices/batch")
+async def create_invoices_batch(payload: InvoiceBatch):
+    """
+        Create many invoices at once:
+        - Resolves every item (by product_id, else name) to a product id from the
+          catalog cache; prices come from the products table inside the INSERT,
+          exactly as for POST /invoices
+        - Inserts all valid invoices with a single multi-row INSERT in one transaction
+        - Returns one result per input invoice, in order; an invoice with unknown
+          products or an unknown user fails on its own without failing the batch
+        - Invoices whose idempotency_key already exists (from an earlier request or
+          earlier in this batch) come back as "replayed" with the original row
+        - Inventory is decremented for all created invoices in the same statement;
+          products left at or below LOW_STOCK_THRESHOLD are listed in "low_stock"
+    """
+    try:
+        await catalog.ensure_fresh()
+
+        results: list[dict] = [None] * len(payload.invoices)
+        rows = []  # (index, id, user_id, items, idempotency_key)
+        for i, inv in enumerate(payload.invoices):
+            products = [catalog.lookup(it.name, it.product_id) for it in inv.items]
+            missing = [it.label for it, p in zip(inv.items, products) if p is None]
+            if missing:
+                results[i] = {"index": i, "status": "error", "status_code": 404,
+                              "detail": f"Products not found: {', '.join(missing)}"}
+                continue
+            try:
+                user_id = str(uuid.UUID(inv.user_id))
+            except ValueError:
+                results[i] = {"index": i, "status": "error", "status_code": 422,
+                              "detail": f"Invalid user_id: {inv.user_id}"}
+                continue
+            items = [{"product_id": p["id"], "quantity": it.quantity} for it, p in zip(inv.items, products)]
+            # ids are generated here so RETURNING rows can be matched back to inputs
+            rows.append((i, str(uuid.uuid4()), user_id, items, inv.idempotency_key))
+
+        created, existing, low_stock, unpriced = {}, {}, [], set()
+        if rows:
+            async with async_connection() as conn:
+                cur = conn.cursor(row_factory=dict_row)
+                # The join on users drops invoices for unknown users instead of
+                # failing the whole statement on the foreign key. Lines are priced
+                # from products here, like CREATE_INVOICE_SQL, so both endpoints
+                # charge the same; an invoice whose product has gone since the
+                # catalog lookup is left out and reported in `unpriced`. An invoice
+                # with a key is only inserted if this statement claimed the key
+                # (the first one wins when a key repeats within the batch).
+                # Inventory is decremented for the inserted invoices only, in the same statement
+                await cur.execute(
+                    f"""
+                    WITH input AS (
+                        SELECT r.*
+                        FROM unnest(%s::uuid[], %s::uuid[], %s::jsonb[], %s::text[])
+                             WITH ORDINALITY AS r(id, user_id, items, idempotency_key, ord)
+                        JOIN users u ON u.id = r.user_id
+                    ),
+                    priced AS (
+                        SELECT i.id,
+                               count(p.id) = count(*) AS complete,
+                               sum(p.price * e.quantity) AS total_amount,
+                               jsonb_agg(jsonb_build_object(
+                                   'product_id', p.id, 'name', p.name, 'quantity', e.quantity,
+                                   'unit_price', p.price, 'line_total', p.price * e.quantity) ORDER BY e.ord) AS items
+                        FROM input i
+                        CROSS JOIN LATERAL ROWS FROM (jsonb_to_recordset(i.items) AS (product_id text, quantity int))
+                             WITH ORDINALITY AS e(product_id, quantity, ord)
+                        LEFT JOIN products p ON p.id = e.product_id
+                        GROUP BY i.id
+                    ),
+                    req AS (
+                        SELECT i.id, i.user_id, i.idempotency_key, i.ord, pr.total_amount, pr.items,
+                               localtimestamp AS ts
+                        FROM input i
+                        JOIN priced pr ON pr.id = i.id AND pr.complete
+                    ),
+                    claim AS (
+                        INSERT INTO invoice_idempotency_keys (key, invoice_id, invoice_ts)
+                        SELECT idempotency_key, id, ts FROM req
+                        WHERE idempotency_key IS NOT NULL
+                        ORDER BY ord
+                        ON CONFLICT (key) DO NOTHING
+                        RETURNING invoice_id
+                    ),
+                    ins AS (
+                        INSERT INTO invoices (id, "timestamp", user_id, branch_id, payment_id, total_amount,
+                                              products_and_quantities, status, idempotency_key)
+                        SELECT r.id, r.ts, r.user_id, %s, %s, r.total_amount, r.items, 'paid', r.idempotency_key
+                        FROM req r
+                        WHERE r.idempotency_key IS NULL OR r.id IN (SELECT invoice_id FROM claim)
+                        RETURNING {INVOICE_COLUMNS}
+                    ),
+                    sold AS (
+                        SELECT e.item ->> 'product_id' AS product_id, sum((e.item ->> 'quantity')::int) AS qty
+                        FROM ins
+                        CROSS JOIN LATERAL jsonb_array_elements(ins.products_and_quantities) AS e(item)
+                        GROUP BY 1
+                    ),{DECREMENT_INVENTORY_CTES}
+                    -- one row even when nothing was inserted, to carry low_stock / unpriced
+                    SELECT ins.*, (SELECT items FROM low_stock) AS low_stock,
+                           (SELECT array_agg(id) FROM priced WHERE NOT complete) AS unpriced
+                    FROM (SELECT 1) AS one
+                    LEFT JOIN ins ON true
+                    """,
+                    (
+                        [r[1] for r in rows],
+                        [r[2] for r in rows],
+                        [Jsonb(r[3]) for r in rows],
+                        [r[4] for r in rows],
+                        BRANCH_ID,
+                        PAYMENT_ID,
+                    ),
+                )
+                created = {}
+                for row in await cur.fetchall():
+                    low_stock = row.pop("low_stock") or []
+                    unpriced = {str(u) for u in row.pop("unpriced") or []}
+                    if row["id"] is not None:
+                        created[str(row["id"])] = row
+
+                first_by_key = {r["idempotency_key"]: r for r in created.values() if r["idempotency_key"]}
+                unresolved = [r[4] for r in rows
+                              if r[4] and r[1] not in created and r[4] not in first_by_key]
+                existing = dict(first_by_key)
+                if unresolved:
+                    existing.update(await _invoices_by_key(conn, unresolved))
+                await note_write(conn, {r["user_id"] for r in created.values()})
+
+        for i, invoice_id, user_id, _, key in rows:
+            original = existing.get(key) if key else None
+            if invoice_id in created:
+                results[i] = {"index": i, "status": "created", "invoice": created[invoice_id]}
+            elif invoice_id in unpriced:
+                results[i] = {"index": i, "status": "error", "status_code": 404,
+                              "detail": "Products not found"}
+            elif original is not None and str(original["user_id"]) == user_id:
+                results[i] = {"index": i, "status": "replayed", "invoice": original}
+            elif original is not None:
+                results[i] = {"index": i, "status": "error", "status_code": 409,
+                              "detail": "Idempotency key already used for another user"}
+            else:
+                results[i] = {"index": i, "status": "error", "status_code": 404,
+                              "detail": "User not found"}
+
+        counts = {"created": 0, "replayed": 0, "error": 0}
+        for r in results:
+            counts[r["status"]] += 1
+        return {"created": counts["created"], "replayed": counts["replayed"],
+                "failed": counts["error"], "low_stock": low_stock, "results": results}
+
+    except Exception as e:
         print("Error:", e)
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -0,0 +1,285 @@
+"""
+Batch re-verification of disputed invoices from recorded video.
+
+Runs the same snapshot/missing-item logic as run_yolo.py / Full.py on recorded
+clips, one process per CPU core, and compares what was picked against the
+invoice's products_and_quantities by product_id (classes mapped through
+detector_classes).
+
+    python audit.py --open-tickets                  # every open ticket with evidence clips
+    python audit.py --manifest disputes.json        # explicit clips and timestamps
+
+Manifest format (timestamps are seconds into the clip; omitted = clip start / end):
+    [{"ticket_id": "...", "invoice_id": "...",
+      "clips": [{"path": "table_a.mp4", "before_s": 1.0, "after_s": 14.5}]}]
+"""
+import os
+import sys
+import json
+import argparse
+from pathlib import Path
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import cv2
+import numpy as np
+
+from capture import CameraConfig, load_config, open_camera
+from clips import EVIDENCE_DIR
+from detections import to_records, class_names, compute_missing
+from frame import Frame
+
+REPORT_DIR = os.getenv("AUDIT_REPORT_DIR", str(Path(__file__).with_name("audit_reports")))
+SAMPLES_PER_SNAPSHOT = 5    # frames averaged per snapshot to ride out occlusions
+SAMPLE_SPREAD_S = 0.5       # ... taken within this many seconds of the timestamp
+
+_model = None  # one item model per worker process
+
+
+def _init_worker(weights: str):
+    global _model
+    import torch
+    from ultralytics import YOLO
+    torch.set_num_threads(1)  # one core per worker; the pool provides the parallelism
+    _model = YOLO(weights)
+
+
+def _detect(image: np.ndarray) -> list[str]:
+    frame = Frame(image)
+    result = _model(frame.tensor(), conf=0.30, iou=0.45, agnostic_nms=True, verbose=False)[0]
+    return class_names(to_records(result, frame), _model.names)
+
+
+def snapshot_at(cap, t_s: float, direction: int, duration_s: float) -> list[str]:
+    """
+    Items visible around t_s. Samples frames stepping away from t_s (forward for
+    a baseline, backward for the final view) and keeps each class's median count.
+    """
+    offsets = np.linspace(0.0, SAMPLE_SPREAD_S, SAMPLES_PER_SNAPSHOT) * direction
+    counts = []
+    for t in np.clip(t_s + offsets, 0.0, max(duration_s - 0.05, 0.0)):
+        cap.set(cv2.CAP_PROP_POS_MSEC, float(t) * 1000.0)
+        ok, image = cap.read()
+        if ok:
+            counts.append(Counter(_detect(image)))
+    if not counts:
+        return []
+
+    names = set().union(*counts)
+    items = []
+    for name in sorted(names):
+        items += [name] * int(np.median([c[name] for c in counts]))
+    return items
+
+
+def audit_clip(clip: dict) -> dict:
+    """
+    Worker: items missing between the clip's before and after snapshots.
+    """
+    path = clip["path"]
+    cap = open_camera(Path(path).name, CameraConfig(source=path))
+    try:
+        fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+        duration_s = cap.get(cv2.CAP_PROP_FRAME_COUNT) / fps
+        before_s = clip.get("before_s", 0.0)
+        after_s = clip.get("after_s", duration_s)
+
+        baseline = snapshot_at(cap, before_s, +1, duration_s)
+        current = snapshot_at(cap, after_s, -1, duration_s)
+    finally:
+        cap.release()
+
+    return {
+        "path": path,
+        "before_s": before_s,
+        "after_s": after_s,
+        "baseline": baseline,
+        "current": current,
+        "picked": compute_missing(baseline, current),
+    }
+
+
+# ----------------------------
+# Job discovery
+# ----------------------------
+
+def _evidence_index(evidence_dir: str) -> dict[str, list[dict]]:
+    """
+    invoice_id -> table-camera clips, from the sidecars EvidenceRecorder writes.
+    The motion camera is skipped: items are only visible on table cameras.
+    """
+    index = {}
+    for meta_path in Path(evidence_dir).rglob("*.json"):
+        try:
+            meta = json.loads(meta_path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            continue
+        if meta.get("invoice_id") and meta.get("camera") != "motion":
+            index.setdefault(meta["invoice_id"], []).append(
+                {"path": str(meta_path.with_name(meta["video"]))})
+    return index
+
+
+def open_ticket_jobs(evidence_dir: str) -> list[dict]:
+    from supabase import get_connection
+
+    conn = get_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT id, invoice_id FROM tickets WHERE status = 'open';")
+        rows = cur.fetchall()
+        cur.close()
+    finally:
+        conn.close()
+
+    index = _evidence_index(evidence_dir)
+    return [
+        {"ticket_id": str(tid), "invoice_id": str(iid), "clips": index.get(str(iid), [])}
+        for tid, iid in rows
+    ]
+
+
+def fetch_invoiced(invoice_ids: list[str]) -> dict[str, Counter]:
+    """
+    invoice_id -> Counter of product_id -> quantity, in one query. Items saved
+    before vision nodes sent product IDs are resolved by product name.
+    """
+    from supabase import get_connection
+
+    if not invoice_ids:
+        return {}
+    conn = get_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute(
+            """
+            SELECT i.id, COALESCE(e.item ->> 'product_id', p.id, e.item ->> 'name'),
+                   COALESCE(e.item ->> 'quantity', e.item ->> 'qty', '0')::int
+            FROM invoices i
+            CROSS JOIN LATERAL jsonb_array_elements(
+                CASE WHEN jsonb_typeof(i.products_and_quantities) = 'array'
+                     THEN i.products_and_quantities ELSE '[]'::jsonb END) AS e(item)
+            LEFT JOIN products p ON e.item ->> 'product_id' IS NULL AND p.name = e.item ->> 'name'
+            WHERE i.id::text = ANY(%s);
+            """,
+            (invoice_ids,),
+        )
+        rows = cur.fetchall()
+        cur.close()
+    finally:
+        conn.close()
+
+    invoiced = {iid: Counter() for iid in invoice_ids}
+    for iid, product_id, qty in rows:
+        invoiced[str(iid)][product_id] += qty
+    return invoiced
+
+
+def fetch_class_products(model: str) -> dict[str, str]:
+    """
+    class name -> product_id for one item model, from detector_classes (the
+    map vision nodes build carts with, see class_map.py).
+    """
+    from supabase import get_connection
+
+    conn = get_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute(
+            "SELECT class_name, product_id FROM detector_classes "
+            "WHERE model = %s AND product_id IS NOT NULL;",
+            (model,),
+        )
+        rows = cur.fetchall()
+        cur.close()
+    finally:
+        conn.close()
+    return dict(rows)
+
+
+# ----------------------------
+# Report
+# ----------------------------
+
+def build_report(job: dict, clip_results: list[dict], invoiced: Counter | None,
+                 class_products: dict[str, str], failed_clips: int = 0) -> dict:
+    # Compare by product_id; a class with no linked product keeps its name
+    observed = Counter()
+    for r in clip_results:
+        observed.update(class_products.get(name, name) for name in r["picked"])
+    invoiced = invoiced or Counter()
+
+    if not job["clips"]:
+        verdict = "no_evidence"
+    elif failed_clips:
+        verdict = "incomplete"
+    elif observed == invoiced:
+        verdict = "match"
+    else:
+        verdict = "mismatch"
+
+    return {
+        "ticket_id": job.get("ticket_id"),
+        "invoice_id": job["invoice_id"],
+        "verdict": verdict,
+        "invoiced": dict(invoiced),
+        "observed": dict(observed),
+        "charged_not_seen": dict(invoiced - observed),
+        "seen_not_charged": dict(observed - invoiced),
+        "failed_clips": failed_clips,
+        "clips": clip_results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-verify disputed invoices from recorded clips.")
+    src = parser.add_mutually_exclusive_group(required=True)
+    src.add_argument("--manifest", help="JSON list of tickets with clips and timestamps")
+    src.add_argument("--open-tickets", action="store_true",
+                     help="audit every open ticket that has evidence clips")
+    parser.add_argument("--evidence-dir", default=EVIDENCE_DIR)
+    parser.add_argument("--out", default=REPORT_DIR)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    if args.manifest:
+        jobs = json.loads(Path(args.manifest).read_text(encoding="utf-8"))
+    else:
+        jobs = open_ticket_jobs(args.evidence_dir)
+    if not jobs:
+        print("[audit] Nothing to audit.")
+        return
+
+    invoiced = fetch_invoiced([j["invoice_id"] for j in jobs])
+    weights = load_config()["models"]["items"]
+    class_products = fetch_class_products(Path(weights).name)
+
+    # Fan out at clip granularity so one long ticket does not serialise the run
+    results = {i: [] for i in range(len(jobs))}
+    failed = Counter()
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=_init_worker,
+                             initargs=(weights,)) as pool:
+        futures = {
+            pool.submit(audit_clip, clip): i
+            for i, job in enumerate(jobs) for clip in job["clips"]
+        }
+        for fut in as_completed(futures):
+            i = futures[fut]
+            try:
+                results[i].append(fut.result())
+            except Exception as e:
+                failed[i] += 1
+                print(f"[audit] ticket {jobs[i].get('ticket_id')}: clip failed: {e}")
+
+    out_dir = Path(args.out)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    for i, job in enumerate(jobs):
+        report = build_report(job, results[i], invoiced.get(job["invoice_id"]), class_products, failed[i])
+        name = job.get("ticket_id") or job["invoice_id"]
+        (out_dir / f"{name}.json").write_text(json.dumps(report, indent=2), encoding="utf-8")
+        print(f"[audit] {name}: {report['verdict']} | "
+              f"charged_not_seen={report['charged_not_seen']} seen_not_charged={report['seen_not_charged']}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,182 @@
+import os
+import sys
+import json
+import threading
+from pathlib import Path
+from dataclasses import dataclass
+
+import cv2
+
+CONFIG_PATH = os.getenv("CAMERA_CONFIG", str(Path(__file__).with_name("cameras.json")))
+
+# Backend picked for local capture devices when the config does not name one
+_DEVICE_BACKENDS = {
+    "linux": "V4L2",
+    "win32": "DSHOW",
+    "darwin": "AVFOUNDATION",
+}
+
+
+@dataclass
+class CameraConfig:
+    # int index, "/dev/videoN", "rtsp://..." / "http://..." URL, or a video file path
+    source: int | str
+    width: int | None = None
+    height: int | None = None
+    fps: int | None = None
+    fourcc: str | None = "MJPG"
+    buffer_size: int = 1
+    backend: str | None = None
+    enabled: bool = True
+
+
+def load_config(path: str | None = None) -> dict:
+    """
+    Load a store's camera/zone/model config file.
+    Returns {"store": name, "cameras": {name: CameraConfig},
+             "zones": {zone: {"rect": (x1, y1, x2, y2), "camera": camera name or None}},
+             "models": {role: weights path}}.
+    Relative weights paths resolve next to the config file when they exist there,
+    otherwise they are passed through (so ultralytics can fetch e.g. yolov8n.pt).
+    """
+    path = Path(path or CONFIG_PATH)
+    with open(path, "r", encoding="utf-8") as f:
+        raw = json.load(f)
+
+    cameras = {name: CameraConfig(**cfg) for name, cfg in raw.get("cameras", {}).items()}
+
+    models = {}
+    for role, weights in raw.get("models", {}).items():
+        local = path.parent / weights
+        models[role] = str(local) if local.exists() else weights
+
+    zones = {
+        name: {"rect": tuple(zone["rect"]), "camera": zone.get("camera")}
+        for name, zone in raw.get("zones", {}).items()
+    }
+
+    return {
+        "store": raw.get("store", path.stem),
+        "cameras": cameras,
+        "zones": zones,
+        "models": models,
+    }
+
+
+def source_kind(source: int | str) -> str:
+    """
+    Classify a capture source as "device", "stream" or "file".
+    """
+    if isinstance(source, int) or str(source).isdigit():
+        return "device"
+    if str(source).startswith("/dev/video"):
+        return "device"
+    if "://" in str(source):
+        return "stream"
+    return "file"
+
+
+def _backend_id(cfg: CameraConfig, kind: str) -> int:
+    name = cfg.backend
+    if name is None:
+        if kind == "device":
+            name = _DEVICE_BACKENDS.get(sys.platform, "ANY")
+        elif kind == "stream":
+            name = "FFMPEG"
+        else:
+            name = "ANY"
+    return getattr(cv2, f"CAP_{name.upper()}", cv2.CAP_ANY)
+
+
+def _fourcc_str(value: float) -> str:
+    code = int(value)
+    return "".join(chr((code >> (8 * i)) & 0xFF) for i in range(4)).strip("\x00")
+
+
+class LatestFrameCapture:
+    """
+    Wraps a network stream and keeps only the newest frame.
+    FFMPEG ignores CAP_PROP_BUFFERSIZE, so a reader thread drains the stream
+    continuously and read() never returns a frame that queued up behind others.
+    """
+
+    def __init__(self, cap: cv2.VideoCapture, first_frame_timeout: float = 5.0):
+        self.cap = cap
+        self.first_frame_timeout = first_frame_timeout
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self._ok = False
+        self._frame = None
+        self._running = True
+        self._thread = threading.Thread(target=self._reader, daemon=True)
+        self._thread.start()
+
+    def _reader(self):
+        while self._running:
+            ok, frame = self.cap.read()
+            with self._lock:
+                self._ok, self._frame = ok, frame
+            self._ready.set()
+            if not ok:
+                break
+
+    def read(self):
+        self._ready.wait(self.first_frame_timeout)
+        with self._lock:
+            return self._ok, self._frame
+
+    def isOpened(self) -> bool:
+        return self.cap.isOpened()
+
+    def get(self, prop_id: int) -> float:
+        return self.cap.get(prop_id)
+
+    def set(self, prop_id: int, value: float) -> bool:
+        return self.cap.set(prop_id, value)
+
+    def release(self):
+        self._running = False
+        self._thread.join(timeout=1.0)
+        self.cap.release()
+
+
+def open_camera(name: str, cfg: CameraConfig):
+    """
+    Open a capture for the given config and negotiate format/latency settings.
+    Raises RuntimeError if the source cannot be opened.
+    """
+    kind = source_kind(cfg.source)
+    source = int(cfg.source) if kind == "device" and str(cfg.source).isdigit() else cfg.source
+
+    if kind == "stream":
+        # TCP avoids the smeared frames UDP gives on lossy store Wi-Fi
+        os.environ.setdefault("OPENCV_FFMPEG_CAPTURE_OPTIONS", "rtsp_transport;tcp")
+
+    cap = cv2.VideoCapture(source, _backend_id(cfg, kind))
+    if not cap.isOpened():
+        raise RuntimeError(f"Could not open {name} camera ({cfg.source!r}).")
+
+    if kind == "device":
+        # FOURCC must be set before the resolution so the driver picks MJPG modes
+        if cfg.fourcc:
+            cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*cfg.fourcc))
+        if cfg.width:
+            cap.set(cv2.CAP_PROP_FRAME_WIDTH, cfg.width)
+        if cfg.height:
+            cap.set(cv2.CAP_PROP_FRAME_HEIGHT, cfg.height)
+        if cfg.fps:
+            cap.set(cv2.CAP_PROP_FPS, cfg.fps)
+        cap.set(cv2.CAP_PROP_BUFFERSIZE, cfg.buffer_size)
+
+        got = _fourcc_str(cap.get(cv2.CAP_PROP_FOURCC))
+        if cfg.fourcc and got != cfg.fourcc:
+            print(f"[camera] {name}: requested {cfg.fourcc}, driver gave {got or 'unknown'}")
+
+    w = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    h = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    print(f"[camera] {name}: {cfg.source} via {cap.getBackendName()} {w}x{h}")
+
+    if kind == "stream":
+        return LatestFrameCapture(cap)
+    return cap
+
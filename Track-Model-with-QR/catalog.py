@@ -0,0 +1,206 @@
+import os
+import json
+import time
+import asyncio
+import hashlib
+
+import psycopg
+from psycopg.rows import dict_row
+
+from supabase import async_connection, open_listen_connection
+
+CATALOG_CHANNEL = "products_changed"   # see sql/001_products_notify.sql
+CATALOG_TTL_S = float(os.getenv("CATALOG_TTL_S", "300"))  # full reload even without notifications
+LISTEN_RETRY_S = 5.0
+
+PRODUCT_COLUMNS = "id, name, price, shelf, category, calories"
+# Row layout of GET /catalog/classes (see sql/003_detector_classes.sql)
+CLASS_MAP_COLUMNS = ["class_index", "class_name", "product_id", "price", "display_name"]
+
+
+class ProductCatalog:
+    """
+    Process-local copy of the products table, indexed by name and by id,
+    plus the detector_classes mapping for each item model.
+
+    Loaded once at startup; after that each row is refreshed when the
+    products_changed trigger announces it, so lookups cost no round-trip.
+    If the listener is down (or a notification is lost) the whole catalog
+    is reloaded once it is older than CATALOG_TTL_S.
+    """
+
+    def __init__(self, ttl_s: float = CATALOG_TTL_S):
+        self.ttl_s = ttl_s
+        self._by_name: dict[str, dict] = {}
+        self._by_id: dict[str, dict] = {}
+        self._classes: dict[str, list[dict]] = {}   # model -> rows by class_index
+        self._class_maps: dict[str, dict] = {}      # model -> built payload; cleared on change
+        self._loaded_at = 0.0
+        self._reload_lock = asyncio.Lock()
+        self._listener: asyncio.Task | None = None
+
+    # ---- lifecycle
+    async def start(self):
+        await self.reload()
+        self._listener = asyncio.create_task(self._listen())
+
+    async def stop(self):
+        if self._listener is not None:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+            self._listener = None
+
+    # ---- lookups
+    async def by_name(self, name: str) -> dict | None:
+        await self._ensure_fresh()
+        return self._by_name.get(name)
+
+    async def by_id(self, product_id: str) -> dict | None:
+        await self._ensure_fresh()
+        return self._by_id.get(str(product_id))
+
+    async def ensure_fresh(self):
+        """
+        Reload if past the TTL; after this, lookup() answers without awaiting.
+        """
+        await self._ensure_fresh()
+
+    def lookup(self, name: str | None = None, product_id: str | None = None) -> dict | None:
+        """
+        Product by id if given, else by name. Call ensure_fresh() first.
+        """
+        if product_id is not None:
+            return self._by_id.get(str(product_id))
+        return self._by_name.get(name)
+
+    async def class_map(self, model: str) -> dict | None:
+        """
+        {model, version, columns, classes} for one item model, or None if the
+        model has no rows. classes is one compact list per class (CLASS_MAP_COLUMNS);
+        version changes whenever any served value does.
+        """
+        await self._ensure_fresh()
+        if model not in self._classes:
+            return None
+        cached = self._class_maps.get(model)
+        if cached is None:
+            rows = []
+            for c in self._classes[model]:
+                p = self._by_id.get(c["product_id"]) if c["product_id"] else None
+                rows.append([
+                    c["class_index"],
+                    c["class_name"],
+                    p["id"] if p else None,
+                    p["price"] if p else None,
+                    c["display_name"] or (p["name"] if p else c["class_name"]),
+                ])
+            body = json.dumps(rows, ensure_ascii=False, separators=(",", ":"))
+            cached = self._class_maps[model] = {
+                "model": model,
+                "version": hashlib.sha1(body.encode("utf-8")).hexdigest()[:16],
+                "columns": CLASS_MAP_COLUMNS,
+                "classes": rows,
+            }
+        return cached
+
+    # ---- loading
+    async def reload(self):
+        async with async_connection() as conn:
+            cur = conn.cursor(row_factory=dict_row)
+            await cur.execute(f"SELECT {PRODUCT_COLUMNS} FROM products;")
+            rows = await cur.fetchall()
+
+        by_id = {}
+        for r in rows:
+            p = self._row(r)
+            by_id[p["id"]] = p
+        # Swap whole dicts so readers never see a half-built catalog
+        self._by_id = by_id
+        self._by_name = {p["name"]: p for p in by_id.values()}
+        await self._load_classes()
+        self._loaded_at = time.monotonic()
+        print(f"[catalog] Loaded {len(by_id)} products, class maps for {len(self._classes)} models")
+
+    async def _load_classes(self):
+        try:
+            async with async_connection() as conn:
+                cur = conn.cursor(row_factory=dict_row)
+                await cur.execute(
+                    "SELECT model, class_index, class_name, product_id, display_name "
+                    "FROM detector_classes ORDER BY model, class_index;"
+                )
+                rows = await cur.fetchall()
+        except psycopg.errors.UndefinedTable:
+            rows = []  # sql/003_detector_classes.sql not applied yet
+
+        classes = {}
+        for r in rows:
+            r["product_id"] = str(r["product_id"]) if r["product_id"] is not None else None
+            classes.setdefault(r["model"], []).append(r)
+        self._classes = classes
+        self._class_maps = {}
+
+    async def _ensure_fresh(self):
+        if time.monotonic() - self._loaded_at <= self.ttl_s:
+            return
+        async with self._reload_lock:
+            if time.monotonic() - self._loaded_at > self.ttl_s:
+                await self.reload()
+
+    async def _refresh_one(self, product_id: str):
+        async with async_connection() as conn:
+            cur = conn.cursor(row_factory=dict_row)
+            await cur.execute(f"SELECT {PRODUCT_COLUMNS} FROM products WHERE id = %s;", (product_id,))
+            row = await cur.fetchone()
+
+        old = self._by_id.pop(product_id, None)
+        if old is not None and self._by_name.get(old["name"]) is old:
+            del self._by_name[old["name"]]
+        if row is not None:
+            p = self._row(row)
+            self._by_id[p["id"]] = p
+            self._by_name[p["name"]] = p
+        self._class_maps = {}  # prices / names in the class maps may have changed
+
+    @staticmethod
+    def _row(r: dict) -> dict:
+        p = dict(r)
+        p["id"] = str(p["id"])
+        p["price"] = float(p["price"]) if p["price"] is not None else None
+        return p
+
+    # ---- invalidation
+    async def _listen(self):
+        reconnect = False
+        while True:
+            try:
+                conn = await open_listen_connection()
+                try:
+                    await conn.execute(f"LISTEN {CATALOG_CHANNEL};")
+                    if reconnect:
+                        await self.reload()  # changes made while we were not listening
+                    async for note in conn.notifies():
+                        await self._on_notify(note.payload)
+                finally:
+                    await conn.close()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"[catalog] Listener error: {e}; retrying in {LISTEN_RETRY_S:.0f}s")
+                await asyncio.sleep(LISTEN_RETRY_S)
+            reconnect = True
+
+    async def _on_notify(self, payload: str):
+        try:
+            msg = json.loads(payload)
+        except ValueError:
+            msg = {}
+        if msg.get("table") == "detector_classes":
+            await self._load_classes()
+        elif msg.get("id") is None:  # TRUNCATE or unknown payload
+            await self.reload()
+        else:
+            await self._refresh_one(str(msg["id"]))
@@ -0,0 +1,175 @@
+"""
+Vision-side copy of the detector class -> product map served by
+GET /catalog/classes (api.py), so carts are built from product IDs
+instead of class-name strings.
+
+    python class_map.py --sync weights.pt     # write the model's classes into detector_classes
+"""
+import os
+import sys
+import json
+import argparse
+import threading
+from pathlib import Path
+
+import requests
+
+CLASS_MAP_URL = os.getenv("CLASS_MAP_URL", "http://127.0.0.1:8000/catalog/classes")
+CLASS_MAP_CACHE_DIR = os.getenv("CLASS_MAP_CACHE_DIR", str(Path(__file__).with_name(".class_maps")))
+CLASS_MAP_REFRESH_S = 300.0   # re-validate with If-None-Match this often
+CLASS_MAP_TIMEOUT_S = 2.0
+
+# Shopper-facing names used to seed detector_classes.display_name on --sync
+# (rag_system.py keeps the same list for when detector_classes cannot be read)
+DEFAULT_DISPLAY_NAMES = {
+    'Almarai_juice': 'عصير المراعي',
+    'alrabie_juice': 'عصير الربيع',
+    'Nadec_Mlik': 'حليب نادك',
+    'Sun_top': 'صن توب',
+    'barni': 'بارني',
+    'biskrem': 'بسكريم',
+    'loacker': 'لويكر',
+    'oreos': 'أوريو',
+    'galaxy': 'جالكسي',
+    'green_skittles': 'سكيتلز أخضر',
+    'kit_kat': 'كيت كات',
+    'pink_skittles': 'سكيتلز وردي',
+    'protein_bar': 'بروتين بار',
+}
+
+
+class ClassMap:
+    """
+    Class map for one item model. Loaded from the API at startup (falling
+    back to the last copy on disk when the API is down) and re-validated in
+    a background thread every CLASS_MAP_REFRESH_S; an unchanged map costs a
+    304 and no body. Lookups never block on the network.
+    """
+
+    def __init__(self, model: str, url: str = CLASS_MAP_URL, cache_dir: str = CLASS_MAP_CACHE_DIR,
+                 refresh_s: float = CLASS_MAP_REFRESH_S):
+        self.model = model
+        self.url = url
+        self.cache_path = Path(cache_dir) / f"{Path(model).name}.json"
+        self.refresh_s = refresh_s
+        self.version = None
+        self._by_name: dict[str, dict] = {}
+
+        self._load_disk()
+        self.refresh()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def product_id(self, class_name: str) -> str | None:
+        entry = self._by_name.get(class_name)
+        return entry["product_id"] if entry else None
+
+    def display_name(self, class_name: str) -> str:
+        entry = self._by_name.get(class_name)
+        return entry["display_name"] if entry and entry["display_name"] else class_name
+
+    def refresh(self) -> bool:
+        """
+        Fetch the map if its version changed. Returns True if a new map was installed.
+        """
+        headers = {"If-None-Match": f'"{self.version}"'} if self.version else {}
+        try:
+            resp = requests.get(self.url, params={"model": self.model}, headers=headers,
+                                timeout=CLASS_MAP_TIMEOUT_S)
+        except requests.RequestException as e:
+            print(f"[classes] {self.model}: refresh failed: {e}")
+            return False
+        if resp.status_code == 304:
+            return False
+        if resp.status_code != 200:
+            print(f"[classes] {self.model}: refresh got {resp.status_code} - {resp.text}")
+            return False
+
+        payload = resp.json()
+        self._install(payload)
+        try:
+            self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+            self.cache_path.write_text(json.dumps(payload, ensure_ascii=False), encoding="utf-8")
+        except OSError as e:
+            print(f"[classes] {self.model}: could not cache map: {e}")
+        return True
+
+    def close(self):
+        self._stop.set()
+
+    def _install(self, payload: dict):
+        cols = payload["columns"]
+        # Swap the whole dict so the main loop never sees a half-built map
+        self._by_name = {row[cols.index("class_name")]: dict(zip(cols, row))
+                         for row in payload["classes"]}
+        self.version = payload["version"]
+        print(f"[classes] {self.model}: map version {self.version} ({len(self._by_name)} classes)")
+
+    def _load_disk(self):
+        try:
+            self._install(json.loads(self.cache_path.read_text(encoding="utf-8")))
+        except (OSError, ValueError, KeyError):
+            pass
+
+    def _run(self):
+        while not self._stop.wait(self.refresh_s):
+            self.refresh()
+
+
+# ----------------------------
+# Seeding detector_classes
+# ----------------------------
+
+def sync_classes(weights: str):
+    """
+    Upsert one row per class of the model. New rows are linked to the product
+    whose name equals the class name (what invoices matched on before) and get
+    DEFAULT_DISPLAY_NAMES; existing product_id / display_name are kept.
+    """
+    from ultralytics import YOLO
+    from supabase import get_connection
+
+    names = YOLO(weights).names
+    model = Path(weights).name
+    rows = [(model, int(i), n, DEFAULT_DISPLAY_NAMES.get(n)) for i, n in sorted(names.items())]
+
+    conn = get_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute(
+            """
+            INSERT INTO detector_classes (model, class_index, class_name, product_id, display_name)
+            SELECT r.model, r.class_index, r.class_name, p.id, r.display_name
+            FROM unnest(%s::text[], %s::int[], %s::text[], %s::text[])
+                 AS r(model, class_index, class_name, display_name)
+            LEFT JOIN products p ON p.name = r.class_name
+            ON CONFLICT (model, class_index) DO UPDATE
+            SET class_name   = EXCLUDED.class_name,
+                product_id   = COALESCE(detector_classes.product_id, EXCLUDED.product_id),
+                display_name = COALESCE(detector_classes.display_name, EXCLUDED.display_name)
+            RETURNING class_name, product_id;
+            """,
+            tuple(map(list, zip(*rows))),
+        )
+        unlinked = [n for n, pid in cur.fetchall() if pid is None]
+        conn.commit()
+        cur.close()
+    finally:
+        conn.close()
+
+    print(f"[classes] {model}: synced {len(rows)} classes")
+    if unlinked:
+        print(f"[classes] {model}: no product linked for: {', '.join(unlinked)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the detector class -> product map.")
+    parser.add_argument("--sync", metavar="WEIGHTS", required=True,
+                        help="write the model's class names into detector_classes")
+    args = parser.parse_args()
+    sync_classes(args.sync)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,185 @@
+import os
+import json
+import time
+import queue
+import threading
+from pathlib import Path
+from collections import deque
+
+import cv2
+import numpy as np
+
+from frame import Frame
+
+EVIDENCE_DIR = os.getenv("EVIDENCE_DIR", str(Path(__file__).with_name("evidence")))
+EVIDENCE_FPS = 10           # frames kept per second per camera (subsampled)
+PRE_EVENT_S = 5.0           # footage kept from before an event
+POST_EVENT_S = 5.0          # footage recorded after an event
+JPEG_QUALITY = 80
+MAX_TRACKED_CLIPS = 1000    # sidecars remembered for invoice tagging
+
+
+def encode_jpeg(frame: Frame) -> bytes:
+    """
+    JPEG bytes for a frame, cached on it so an unchanged table frame is not re-encoded.
+    """
+    def build(f):
+        ok, buf = cv2.imencode(".jpg", f.image, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
+        return buf.tobytes() if ok else b""
+    return frame.cached("jpeg", build)
+
+
+class EvidenceRecorder:
+    """
+    Rolling in-memory buffers of compressed frames, one per camera, and a
+    background writer that turns event windows into short clips.
+
+    trigger() grabs the last PRE_EVENT_S seconds from a camera's buffer and keeps
+    collecting until POST_EVENT_S after the event; overlapping events for the
+    same track and camera extend one clip instead of writing several.
+    Each clip gets a .json sidecar with the store, camera, track and events;
+    tag_invoice() adds the invoice ID once the invoice exists.
+    """
+
+    def __init__(self, store: str, out_dir: str = EVIDENCE_DIR, fps: float = EVIDENCE_FPS,
+                 pre_s: float = PRE_EVENT_S, post_s: float = POST_EVENT_S):
+        self.store = store
+        self.out_dir = Path(out_dir) / store.replace(" ", "_")
+        self.fps = fps
+        self.pre_s = pre_s
+        self.post_s = post_s
+
+        self._buffers: dict[str, deque] = {}    # camera -> deque[(ts, jpeg)]
+        self._last_push: dict[str, float] = {}
+        self._pending: list[dict] = []          # clips still collecting post-event frames
+        self._written: dict[int, list[Path]] = {}  # track_id -> sidecar paths
+        self._invoice_by_track: dict[int, str] = {}
+
+        self._jobs = queue.Queue()
+        self._writer = threading.Thread(target=self._run_writer, daemon=True)
+        self._writer.start()
+
+    # ---- main-thread API
+    def push(self, camera: str, frame: Frame, ts: float | None = None):
+        """
+        Offer a frame from a camera; kept at most EVIDENCE_FPS times per second.
+        Call before anything is drawn on frame.image.
+        """
+        ts = time.time() if ts is None else ts
+        if ts - self._last_push.get(camera, 0.0) < 1.0 / self.fps:
+            return
+        self._last_push[camera] = ts
+
+        buf = self._buffers.get(camera)
+        if buf is None:
+            buf = self._buffers[camera] = deque(maxlen=int(self.fps * self.pre_s) + 1)
+        entry = (ts, encode_jpeg(frame))
+        buf.append(entry)
+
+        for clip in [c for c in self._pending if c["camera"] == camera]:
+            clip["frames"].append(entry)
+            if ts >= clip["end_ts"]:
+                self._finalize(clip)
+
+    def trigger(self, event: str, track_id: int, cameras: list[str], ts: float | None = None):
+        """
+        Record a clip around an event on each of the given cameras.
+        """
+        ts = time.time() if ts is None else ts
+        for camera in cameras:
+            clip = next((c for c in self._pending
+                         if c["camera"] == camera and c["track_id"] == track_id), None)
+            if clip is not None:
+                clip["end_ts"] = max(clip["end_ts"], ts + self.post_s)
+                clip["events"].append({"event": event, "ts": ts})
+                continue
+
+            pre = [e for e in self._buffers.get(camera, ()) if e[0] >= ts - self.pre_s]
+            self._pending.append({
+                "camera": camera,
+                "track_id": track_id,
+                "start_ts": pre[0][0] if pre else ts,
+                "end_ts": ts + self.post_s,
+                "events": [{"event": event, "ts": ts}],
+                "frames": pre,
+            })
+
+    def tag_invoice(self, track_id: int, invoice_id: str):
+        """
+        Attach an invoice ID to every clip of a track, written or still pending.
+        """
+        self._invoice_by_track[track_id] = invoice_id
+        self._jobs.put(("tag", track_id, invoice_id))
+
+    def close(self):
+        """
+        Write out clips still collecting frames and wait for the writer to finish.
+        """
+        for clip in list(self._pending):
+            self._finalize(clip)
+        self._jobs.put(None)
+        self._writer.join()
+
+    def _finalize(self, clip: dict):
+        self._pending.remove(clip)
+        track_id = clip["track_id"]
+        clip["invoice_id"] = self._invoice_by_track.get(track_id)
+        if not any(c["track_id"] == track_id for c in self._pending):
+            self._invoice_by_track.pop(track_id, None)
+        self._jobs.put(("clip", clip))
+
+    # ---- writer thread
+    def _run_writer(self):
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                return
+            try:
+                if job[0] == "clip":
+                    self._write_clip(job[1])
+                else:
+                    self._retag(job[1], job[2])
+            except Exception as e:
+                print(f"[evidence] {self.store}: failed to write {job[0]}: {e}")
+
+    def _write_clip(self, clip: dict):
+        frames = [cv2.imdecode(np.frombuffer(jpg, np.uint8), cv2.IMREAD_COLOR)
+                  for _, jpg in clip["frames"] if jpg]
+        frames = [f for f in frames if f is not None]
+        if not frames:
+            return
+
+        self.out_dir.mkdir(parents=True, exist_ok=True)
+        first = clip["events"][0]
+        stem = f"{int(first['ts'] * 1000)}_{clip['camera']}_track{clip['track_id']}_{first['event']}"
+        video_path = self.out_dir / f"{stem}.mp4"
+
+        h, w = frames[0].shape[:2]
+        writer = cv2.VideoWriter(str(video_path), cv2.VideoWriter_fourcc(*"mp4v"), self.fps, (w, h))
+        for f in frames:
+            writer.write(f if f.shape[:2] == (h, w) else cv2.resize(f, (w, h)))
+        writer.release()
+
+        meta = {
+            "store": self.store,
+            "camera": clip["camera"],
+            "track_id": clip["track_id"],
+            "invoice_id": clip["invoice_id"],
+            "start_ts": clip["start_ts"],
+            "end_ts": clip["frames"][-1][0],
+            "events": clip["events"],
+            "video": video_path.name,
+        }
+        meta_path = video_path.with_suffix(".json")
+        meta_path.write_text(json.dumps(meta, indent=2), encoding="utf-8")
+        if clip["invoice_id"] is None:
+            self._written.setdefault(clip["track_id"], []).append(meta_path)
+            while len(self._written) > MAX_TRACKED_CLIPS:
+                self._written.pop(next(iter(self._written)))
+        print(f"[evidence] {self.store}: wrote {video_path.name} ({len(frames)} frames)")
+
+    def _retag(self, track_id: int, invoice_id: str):
+        for meta_path in self._written.pop(track_id, []):
+            meta = json.loads(meta_path.read_text(encoding="utf-8"))
+            meta["invoice_id"] = invoice_id
+            meta_path.write_text(json.dumps(meta, indent=2), encoding="utf-8")
@@ -0,0 +1,125 @@
+import cv2
+import numpy as np
+
+# One row per box; "id" is -1 for untracked detections
+DETECTION_DTYPE = np.dtype([
+    ("id", np.int32),
+    ("cls", np.int16),
+    ("conf", np.float32),
+    ("xyxy", np.int32, (4,)),
+    ("center", np.int32, (2,)),
+])
+
+NO_ZONE = -1
+
+
+def empty_records() -> np.ndarray:
+    return np.empty(0, dtype=DETECTION_DTYPE)
+
+
+def to_records(result, frame=None) -> np.ndarray:
+    """
+    Convert an ultralytics Results into a DETECTION_DTYPE structured array
+    with a single device->host transfer (boxes.data holds every column).
+    If frame is given, the model was fed frame.tensor() and boxes are mapped
+    back from letterboxed coordinates to the frame's pixels.
+    """
+    boxes = result.boxes if result is not None else None
+    if boxes is None or len(boxes) == 0:
+        return empty_records()
+
+    # columns: x1, y1, x2, y2, [track_id], conf, cls
+    data = boxes.data.cpu().numpy()
+    xyxy = data[:, :4]
+    if frame is not None:
+        xyxy = frame.unletterbox(xyxy)
+
+    recs = np.empty(len(data), dtype=DETECTION_DTYPE)
+    recs["id"] = data[:, 4] if data.shape[1] == 7 else -1
+    recs["conf"] = data[:, -2]
+    recs["cls"] = data[:, -1]
+    recs["xyxy"] = xyxy
+    recs["center"] = (recs["xyxy"][:, :2] + recs["xyxy"][:, 2:]) // 2
+    return recs
+
+
+def from_tracks(tracks: np.ndarray) -> np.ndarray:
+    """
+    Convert BYTETracker.update() output (rows of x1, y1, x2, y2, track_id,
+    score, cls, idx) into a DETECTION_DTYPE structured array.
+    """
+    tracks = np.asarray(tracks, dtype=np.float32)
+    if tracks.size == 0:
+        return empty_records()
+
+    recs = np.empty(len(tracks), dtype=DETECTION_DTYPE)
+    recs["xyxy"] = tracks[:, :4]
+    recs["id"] = tracks[:, 4]
+    recs["conf"] = tracks[:, 5]
+    recs["cls"] = tracks[:, 6]
+    recs["center"] = (recs["xyxy"][:, :2] + recs["xyxy"][:, 2:]) // 2
+    return recs
+
+
+def class_names(recs: np.ndarray, names) -> list[str]:
+    """
+    Class names for every record, duplicates preserved.
+    """
+    return [names[c] for c in recs["cls"].tolist()]
+
+
+def compute_missing(baseline: list[str], current: list[str]) -> list[str]:
+    """
+    Compare baseline and current lists and return items missing
+    from the current list (duplicates preserved).
+    """
+    current_copy = list(current)
+    missing = []
+    for item in baseline:
+        if item in current_copy:
+            current_copy.remove(item)
+        else:
+            missing.append(item)
+    return missing
+
+
+def zone_rects(zones: dict[str, tuple]) -> tuple[list[str], np.ndarray]:
+    """
+    Split a {name: (x1, y1, x2, y2)} dict into names and a Zx4 array.
+    """
+    names = list(zones)
+    return names, np.array([zones[n] for n in names], dtype=np.int32).reshape(-1, 4)
+
+
+def assign_zones(centers: np.ndarray, rects: np.ndarray, margin: int = 0) -> np.ndarray:
+    """
+    For each center, the index of the nearest zone (by distance to the zone
+    center) whose rect, grown by margin, contains it; NO_ZONE if none does.
+    """
+    if len(centers) == 0 or len(rects) == 0:
+        return np.full(len(centers), NO_ZONE, dtype=np.int32)
+
+    pts = centers[:, None, :]                          # N x 1 x 2
+    lo = rects[None, :, :2] - margin                   # 1 x Z x 2
+    hi = rects[None, :, 2:] + margin
+    inside = np.all((pts >= lo) & (pts <= hi), axis=2)  # N x Z
+
+    zone_centers = (rects[:, :2] + rects[:, 2:]) // 2
+    dist2 = np.sum((pts - zone_centers[None]) ** 2, axis=2).astype(np.float64)
+    dist2[~inside] = np.inf
+
+    best = np.argmin(dist2, axis=1).astype(np.int32)
+    best[~inside.any(axis=1)] = NO_ZONE
+    return best
+
+
+def draw_records(img: np.ndarray, recs: np.ndarray, names, color=(0, 200, 255)) -> np.ndarray:
+    """
+    Draw boxes with class name and confidence onto img in place.
+    """
+    for (x1, y1, x2, y2), c, conf in zip(recs["xyxy"].tolist(), recs["cls"].tolist(),
+                                         recs["conf"].tolist()):
+        cv2.rectangle(img, (x1, y1), (x2, y2), color, 2)
+        cv2.putText(img, f"{names[c]} {conf:.2f}", (x1, max(20, y1 - 8)),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.6, color, 2, cv2.LINE_AA)
+    return img
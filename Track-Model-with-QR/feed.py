@@ -0,0 +1,162 @@
+import os
+import json
+import asyncio
+from collections import deque
+
+from supabase import open_listen_connection
+
+FEED_CHANNEL = "invoices_changed"   # see sql/008_invoice_notify.sql
+FEED_CLIENT_BUFFER = int(os.getenv("FEED_CLIENT_BUFFER", "256"))  # events queued per client
+FEED_REPLAY = int(os.getenv("FEED_REPLAY", "1024"))               # recent events kept for Last-Event-ID
+FEED_KEEPALIVE_S = float(os.getenv("FEED_KEEPALIVE_S", "15"))     # comment line when idle
+FEED_MAX_AGE_S = float(os.getenv("FEED_MAX_AGE_S", "60"))        # then the client reconnects
+FEED_RETRY_MS = 1000                # EventSource reconnect delay
+LISTEN_RETRY_S = 5.0
+
+RESYNC = "event: resync\ndata: {}\n\n"
+_CLOSE = None
+
+
+class InvoiceFeed:
+    """
+    One LISTEN connection on invoices_changed, fanned out to every connected
+    Server-Sent Events client, so the admin pages hear about new invoices
+    without polling and N open pages cost one database connection.
+
+    Each event is encoded once and the same frame is queued for every client.
+    A client that falls FEED_CLIENT_BUFFER events behind has its backlog
+    dropped and is told to resync (reload once) instead of slowing the rest.
+    Event ids are the trigger's seq (sql/008), which numbers every change once
+    and is the same on every worker, so a reconnecting EventSource picks up
+    where it left off on any of them: every listener receives the
+    notifications in the same commit order. seq is taken before commit, so
+    ids need not arrive in ascending order; replay goes by position in the
+    buffer, not by comparing ids. If the client's last event is no longer in
+    the replay buffer it is told to resync instead.
+    That is also what lets a stream end after FEED_MAX_AGE_S without losing
+    anything: uvicorn waits for open responses before shutting down, so no
+    stream may stay open indefinitely.
+    """
+
+    def __init__(self, buffer: int = FEED_CLIENT_BUFFER, replay: int = FEED_REPLAY):
+        self.buffer = buffer
+        self._clients: dict[asyncio.Queue, str | None] = {}   # queue -> user_id filter
+        self._recent: deque = deque(maxlen=replay)           # (event id, user_id, frame)
+        self._listener: asyncio.Task | None = None
+        self._counts = {"events": 0, "resyncs": 0, "replayed": 0}
+
+    # ---- lifecycle
+    async def start(self):
+        self._listener = asyncio.create_task(self._listen())
+
+    async def stop(self):
+        if self._listener is not None:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+            self._listener = None
+        # End open streams so shutdown does not wait on them
+        for q in list(self._clients):
+            self._push(q, _CLOSE, force=True)
+
+    def stats(self) -> dict:
+        return {"clients": len(self._clients), "listening": self._listener is not None, **self._counts}
+
+    # ---- clients
+    async def stream(self, user_id: str | None = None, last_event_id: str | None = None):
+        """
+        text/event-stream frames for one client: invoice events (all of them,
+        or only `user_id`'s), `resync` when events were missed, and a
+        keepalive comment every FEED_KEEPALIVE_S. Ends after FEED_MAX_AGE_S.
+        """
+        q: asyncio.Queue = asyncio.Queue()
+        self._clients[q] = user_id
+        # Taken before the first yield: later events only arrive through q
+        missed = self._replay(last_event_id, user_id) if last_event_id else []
+        position = self._recent[-1][0] if self._recent else None
+        loop = asyncio.get_running_loop()
+        ends_at = loop.time() + FEED_MAX_AGE_S
+        try:
+            yield f"retry: {FEED_RETRY_MS}\n\n"
+            for frame in missed:
+                yield frame
+            if position:
+                # Sets the client's Last-Event-ID even if it sees no event here
+                yield f"id: {position}\n\n"
+            while (left := ends_at - loop.time()) > 0:
+                try:
+                    frame = await asyncio.wait_for(q.get(), min(FEED_KEEPALIVE_S, left))
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                if frame is _CLOSE:
+                    return
+                yield frame
+        finally:
+            self._clients.pop(q, None)
+
+    def _replay(self, last_event_id: str, user_id: str | None) -> list[str]:
+        for i in range(len(self._recent) - 1, -1, -1):
+            if self._recent[i][0] == last_event_id:
+                frames = [f for _, uid, f in list(self._recent)[i + 1:] if user_id is None or uid == user_id]
+                self._counts["replayed"] += len(frames)
+                return frames
+        self._counts["resyncs"] += 1
+        return [RESYNC]
+
+    def _push(self, q: asyncio.Queue, frame: str | None, force: bool = False):
+        if q.qsize() >= self.buffer or force:
+            # Too far behind (or shutting down): drop the backlog, keep the client
+            while not q.empty():
+                q.get_nowait()
+            if frame is not _CLOSE:
+                frame = RESYNC
+        if frame == RESYNC:
+            self._counts["resyncs"] += 1
+        q.put_nowait(frame)
+
+    def _publish(self, payload: str):
+        try:
+            msg = json.loads(payload)
+        except ValueError:
+            return
+        if msg.get("seq") is None:
+            print(f"[feed] Ignoring notification without seq: {payload[:200]}")
+            return
+        event_id = str(msg["seq"])
+        user_id = msg.get("user_id")
+        frame = f"id: {event_id}\nevent: invoice\ndata: {payload}\n\n"
+        self._recent.append((event_id, user_id, frame))
+        self._counts["events"] += 1
+        for q, wanted in list(self._clients.items()):
+            if wanted is None or wanted == user_id:
+                self._push(q, frame)
+
+    def _resync_all(self):
+        # No Last-Event-ID from before the gap may replay across it
+        self._recent.clear()
+        for q in list(self._clients):
+            self._push(q, RESYNC)
+
+    # ---- listener
+    async def _listen(self):
+        reconnect = False
+        while True:
+            try:
+                conn = await open_listen_connection()
+                try:
+                    await conn.execute(f"LISTEN {FEED_CHANNEL};")
+                    if reconnect:
+                        self._resync_all()  # invoices written while we were not listening
+                    async for note in conn.notifies():
+                        self._publish(note.payload)
+                finally:
+                    await conn.close()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"[feed] Listener error: {e}; retrying in {LISTEN_RETRY_S:.0f}s")
+                await asyncio.sleep(LISTEN_RETRY_S)
+            reconnect = True
@@ -0,0 +1,112 @@
+import cv2
+import numpy as np
+import torch
+
+LETTERBOX_SIZE = 640        # YOLO input size (long side)
+LETTERBOX_STRIDE = 32       # pad to a multiple of the model stride
+LETTERBOX_COLOR = (114, 114, 114)
+THUMB_WIDTH = 64            # width of the change-detection thumbnail
+CHANGE_THRESHOLD = 4.0      # mean abs gray-level difference that counts as "changed"
+
+
+class Frame:
+    """
+    One captured BGR frame plus derived views that are computed on first use
+    and then shared by every consumer (QR decoder, YOLO, display, change detection).
+    Views that need no conversion are returned as numpy views, not copies.
+    """
+
+    def __init__(self, image: np.ndarray):
+        self.image = image
+        self._views = {}
+
+    def cached(self, key, fn):
+        """
+        Return the view stored under key, computing it with fn(self) the first time.
+        Consumers can also use this to share per-frame results (e.g. detections).
+        """
+        if key not in self._views:
+            self._views[key] = fn(self)
+        return self._views[key]
+
+    def has(self, key) -> bool:
+        return key in self._views
+
+    def get(self, key, default=None):
+        return self._views.get(key, default)
+
+    def store(self, key, value):
+        """
+        Attach a result computed elsewhere (e.g. by a batched model call).
+        """
+        self._views[key] = value
+
+    @property
+    def shape(self):
+        return self.image.shape
+
+    @property
+    def gray(self) -> np.ndarray:
+        return self.cached("gray", lambda f: cv2.cvtColor(f.image, cv2.COLOR_BGR2GRAY))
+
+    @property
+    def thumb(self) -> np.ndarray:
+        """
+        Tiny float32 grayscale thumbnail, blurred so sensor noise does not count as change.
+        Built from the gray view so it reuses that conversion.
+        """
+        def build(f):
+            h, w = f.gray.shape[:2]
+            th = max(1, round(h * THUMB_WIDTH / w))
+            t = cv2.resize(f.gray, (THUMB_WIDTH, th), interpolation=cv2.INTER_AREA)
+            return cv2.GaussianBlur(t, (3, 3), 0).astype(np.float32)
+        return self.cached("thumb", build)
+
+    def differs_from(self, other: "Frame | None", threshold: float = CHANGE_THRESHOLD) -> bool:
+        """
+        True if this frame looks different enough from other to be worth re-processing.
+        """
+        if other is None or other.thumb.shape != self.thumb.shape:
+            return True
+        return float(np.mean(np.abs(self.thumb - other.thumb))) > threshold
+
+    def letterbox(self, size: int = LETTERBOX_SIZE):
+        """
+        Resize keeping aspect ratio and pad to the model stride, like YOLO does.
+        Returns (image, ratio, (pad_x, pad_y)) so boxes can be mapped back.
+        """
+        def build(f):
+            h, w = f.image.shape[:2]
+            r = min(size / h, size / w)
+            nw, nh = round(w * r), round(h * r)
+            img = f.image if (nw, nh) == (w, h) else cv2.resize(
+                f.image, (nw, nh), interpolation=cv2.INTER_LINEAR)
+            pw, ph = (-nw) % LETTERBOX_STRIDE, (-nh) % LETTERBOX_STRIDE
+            left, top = pw // 2, ph // 2
+            if pw or ph:
+                img = cv2.copyMakeBorder(img, top, ph - top, left, pw - left,
+                                         cv2.BORDER_CONSTANT, value=LETTERBOX_COLOR)
+            return img, r, (left, top)
+        return self.cached(("letterbox", size), build)
+
+    def tensor(self, size: int = LETTERBOX_SIZE) -> torch.Tensor:
+        """
+        Letterboxed frame as a 1x3xHxW RGB float tensor in [0, 1], the input
+        format ultralytics accepts without running its own preprocessing.
+        """
+        def build(f):
+            img, _, _ = f.letterbox(size)
+            chw = np.ascontiguousarray(img[..., ::-1].transpose(2, 0, 1))
+            return torch.from_numpy(chw).unsqueeze(0).float().div_(255.0)
+        return self.cached(("tensor", size), build)
+
+    def unletterbox(self, xyxy: np.ndarray, size: int = LETTERBOX_SIZE) -> np.ndarray:
+        """
+        Map Nx4 boxes from letterboxed coordinates back to this frame's pixels.
+        """
+        _, r, (left, top) = self.letterbox(size)
+        h, w = self.image.shape[:2]
+        out = (np.asarray(xyxy, dtype=np.float32) - [left, top, left, top]) / r
+        out[:, [0, 2]] = out[:, [0, 2]].clip(0, w)
+        out[:, [1, 3]] = out[:, [1, 3]].clip(0, h)
+        return out
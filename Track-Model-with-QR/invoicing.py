@@ -0,0 +1,115 @@
+import time
+import queue
+import threading
+from typing import Callable
+
+import requests
+
+from schemas import InvoiceCreate
+
+INVOICE_API_URL = "http://127.0.0.1:8000/invoices"
+INVOICE_TIMEOUT_S = 2.0     # per attempt; safe to keep short since retries are idempotent
+INVOICE_ATTEMPTS = 4
+INVOICE_BACKOFF_S = 0.25    # doubled after each failed attempt
+
+# Outcomes reported by InvoiceSender.poll()
+SENT, REJECTED, FAILED = "sent", "rejected", "failed"
+
+# 409 detail api.py sends when the request holding our idempotency key had not
+# committed yet; the other 409 (key used by another user) is final
+RETRY_CONFLICT = "Idempotency key conflict; retry the request"
+
+
+def _retry_conflict(resp: requests.Response) -> bool:
+    if resp.status_code != 409:
+        return False
+    try:
+        body = resp.json()
+    except ValueError:
+        return False
+    return isinstance(body, dict) and body.get("detail") == RETRY_CONFLICT
+
+
+class InvoiceSender:
+    """
+    POSTs invoices from a background thread, so retries and backoff against a
+    slow or failing invoice API never stall the vision loop.
+
+    submit() only queues the invoice. Outcomes come back through poll(), which
+    the main thread drains each tick: (track_id, outcome, invoice_id, payload).
+    """
+
+    def __init__(self, log: Callable[[str], None] = print, url: str = INVOICE_API_URL):
+        self.log = log
+        self.url = url
+        self._jobs = queue.Queue()
+        self._results = queue.Queue()
+        self._worker = threading.Thread(target=self._run_worker, daemon=True)
+        self._worker.start()
+
+    # ---- main-thread API
+    def submit(self, track_id: int, payload: InvoiceCreate):
+        self._jobs.put((track_id, payload))
+
+    def poll(self) -> list[tuple]:
+        """
+        Outcomes of the invoices finished since the last call; never blocks.
+        """
+        done = []
+        while True:
+            try:
+                done.append(self._results.get_nowait())
+            except queue.Empty:
+                return done
+
+    def close(self) -> list[tuple]:
+        """
+        Finish the queued invoices (retries included), then return what poll() would.
+        """
+        self._jobs.put(None)
+        self._worker.join()
+        return self.poll()
+
+    # ---- worker thread
+    def _run_worker(self):
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                return
+            track_id, payload = job
+            try:
+                outcome, invoice_id = self._post(track_id, payload)
+            except Exception as e:
+                self.log(f"[invoice] track {track_id}: ERROR sending invoice: {e}")
+                outcome, invoice_id = FAILED, None
+            self._results.put((track_id, outcome, invoice_id, payload))
+
+    def _post(self, track_id: int, payload: InvoiceCreate) -> tuple[str, str | None]:
+        body = payload.model_dump()
+        delay = INVOICE_BACKOFF_S
+        for attempt in range(1, INVOICE_ATTEMPTS + 1):
+            wait = delay
+            try:
+                resp = requests.post(self.url, json=body, timeout=INVOICE_TIMEOUT_S)
+            except requests.RequestException as e:
+                self.log(f"[invoice] track {track_id}: attempt {attempt} failed: {e}")
+            else:
+                if 200 <= resp.status_code < 300:
+                    self.log(f"[invoice] track {track_id}: SUCCESS {resp.status_code}")
+                    invoice_id = resp.json().get("id")
+                    return SENT, str(invoice_id) if invoice_id else None
+                if resp.status_code < 500 and resp.status_code != 429 and not _retry_conflict(resp):
+                    # The request itself is wrong; retrying will not help
+                    self.log(f"[invoice] track {track_id}: FAILED {resp.status_code} - {resp.text}")
+                    return REJECTED, None
+                self.log(f"[invoice] track {track_id}: attempt {attempt} got {resp.status_code}")
+                # A 503 from the API's admission control says when to come back
+                try:
+                    wait = max(delay, float(resp.headers.get("Retry-After", 0)))
+                except ValueError:
+                    pass
+            if attempt < INVOICE_ATTEMPTS:
+                time.sleep(wait)  # only this thread waits
+                delay *= 2
+        self.log(f"[invoice] track {track_id}: giving up after {INVOICE_ATTEMPTS} attempts; cart kept.")
+        return FAILED, None
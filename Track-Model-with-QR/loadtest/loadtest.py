@@ -0,0 +1,497 @@
+"""
+Load test for the invoice API (api.py) against a throwaway local Postgres.
+
+Starts Postgres (initdb/pg_ctl if on PATH, otherwise the postgres:16 docker
+image), creates the base schema (schema.sql) plus every ../sql/*.sql
+migration, seeds users / products / inventory / past invoices, runs the API
+under uvicorn pointed at it, and drives it with concurrent asyncio clients.
+Reports throughput and p50/p95/p99 latency per endpoint.
+
+    python loadtest/loadtest.py                                   # defaults: 64 clients, 60s
+    python loadtest/loadtest.py --concurrency 200 --duration 120 --out before.json
+    python loadtest/loadtest.py --mix invoices=1,products=4,users=1,history=2
+    python loadtest/loadtest.py --replica                         # + a streaming standby for DB_REPLICA_URL
+    python loadtest/loadtest.py --dsn postgresql://...            # existing database (WIPED and seeded)
+    python loadtest/loadtest.py --api http://127.0.0.1:8000 --dsn postgresql://...
+                                                                  # drive a running API (seeds only)
+
+Same --seed and flags => same data and the same request sequence per client,
+so runs before and after a change are comparable (compare the --out files).
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import shutil
+import socket
+import random
+import asyncio
+import argparse
+import tempfile
+import subprocess
+from pathlib import Path
+from contextlib import contextmanager
+
+import httpx
+import psycopg
+
+API_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(API_DIR))
+
+from api import BRANCH_ID, PAYMENT_ID          # invoices are written against these rows
+from class_map import DEFAULT_DISPLAY_NAMES    # product names the detector emits
+
+SCHEMA_FILE = Path(__file__).with_name("schema.sql")
+MIGRATIONS_DIR = API_DIR / "sql"
+PG_IMAGE = os.getenv("LOADTEST_PG_IMAGE", "postgres:16")
+PG_READY_TIMEOUT_S = 60.0
+API_READY_TIMEOUT_S = 30.0
+REQUEST_TIMEOUT_S = 30.0
+
+# name -> relative weight; see OPERATIONS below
+DEFAULT_MIX = {"invoices": 2, "products": 5, "users": 1, "history": 0, "summary": 0, "stats": 0}
+
+
+# ----------------------------
+# Postgres
+# ----------------------------
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _wait_for_postgres(dsn: str):
+    deadline = time.monotonic() + PG_READY_TIMEOUT_S
+    while True:
+        try:
+            psycopg.connect(dsn, connect_timeout=2).close()
+            return
+        except psycopg.OperationalError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.5)
+
+
+@contextmanager
+def local_postgres(replica: bool = False):
+    """
+    Yield (dsn, replica_dsn) of a fresh, empty Postgres; removed again on exit.
+    With replica=True (pg_ctl only) a hot standby streaming from it is
+    started too, otherwise replica_dsn is None.
+    """
+    port = _free_port()
+    replica_dsn = None
+    if shutil.which("initdb") and shutil.which("pg_ctl"):
+        data = tempfile.mkdtemp(prefix="loadtest-pg-")
+        subprocess.run(["initdb", "-D", data, "-U", "postgres", "--auth=trust", "-E", "UTF8"],
+                       check=True, stdout=subprocess.DEVNULL)
+        # Headroom for the API pool plus the listener plus the seeding connection
+        opts = f"-p {port} -k {data} -c listen_addresses=127.0.0.1 -c max_connections=200 -c fsync=off"
+        subprocess.run(["pg_ctl", "-D", data, "-o", opts, "-l", os.path.join(data, "log"), "-w", "start"],
+                       check=True, stdout=subprocess.DEVNULL)
+        stop = lambda: (subprocess.run(["pg_ctl", "-D", data, "-m", "fast", "stop"],
+                                       stdout=subprocess.DEVNULL),
+                        shutil.rmtree(data, ignore_errors=True))
+        print(f"[loadtest] Postgres (pg_ctl) on port {port}, data in {data}")
+        if replica:
+            replica_dsn, stop_replica = _start_standby(port)
+            stop_primary = stop
+            stop = lambda: (stop_replica(), stop_primary())
+    elif replica:
+        raise RuntimeError("--replica needs initdb/pg_ctl on PATH (or pass --replica-dsn)")
+    elif shutil.which("docker"):
+        name = f"loadtest-pg-{port}"
+        subprocess.run(["docker", "run", "-d", "--rm", "--name", name, "-p", f"127.0.0.1:{port}:5432",
+                        "-e", "POSTGRES_HOST_AUTH_METHOD=trust", PG_IMAGE,
+                        "-c", "max_connections=200", "-c", "fsync=off"],
+                       check=True, stdout=subprocess.DEVNULL)
+        stop = lambda: subprocess.run(["docker", "stop", name], stdout=subprocess.DEVNULL)
+        print(f"[loadtest] Postgres ({PG_IMAGE}) container {name} on port {port}")
+    else:
+        raise RuntimeError("Need initdb/pg_ctl or docker on PATH (or pass --dsn)")
+
+    dsn = f"postgresql://postgres@127.0.0.1:{port}/postgres"
+    try:
+        _wait_for_postgres(dsn)
+        if replica_dsn:
+            _wait_for_postgres(replica_dsn)
+        yield dsn, replica_dsn
+    finally:
+        stop()
+
+
+def _start_standby(primary_port: int):
+    """
+    pg_basebackup the primary (initdb's default pg_hba already trusts local
+    replication) and start it as a hot standby. Returns (dsn, stop).
+    """
+    port = _free_port()
+    data = tempfile.mkdtemp(prefix="loadtest-pg-replica-")
+    subprocess.run(["pg_basebackup", "-c", "fast", "-h", "127.0.0.1", "-p", str(primary_port), "-U", "postgres",
+                    "-D", data, "-R", "-X", "stream"], check=True)
+    os.chmod(data, 0o700)
+    opts = f"-p {port} -k {data} -c listen_addresses=127.0.0.1 -c max_connections=200 -c hot_standby=on"
+    subprocess.run(["pg_ctl", "-D", data, "-o", opts, "-l", os.path.join(data, "log"), "-w", "start"],
+                   check=True, stdout=subprocess.DEVNULL)
+    print(f"[loadtest] Standby on port {port}, data in {data}")
+    stop = lambda: (subprocess.run(["pg_ctl", "-D", data, "-m", "fast", "stop"], stdout=subprocess.DEVNULL),
+                    shutil.rmtree(data, ignore_errors=True))
+    return f"postgresql://postgres@127.0.0.1:{port}/postgres", stop
+
+
+def split_sql(text: str) -> list[str]:
+    """
+    Split a script into statements on top-level semicolons, skipping those
+    inside quotes, comments and $$ bodies. Statements run one at a time so
+    CREATE INDEX CONCURRENTLY in the migrations stays outside a transaction.
+    """
+    out, buf, i, n = [], [], 0, len(text)
+    while i < n:
+        c = text[i]
+        if text.startswith("--", i):
+            j = text.find("\n", i)
+            j = n if j < 0 else j
+        elif c in ("'", '"'):
+            j = text.find(c, i + 1)
+            while j >= 0 and text.startswith(c, j + 1):  # doubled quote escape
+                j = text.find(c, j + 2)
+            j = n if j < 0 else j + 1
+        elif c == "$":
+            end = text.find("$", i + 1)
+            tag = text[i:end + 1] if end > 0 else ""
+            if tag and (tag == "$$" or tag[1:-1].isidentifier()):
+                j = text.find(tag, end + 1)
+                j = n if j < 0 else j + len(tag)
+            else:
+                j = i + 1
+        elif c == ";":
+            stmt = "".join(buf).strip()
+            if stmt:
+                out.append(stmt)
+            buf, i = [], i + 1
+            continue
+        else:
+            j = i + 1
+        buf.append(text[i:j])
+        i = j
+    stmt = "".join(buf).strip()
+    if stmt and any(l.strip() and not l.strip().startswith("--") for l in stmt.splitlines()):
+        out.append(stmt)
+    return out
+
+
+def prepare_database(dsn: str, n_users: int, n_invoices: int, rng: random.Random) -> dict:
+    """
+    Reset the public schema, apply schema.sql and the migrations, and seed.
+    Returns the ids the clients pick from.
+    """
+    with psycopg.connect(dsn, autocommit=True) as conn:
+        conn.execute("DROP SCHEMA IF EXISTS public CASCADE;")
+        conn.execute("CREATE SCHEMA public;")
+        for path in [SCHEMA_FILE, *sorted(MIGRATIONS_DIR.glob("*.sql"))]:
+            for stmt in split_sql(path.read_text(encoding="utf-8")):
+                conn.execute(stmt)
+            print(f"[loadtest] Applied {path.name}")
+
+        user_ids = [str(uuid.UUID(int=rng.getrandbits(128), version=4)) for _ in range(n_users)]
+        products = [
+            {"id": f"P{i:03d}", "name": name, "price": round(rng.uniform(1, 15), 2)}
+            for i, name in enumerate(DEFAULT_DISPLAY_NAMES)
+        ]
+
+        conn.execute(
+            """
+            INSERT INTO users (id, email, first_name, last_name, city, is_admin, num_visits, owed_balance)
+            SELECT u, 'user' || n || '@loadtest.local', 'User', n::text, 'Riyadh', false, 0, 0
+            FROM unnest(%s::uuid[]) WITH ORDINALITY AS t(u, n);
+            """,
+            (user_ids,),
+        )
+        conn.execute(
+            "INSERT INTO branches (id, name, address) VALUES (%s, 'Load test branch', 'n/a');",
+            (BRANCH_ID,),
+        )
+        conn.execute(
+            "INSERT INTO payment_methods (id, user_id, card_holder_name, is_default, is_deleted) "
+            "VALUES (%s, %s, 'Load Test', true, false);",
+            (PAYMENT_ID, user_ids[0]),
+        )
+        with conn.transaction():
+            for p in products:
+                conn.execute(
+                    "INSERT INTO products (id, name, price, shelf, category, calories) "
+                    "VALUES (%s, %s, %s, 'A1', 'snacks', 200);",
+                    (p["id"], p["name"], p["price"]),
+                )
+            # Deep enough that the run never sells out and every decrement is real work
+            conn.execute("INSERT INTO inventory (product_id, quantity) SELECT id, 100000000 FROM products;")
+
+        if n_invoices:
+            # Monthly partitions for the whole history (sql/007), not invoices_default
+            conn.execute(
+                "SELECT ensure_invoice_partitions((now() - make_interval(secs => %s * 37))::date, current_date);",
+                (n_invoices,),
+            )
+            # History for /users/{id}/invoices and /stats; the triggers fill the derived tables
+            conn.execute(
+                """
+                INSERT INTO invoices (user_id, branch_id, payment_id, "timestamp",
+                                      total_amount, products_and_quantities, status)
+                SELECT u.ids[1 + (g %% cardinality(u.ids))], %(branch)s, %(payment)s,
+                       now() - make_interval(secs => g * 37),
+                       p.price * 2,
+                       jsonb_build_array(jsonb_build_object(
+                           'product_id', p.id, 'name', p.name, 'quantity', 2,
+                           'unit_price', p.price, 'line_total', p.price * 2)),
+                       'paid'
+                FROM generate_series(1, %(n)s) AS g
+                CROSS JOIN (SELECT %(users)s::uuid[] AS ids) u
+                JOIN LATERAL (SELECT id, name, price FROM products ORDER BY id
+                              OFFSET g %% %(n_products)s LIMIT 1) p ON true;
+                """,
+                {"branch": BRANCH_ID, "payment": PAYMENT_ID, "n": n_invoices,
+                 "users": user_ids, "n_products": len(products)},
+            )
+        conn.execute("ANALYZE;")
+
+    print(f"[loadtest] Seeded {n_users} users, {len(products)} products, {n_invoices} invoices")
+    return {"user_ids": user_ids, "products": products}
+
+
+# ----------------------------
+# API server
+# ----------------------------
+
+@contextmanager
+def api_server(dsn: str, workers: int, replica_dsn: str | None = None):
+    port = _free_port()
+    env = dict(os.environ, connectionURL=dsn, DB_HOST="127.0.0.1", DB_ALLOW_LOCAL="1")
+    env.pop("DB_LISTEN_URL", None)  # listen on the same local server
+    env.pop("DB_REPLICA_URL", None)
+    if replica_dsn:
+        env["DB_REPLICA_URL"] = replica_dsn
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "api:app", "--host", "127.0.0.1", "--port", str(port),
+         "--workers", str(workers), "--log-level", "warning"],
+        cwd=API_DIR, env=env,
+    )
+    url = f"http://127.0.0.1:{port}"
+    try:
+        deadline = time.monotonic() + API_READY_TIMEOUT_S
+        while True:
+            if proc.poll() is not None:
+                raise RuntimeError(f"API exited with code {proc.returncode}")
+            try:
+                httpx.get(f"{url}/products/__ready__", timeout=2)
+                break
+            except httpx.HTTPError:
+                if time.monotonic() > deadline:
+                    raise RuntimeError("API did not come up")
+                time.sleep(0.3)
+        print(f"[loadtest] API ({workers} worker(s)) at {url}")
+        yield url
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+# ----------------------------
+# Load
+# ----------------------------
+
+def _op_invoices(rng, data):
+    items = []
+    for p in rng.sample(data["products"], rng.randint(1, 4)):
+        # Half by product_id (the vision path), half by name (older clients)
+        key = {"product_id": p["id"]} if rng.random() < 0.5 else {"name": p["name"]}
+        items.append({**key, "quantity": rng.randint(1, 3)})
+    body = {"user_id": rng.choice(data["user_ids"]), "items": items,
+            "idempotency_key": f"loadtest:{uuid.UUID(int=rng.getrandbits(128))}"}
+    return "POST", "/invoices", None, body
+
+def _op_products(rng, data):
+    return "GET", f"/products/{rng.choice(data['products'])['name']}", None, None
+
+def _op_users(rng, data):
+    params = {"limit": 50, "fields": "id,first_name,last_name,email"}
+    if rng.random() < 0.5:
+        params["after"] = rng.choice(data["user_ids"])
+    return "GET", "/users", params, None
+
+def _op_history(rng, data):
+    return "GET", f"/users/{rng.choice(data['user_ids'])}/invoices", {"limit": 20}, None
+
+def _op_summary(rng, data):
+    return "GET", f"/users/{rng.choice(data['user_ids'])}/summary", None, None
+
+def _op_stats(rng, data):
+    return "GET", "/stats/revenue", {"group_by": rng.choice(["day", "status"])}, None
+
+OPERATIONS = {
+    "invoices": _op_invoices,
+    "products": _op_products,
+    "users": _op_users,
+    "history": _op_history,
+    "summary": _op_summary,
+    "stats": _op_stats,
+}
+
+
+async def _client(n: int, client: httpx.AsyncClient, data: dict, mix: dict, seed: int,
+                  measure_from: float, stop_at: float, samples: dict):
+    rng = random.Random(seed * 1_000_003 + n)
+    names = [k for k, w in mix.items() if w > 0]
+    weights = [mix[k] for k in names]
+    while True:
+        start = time.perf_counter()
+        if start >= stop_at:
+            return
+        op = rng.choices(names, weights)[0]
+        method, path, params, body = OPERATIONS[op](rng, data)
+        try:
+            resp = await client.request(method, path, params=params, json=body)
+            ok = resp.status_code < 400 or (op == "products" and resp.status_code == 404)
+            status = resp.status_code
+        except httpx.HTTPError as e:
+            ok, status = False, type(e).__name__
+        end = time.perf_counter()
+        if start >= measure_from:  # discard warmup
+            s = samples.setdefault(op, {"lat": [], "errors": {}})
+            s["lat"].append(end - start)
+            if not ok:
+                s["errors"][str(status)] = s["errors"].get(str(status), 0) + 1
+
+
+async def drive(api: str, data: dict, concurrency: int, duration_s: float, warmup_s: float,
+                mix: dict, seed: int) -> dict:
+    samples: dict[str, dict] = {}
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=api, limits=limits, timeout=REQUEST_TIMEOUT_S) as client:
+        t0 = time.perf_counter()
+        measure_from, stop_at = t0 + warmup_s, t0 + warmup_s + duration_s
+        print(f"[loadtest] {concurrency} clients, {warmup_s:.0f}s warmup + {duration_s:.0f}s measured")
+        await asyncio.gather(*(
+            _client(n, client, data, mix, seed, measure_from, stop_at, samples)
+            for n in range(concurrency)
+        ))
+        elapsed = time.perf_counter() - measure_from
+        result = summarize(samples, elapsed)
+        try:
+            result["db"] = (await client.get("/db/status")).json()
+        except (httpx.HTTPError, ValueError):
+            pass
+    return result
+
+
+def _percentile(sorted_vals: list[float], q: float) -> float:
+    if not sorted_vals:
+        return 0.0
+    k = min(len(sorted_vals) - 1, max(0, round(q / 100 * len(sorted_vals) + 0.5) - 1))
+    return sorted_vals[k]  # nearest-rank
+
+
+def _stats(lat: list[float], errors: int, elapsed: float) -> dict:
+    lat = sorted(lat)
+    return {
+        "requests": len(lat),
+        "errors": errors,
+        "rps": round(len(lat) / elapsed, 1) if elapsed > 0 else 0.0,
+        "p50_ms": round(_percentile(lat, 50) * 1000, 1),
+        "p95_ms": round(_percentile(lat, 95) * 1000, 1),
+        "p99_ms": round(_percentile(lat, 99) * 1000, 1),
+        "max_ms": round(lat[-1] * 1000, 1) if lat else 0.0,
+    }
+
+
+def summarize(samples: dict, elapsed: float) -> dict:
+    per_op = {}
+    all_lat, all_err = [], 0
+    for op, s in sorted(samples.items()):
+        n_err = sum(s["errors"].values())
+        per_op[op] = {**_stats(s["lat"], n_err, elapsed), "error_codes": s["errors"]}
+        all_lat += s["lat"]
+        all_err += n_err
+    return {"elapsed_s": round(elapsed, 1), "total": _stats(all_lat, all_err, elapsed), "operations": per_op}
+
+
+def print_report(result: dict):
+    header = f"{'operation':<10} {'requests':>9} {'errors':>7} {'rps':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}"
+    print()
+    print(header)
+    print("-" * len(header))
+    rows = [*result["operations"].items(), ("TOTAL", result["total"])]
+    for op, s in rows:
+        print(f"{op:<10} {s['requests']:>9} {s['errors']:>7} {s['rps']:>8} "
+              f"{s['p50_ms']:>8} {s['p95_ms']:>8} {s['p99_ms']:>8} {s['max_ms']:>8}")
+    for op, s in result["operations"].items():
+        if s["error_codes"]:
+            print(f"[loadtest] {op} errors: {s['error_codes']}")
+    replica = result.get("db", {}).get("replica")
+    if replica and replica["configured"]:
+        print(f"[loadtest] Reads routed: {replica['routed']} (replica lag {replica['lag_s']}s)")
+    admission = result.get("db", {}).get("admission")
+    if admission:
+        for kind in ("write", "read"):
+            print(f"[loadtest] Admission {kind}s: {admission[kind]}")
+
+
+@contextmanager
+def _given(value):
+    yield value
+
+
+def _parse_mix(spec: str | None) -> dict:
+    mix = dict(DEFAULT_MIX)
+    if spec:
+        mix = {k: 0 for k in mix}
+        for part in spec.split(","):
+            name, _, weight = part.partition("=")
+            if name.strip() not in OPERATIONS:
+                raise SystemExit(f"Unknown operation {name!r}; choose from {', '.join(OPERATIONS)}")
+            mix[name.strip()] = float(weight or 1)
+    if not any(w > 0 for w in mix.values()):
+        raise SystemExit("--mix has no operation with a positive weight")
+    return mix
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the invoice API against a local Postgres.")
+    parser.add_argument("--dsn", help="use this database instead of starting one (its public schema is DROPPED)")
+    parser.add_argument("--api", help="drive an API that is already running at this URL")
+    parser.add_argument("--replica", action="store_true",
+                        help="also start a streaming standby and route the API's reads to it")
+    parser.add_argument("--replica-dsn", help="route the API's reads to this replica of --dsn")
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--duration", type=float, default=60.0, help="measured seconds")
+    parser.add_argument("--warmup", type=float, default=5.0, help="seconds of load discarded first")
+    parser.add_argument("--mix", help=f"op=weight,... from {', '.join(OPERATIONS)} (default {DEFAULT_MIX})")
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--invoices", type=int, default=100000, help="past invoices seeded")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--out", help="write the results (and run parameters) as JSON here")
+    args = parser.parse_args()
+    mix = _parse_mix(args.mix)
+
+    with _given((args.dsn, args.replica_dsn)) if args.dsn else local_postgres(args.replica) as (dsn, replica_dsn):
+        data = prepare_database(dsn, args.users, args.invoices, random.Random(args.seed))
+        with _given(args.api) if args.api else api_server(dsn, args.workers, replica_dsn) as api:
+            result = asyncio.run(drive(api, data, args.concurrency, args.duration, args.warmup,
+                                       mix, args.seed))
+
+    print_report(result)
+    if args.out:
+        result["params"] = {k: v for k, v in vars(args).items() if k not in ("dsn", "replica_dsn", "out")}
+        result["params"]["mix"] = mix
+        Path(args.out).write_text(json.dumps(result, indent=2), encoding="utf-8")
+        print(f"[loadtest] Results written to {args.out}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
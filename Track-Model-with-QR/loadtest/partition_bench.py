@@ -0,0 +1,259 @@
+"""
+Plans and timings of the API's invoice queries before and after the monthly
+partitioning migration (sql/007), on a synthetic dataset.
+
+Loads the base schema (schema.sql) with N invoices spread evenly over
+--months (inserted in time order, like real traffic), applies sql/001-006
+(their backfills build the rollups and invoice_lines), runs every query in
+QUERIES under EXPLAIN (ANALYZE, BUFFERS), applies sql/007 and runs them again.
+
+    python loadtest/partition_bench.py                          # 10M invoices, local Postgres
+    python loadtest/partition_bench.py --invoices 1000000 --out bench.json
+    python loadtest/partition_bench.py --dsn postgresql://...   # scratch database (WIPED)
+
+--out keeps the full JSON plans next to the summary.
+"""
+import sys
+import json
+import time
+import argparse
+import statistics
+from pathlib import Path
+from datetime import datetime, timedelta
+
+import psycopg
+
+from loadtest import (SCHEMA_FILE, MIGRATIONS_DIR, PAYMENT_ID, DEFAULT_DISPLAY_NAMES,
+                      local_postgres, split_sql, _given)
+
+PARTITION_MIGRATION = "007_partition_invoices.sql"
+LOAD_CHUNK = 1_000_000
+N_BRANCHES = 8
+
+HISTORY_COLS = 'id, "timestamp", total_amount, status, branch_id'
+
+# name -> (query before sql/007, query after or None if unchanged). Mirrors api.py;
+# where 007 changed the query both versions are listed.
+QUERIES = {
+    "history_first_page": (
+        f'SELECT {HISTORY_COLS} FROM invoices WHERE user_id = %(user)s '
+        'ORDER BY "timestamp" DESC, id DESC LIMIT 20',
+        None,
+    ),
+    "history_older_page": (
+        f'SELECT {HISTORY_COLS} FROM invoices WHERE user_id = %(user)s '
+        'AND ("timestamp", id) < (%(cursor_ts)s, %(cursor_id)s) '
+        'ORDER BY "timestamp" DESC, id DESC LIMIT 20',
+        f'SELECT {HISTORY_COLS} FROM invoices WHERE user_id = %(user)s '
+        'AND "timestamp" <= %(cursor_ts)s AND ("timestamp", id) < (%(cursor_ts)s, %(cursor_id)s) '
+        'ORDER BY "timestamp" DESC, id DESC LIMIT 20',
+    ),
+    "branch_month_totals": (
+        'SELECT count(*), sum(total_amount) FROM invoices '
+        'WHERE "timestamp" >= %(month)s AND "timestamp" < %(next_month)s AND branch_id = %(branch)s',
+        None,
+    ),
+    "product_sales_month": (
+        "SELECT l.product_id, sum(l.qty) AS units, sum(l.qty * l.unit_price) AS revenue "
+        "FROM invoice_lines l WHERE l.invoice_ts >= %(month)s AND l.invoice_ts < %(month_end)s::date + 1 "
+        "GROUP BY l.product_id ORDER BY units DESC LIMIT 20",
+        None,
+    ),
+    "invoice_by_idempotency_key": (
+        "SELECT * FROM invoices WHERE idempotency_key = %(key)s",
+        "SELECT invoices.* FROM invoice_idempotency_keys k "
+        'JOIN invoices ON invoices.id = k.invoice_id AND invoices."timestamp" = k.invoice_ts '
+        "WHERE k.key = %(key)s",
+    ),
+    # The web app's getInvoiceById: no timestamp, so every partition is probed
+    "invoice_by_id": (
+        "SELECT * FROM invoices WHERE id = %(invoice_id)s",
+        None,
+    ),
+}
+
+# Retention: drop one month. Executed once each, inside a rolled-back transaction.
+ARCHIVE_BEFORE = 'DELETE FROM invoices WHERE "timestamp" >= %(old_month)s AND "timestamp" < %(old_next_month)s'
+ARCHIVE_AFTER = "SELECT archive_invoice_month(%(old_month)s)"
+
+
+def load_dataset(conn, n_invoices: int, months: int, n_users: int):
+    conn.execute("DROP SCHEMA IF EXISTS public CASCADE;")
+    conn.execute("CREATE SCHEMA public;")
+    conn.execute("DROP SCHEMA IF EXISTS invoice_archive CASCADE;")
+    for stmt in split_sql(SCHEMA_FILE.read_text(encoding="utf-8")):
+        conn.execute(stmt)
+    # Keys are loaded with the invoices; sql/002 then only indexes them
+    conn.execute("ALTER TABLE invoices ADD COLUMN idempotency_key TEXT;")
+
+    # Ids are md5-derived from a counter so the invoice generator can compute them
+    conn.execute(
+        "INSERT INTO users (id, email, first_name) "
+        "SELECT md5('user' || u)::uuid, 'user' || u || '@bench.local', 'User' FROM generate_series(0, %s - 1) u;",
+        (n_users,),
+    )
+    conn.execute(
+        "INSERT INTO branches (id, name) "
+        "SELECT md5('branch' || b)::uuid, 'Branch ' || b FROM generate_series(0, %s - 1) b;",
+        (N_BRANCHES,),
+    )
+    conn.execute(
+        "INSERT INTO payment_methods (id, user_id, is_default, is_deleted) VALUES (%s, md5('user0')::uuid, true, false);",
+        (PAYMENT_ID,),
+    )
+    for i, name in enumerate(DEFAULT_DISPLAY_NAMES):
+        conn.execute(
+            "INSERT INTO products (id, name, price, shelf, category) VALUES (%s, %s, %s, 'A1', 'snacks');",
+            (f"P{i:03d}", name, 2 + i % 9),
+        )
+    n_products = len(DEFAULT_DISPLAY_NAMES)
+
+    start = datetime.now().replace(microsecond=0) - timedelta(days=30 * months)
+    span_s = 30 * months * 86400
+    for lo in range(0, n_invoices, LOAD_CHUNK):
+        hi = min(n_invoices, lo + LOAD_CHUNK) - 1
+        t0 = time.perf_counter()
+        conn.execute(
+            """
+            INSERT INTO invoices (id, user_id, branch_id, payment_id, "timestamp", total_amount,
+                                  products_and_quantities, status, idempotency_key)
+            SELECT gen_random_uuid(),
+                   md5('user' || (g %% %(n_users)s))::uuid,
+                   md5('branch' || (g %% %(n_branches)s))::uuid,
+                   %(payment)s,
+                   %(start)s::timestamp + make_interval(secs => g::float8 / %(n)s * %(span_s)s),
+                   a.price * (1 + g %% 3) + b.price,
+                   jsonb_build_array(
+                       jsonb_build_object('product_id', a.id, 'quantity', 1 + g %% 3, 'unit_price', a.price),
+                       jsonb_build_object('product_id', b.id, 'quantity', 1, 'unit_price', b.price)),
+                   (ARRAY['paid', 'paid', 'paid', 'pending', 'refunded'])[1 + g %% 5]::invoice_status,
+                   CASE WHEN g %% 2 = 0 THEN 'bench:' || g END
+            FROM generate_series(%(lo)s, %(hi)s) AS g
+            JOIN products a ON a.id = 'P' || lpad((g %% %(n_products)s)::text, 3, '0')
+            JOIN products b ON b.id = 'P' || lpad(((g * 7 + 3) %% %(n_products)s)::text, 3, '0');
+            """,
+            {"n_users": n_users, "n_branches": N_BRANCHES, "payment": PAYMENT_ID, "start": start,
+             "n": n_invoices, "span_s": span_s, "lo": lo, "hi": hi, "n_products": n_products},
+        )
+        print(f"[bench] Invoices {hi + 1:,}/{n_invoices:,} ({time.perf_counter() - t0:.1f}s)")
+
+
+def apply_migrations(conn, only=None, skip=None):
+    for path in sorted(MIGRATIONS_DIR.glob("*.sql")):
+        if (only and path.name != only) or (skip and path.name == skip):
+            continue
+        t0 = time.perf_counter()
+        for stmt in split_sql(path.read_text(encoding="utf-8")):
+            conn.execute(stmt)
+        print(f"[bench] Applied {path.name} ({time.perf_counter() - t0:.1f}s)")
+
+
+def pick_params(conn, months: int) -> dict:
+    now = datetime.now()
+    month = (now.replace(day=1) - timedelta(days=31 * 6)).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    next_month = (month + timedelta(days=32)).replace(day=1)
+    old_month = (now.replace(day=1) - timedelta(days=31 * (months - 2))).replace(
+        day=1, hour=0, minute=0, second=0, microsecond=0)
+    n = conn.execute("SELECT count(*) FROM invoices;").fetchone()[0]
+    key = conn.execute(  # an invoice from the middle of the history
+        "SELECT idempotency_key, id FROM invoices WHERE idempotency_key = %s;", (f"bench:{n // 4 * 2}",),
+    ).fetchone()
+    cursor_ts = now - timedelta(days=365)
+    return {
+        "user": conn.execute("SELECT md5('user1')::uuid;").fetchone()[0],
+        "branch": conn.execute("SELECT md5('branch1')::uuid;").fetchone()[0],
+        "cursor_ts": cursor_ts,
+        "cursor_id": "ffffffff-ffff-ffff-ffff-ffffffffffff",
+        "month": month,
+        "next_month": next_month,
+        "month_end": (next_month - timedelta(days=1)).date(),
+        "key": key[0],
+        "invoice_id": key[1],
+        "old_month": old_month.date(),
+        "old_next_month": (old_month + timedelta(days=32)).replace(day=1),
+    }
+
+
+def _walk(node):
+    yield node
+    for child in node.get("Plans", []):
+        yield from _walk(child)
+
+
+def explain(conn, query: str, params: dict) -> dict:
+    plan = conn.execute("EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + query, params).fetchone()[0][0]
+    nodes = list(_walk(plan["Plan"]))
+    scanned = {n["Relation Name"] for n in nodes if "Relation Name" in n and n.get("Actual Loops", 0) > 0}
+    return {
+        "ms": plan["Execution Time"],
+        "planning_ms": plan["Planning Time"],
+        "buffers": sum(plan["Plan"].get(k, 0) for k in ("Shared Hit Blocks", "Shared Read Blocks")),
+        "relations": sorted(scanned),
+        "plan": plan,
+    }
+
+
+def run_suite(conn, params: dict, after: bool, repeat: int) -> dict:
+    results = {}
+    for name, (before_q, after_q) in QUERIES.items():
+        query = (after_q or before_q) if after else before_q
+        explain(conn, query, params)  # warm the cache; timings below are hot
+        runs = [explain(conn, query, params) for _ in range(repeat)]
+        best = runs[len(runs) // 2]
+        best["ms"] = statistics.median(r["ms"] for r in runs)
+        results[name] = best
+
+    # EXPLAIN ANALYZE executes the DELETE / detach, so undo it
+    with conn.transaction(force_rollback=True):
+        t0 = time.perf_counter()
+        conn.execute(ARCHIVE_AFTER if after else ARCHIVE_BEFORE, params)
+        results["archive_month"] = {"ms": (time.perf_counter() - t0) * 1000, "buffers": None,
+                                    "planning_ms": None, "relations": [], "plan": None}
+    return results
+
+
+def print_comparison(before: dict, after: dict):
+    header = f"{'query':<28} {'before ms':>10} {'after ms':>10} {'before buf':>11} {'after buf':>10} {'partitions':>10}"
+    print()
+    print(header)
+    print("-" * len(header))
+    for name in before:
+        b, a = before[name], after[name]
+        parts = len([r for r in a["relations"] if r.startswith(("invoices", "invoice_lines"))])
+        print(f"{name:<28} {b['ms']:>10.2f} {a['ms']:>10.2f} "
+              f"{b['buffers'] if b['buffers'] is not None else '-':>11} "
+              f"{a['buffers'] if a['buffers'] is not None else '-':>10} {parts or '-':>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare invoice query plans before/after sql/007.")
+    parser.add_argument("--dsn", help="use this database instead of starting one (its public schema is DROPPED)")
+    parser.add_argument("--invoices", type=int, default=10_000_000)
+    parser.add_argument("--months", type=int, default=24, help="history the invoices are spread over")
+    parser.add_argument("--users", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=5, help="runs per query; the median is reported")
+    parser.add_argument("--out", help="write summary and full plans as JSON here")
+    args = parser.parse_args()
+
+    with _given((args.dsn, None)) if args.dsn else local_postgres() as (dsn, _):
+        with psycopg.connect(dsn, autocommit=True) as conn:
+            load_dataset(conn, args.invoices, args.months, args.users)
+            apply_migrations(conn, skip=PARTITION_MIGRATION)
+            conn.execute("VACUUM ANALYZE;")
+            params = pick_params(conn, args.months)
+            before = run_suite(conn, params, after=False, repeat=args.repeat)
+
+            apply_migrations(conn, only=PARTITION_MIGRATION)
+            conn.execute("VACUUM ANALYZE;")
+            after = run_suite(conn, params, after=True, repeat=args.repeat)
+
+    print_comparison(before, after)
+    if args.out:
+        payload = {"params": {**vars(args), "dsn": None},
+                   "before": before, "after": after}
+        Path(args.out).write_text(json.dumps(payload, indent=2, default=str), encoding="utf-8")
+        print(f"[bench] Results written to {args.out}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
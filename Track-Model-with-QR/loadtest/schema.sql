@@ -0,0 +1,74 @@
+-- Base tables for the load test, as described in Front-End-new/database_schema.md.
+-- loadtest.py applies this to an empty database, then every ../sql/*.sql in order.
+-- Defaults (ids, timestamp) stand in for the ones Supabase provides.
+
+CREATE TYPE invoice_status AS ENUM ('pending', 'paid', 'cancelled', 'refunded');
+CREATE TYPE ticket_status AS ENUM ('open', 'in_progress', 'resolved', 'closed');
+
+CREATE TABLE users (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    email TEXT,
+    phone TEXT,
+    password TEXT,
+    is_admin BOOLEAN,
+    num_visits INTEGER,
+    owed_balance NUMERIC,
+    first_name TEXT,
+    last_name TEXT,
+    city TEXT
+);
+
+CREATE TABLE branches (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    name TEXT,
+    address TEXT,
+    lat NUMERIC,
+    long NUMERIC
+);
+
+CREATE TABLE payment_methods (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    user_id UUID REFERENCES users(id),
+    card_number TEXT,
+    card_holder_name TEXT,
+    expiry_month INTEGER,
+    expiry_year INTEGER,
+    cvv TEXT,
+    is_default BOOLEAN,
+    is_deleted BOOLEAN
+);
+
+CREATE TABLE products (
+    id TEXT PRIMARY KEY,
+    name TEXT,
+    price NUMERIC,
+    shelf TEXT,
+    category TEXT,
+    calories INTEGER
+);
+
+-- Columns as read by admin/inventory.js
+CREATE TABLE inventory (
+    product_id TEXT PRIMARY KEY REFERENCES products(id),
+    quantity INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TABLE invoices (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    user_id UUID REFERENCES users(id),
+    branch_id UUID REFERENCES branches(id),
+    payment_id UUID REFERENCES payment_methods(id),
+    timestamp TIMESTAMP DEFAULT now(),
+    total_amount NUMERIC,
+    products_and_quantities JSONB,
+    status invoice_status
+);
+
+CREATE TABLE tickets (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    invoice_id UUID REFERENCES invoices(id),
+    timestamp TIMESTAMP DEFAULT now(),
+    products_and_quantities JSONB,
+    refund_price NUMERIC,
+    status ticket_status
+);
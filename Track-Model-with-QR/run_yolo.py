@@ -1,35 +1,34 @@
+import sys
 import cv2
 from ultralytics import YOLO
 import torch
+from capture import load_config, open_camera
+from detections import to_records, class_names, compute_missing, draw_records
+
+# Camera to watch, by name in cameras.json (default: Table A snapshot camera)
+CAMERA_NAME = sys.argv[1] if len(sys.argv) > 1 else "table_a"
+CONFIG = load_config()
 
 # Automatically select device: CUDA if available, otherwise CPU
 device = "cuda" if torch.cuda.is_available() else "cpu"
 print(f"Using device: {device}")
 
 # Load YOLO model with weights
-model = YOLO(r"C:\Users\Rakan\Desktop\Capstone\TuwaiqPick\Track-Model-with-QR\weights.pt")
+model = YOLO(CONFIG["models"]["items"])
 model.to(device)
 
-# Try DirectShow on Windows for better camera access
-cap = cv2.VideoCapture(1, cv2.CAP_DSHOW)  # change 0/1/2 depending on your camera index
-if not cap.isOpened():
-    raise RuntimeError("Could not open camera. Try index 0/1/2, or check privacy permissions.")
-
-# Set resolution
-cap.set(cv2.CAP_PROP_FRAME_WIDTH, 1280)
-cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 720)
+# Backend, resolution and buffering come from the camera's config entry
+cap = open_camera(CAMERA_NAME, CONFIG["cameras"][CAMERA_NAME])
 
 # ---- Snapshot logic ----
 baseline_items = set()   # what was visible when you last refreshed
 last_missing = []        # last reported missing list (for your reference)
 
-def build_current_items(result_obj):
+def build_current_items(recs):
     """
-    From a YOLO result, build the set of unique class names currently visible.
+    From a frame's detection records, build the list of class names currently visible.
     """
-    if result_obj is None or result_obj.boxes is None or len(result_obj.boxes) == 0:
-        return set()
-    return [model.names[int(box.cls[0])] for box in result_obj.boxes]
+    return class_names(recs, model.names)
 
 def refresh_snapshot(current_set):
     """
@@ -44,13 +43,7 @@ def get_missing_items(current_set):
     Return the items that are missing now compared to the last snapshot.
     Missing = in baseline but NOT in current.
     """
-    current_copy = list(current_set)  # make a copy
-    missing = []
-    for item in baseline_items:
-        if item in current_copy:
-            current_copy.remove(item)  # consume one occurrence
-        else:
-            missing.append(item)
+    missing = compute_missing(baseline_items, current_set)
     print("Missing items:", missing)
 
     return missing
@@ -72,11 +65,12 @@ while True:
         verbose=False
     )
 
-    # Build current items from this frame
-    current_items = build_current_items(results[0] if results else None)
+    # Build current items from this frame (one host transfer, no Results kept)
+    recs = to_records(results[0] if results else None)
+    current_items = build_current_items(recs)
 
     # Draw detections
-    annotated = results[0].plot(line_width=2, labels=True, conf=True) if results else frame
+    annotated = draw_records(frame.copy(), recs, model.names)
     cv2.imshow("YOLO Live", annotated)
 
     key = cv2.waitKey(1) & 0xFF
@@ -0,0 +1,34 @@
+from pydantic import BaseModel, Field, constr, model_validator
+from typing import List, Optional
+
+# Invoice payloads shared by the API (api.py) and the vision side (Full.py).
+# Kept free of FastAPI/database imports so the tracker can import it cheaply.
+
+class InvoiceItem(BaseModel):
+    # product_id (from the detector class map, see class_map.py) wins when given;
+    # name is the fallback and is kept for logs. quantity must be positive integer
+    name: Optional[constr(strip_whitespace=True, min_length=1)] = None
+    product_id: Optional[constr(strip_whitespace=True, min_length=1)] = None
+    quantity: int = Field(..., gt=0)
+
+    @model_validator(mode="after")
+    def _needs_name_or_id(self):
+        if self.name is None and self.product_id is None:
+            raise ValueError("item needs a name or a product_id")
+        return self
+
+    @property
+    def label(self) -> str:
+        return self.name or self.product_id
+
+
+class InvoiceCreate(BaseModel):
+    user_id: constr(strip_whitespace=True, min_length=1)
+    items: List[InvoiceItem] = Field(..., min_items=1)
+    # Same key => same invoice: a retried request returns the original row
+    idempotency_key: Optional[constr(strip_whitespace=True, min_length=1, max_length=200)] = None
+
+
+class InvoiceBatch(BaseModel):
+    # POST /invoices/batch: many carts in one request (e.g. a store flushing at closing time)
+    invoices: List[InvoiceCreate] = Field(..., min_items=1, max_items=500)
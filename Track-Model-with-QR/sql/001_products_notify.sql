@@ -0,0 +1,31 @@
+-- Notify listeners (api.py's ProductCatalog) whenever the products table changes.
+-- Apply with: psql "$connectionURL" -f sql/001_products_notify.sql
+--
+-- Payload: {"op": "INSERT" | "UPDATE" | "DELETE", "id": "<product id>"}
+-- TRUNCATE sends {"op": "TRUNCATE"} once per statement.
+
+CREATE OR REPLACE FUNCTION notify_products_changed() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+  IF TG_OP = 'TRUNCATE' THEN
+    PERFORM pg_notify('products_changed', json_build_object('op', TG_OP)::text);
+    RETURN NULL;
+  END IF;
+
+  PERFORM pg_notify(
+    'products_changed',
+    json_build_object('op', TG_OP, 'id', COALESCE(NEW.id, OLD.id))::text
+  );
+  RETURN NULL;
+END
+$$;
+
+DROP TRIGGER IF EXISTS products_changed ON products;
+CREATE TRIGGER products_changed
+  AFTER INSERT OR UPDATE OR DELETE ON products
+  FOR EACH ROW EXECUTE FUNCTION notify_products_changed();
+
+DROP TRIGGER IF EXISTS products_truncated ON products;
+CREATE TRIGGER products_truncated
+  AFTER TRUNCATE ON products
+  FOR EACH STATEMENT EXECUTE FUNCTION notify_products_changed();
@@ -0,0 +1,10 @@
+-- Client-supplied idempotency keys for POST /invoices and /invoices/batch.
+-- Apply with: psql "$connectionURL" -f sql/002_invoice_idempotency.sql
+-- (CREATE INDEX CONCURRENTLY cannot run inside a transaction; psql -f runs
+-- each statement on its own.)
+
+ALTER TABLE invoices ADD COLUMN IF NOT EXISTS idempotency_key TEXT;
+
+CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS invoices_idempotency_key_uidx
+  ON invoices (idempotency_key)
+  WHERE idempotency_key IS NOT NULL;
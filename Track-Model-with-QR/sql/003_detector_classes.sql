@@ -0,0 +1,30 @@
+-- Detector class -> product mapping served to vision nodes by GET /catalog/classes.
+-- Apply with: psql "$connectionURL" -f sql/003_detector_classes.sql
+-- Rows are created per model with: python class_map.py --sync <weights.pt>
+
+CREATE TABLE IF NOT EXISTS detector_classes (
+    model        TEXT    NOT NULL,   -- weights file name, as in cameras.json "models.items"
+    class_index  INTEGER NOT NULL,   -- index into item_model.names
+    class_name   TEXT    NOT NULL,   -- item_model.names[class_index]
+    product_id   TEXT    REFERENCES products(id) ON DELETE SET NULL,
+    display_name TEXT,               -- shown to shoppers (Arabic); falls back to products.name
+    PRIMARY KEY (model, class_index)
+);
+
+-- One notification per statement on the catalog channel; ProductCatalog
+-- reloads the class maps when it sees table = detector_classes.
+CREATE OR REPLACE FUNCTION notify_detector_classes_changed() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+  PERFORM pg_notify(
+    'products_changed',
+    json_build_object('op', TG_OP, 'table', 'detector_classes')::text
+  );
+  RETURN NULL;
+END
+$$;
+
+DROP TRIGGER IF EXISTS detector_classes_changed ON detector_classes;
+CREATE TRIGGER detector_classes_changed
+  AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON detector_classes
+  FOR EACH STATEMENT EXECUTE FUNCTION notify_detector_classes_changed();
@@ -0,0 +1,62 @@
+-- Per-user invoice history (GET /users/{id}/invoices) and O(1) summaries
+-- (GET /users/{id}/summary).
+-- Apply with: psql "$connectionURL" -f sql/004_user_invoice_history.sql
+
+-- Newest-first history for one user, read by an index-only scan: the list
+-- endpoint only returns columns that are in the index.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS invoices_user_ts_idx
+  ON invoices (user_id, "timestamp" DESC, id DESC)
+  INCLUDE (total_amount, status, branch_id);
+
+CREATE TABLE IF NOT EXISTS user_invoice_summary (
+    user_id        UUID PRIMARY KEY REFERENCES users(id) ON DELETE CASCADE,
+    invoice_count  INTEGER     NOT NULL DEFAULT 0,
+    lifetime_spend NUMERIC     NOT NULL DEFAULT 0,
+    first_visit    TIMESTAMPTZ,
+    last_visit     TIMESTAMPTZ
+);
+
+-- Kept by trigger rather than in api.py so invoices written by the web app
+-- (database.js createInvoice) are counted too. Deletes and moves only adjust
+-- count/spend; last_visit stays a high-water mark.
+CREATE OR REPLACE FUNCTION apply_user_invoice_summary(_user UUID, _count INTEGER,
+                                                      _spend NUMERIC, _ts TIMESTAMPTZ)
+RETURNS void LANGUAGE sql AS $$
+  INSERT INTO user_invoice_summary AS s (user_id, invoice_count, lifetime_spend, first_visit, last_visit)
+  VALUES (_user, _count, _spend, _ts, _ts)
+  ON CONFLICT (user_id) DO UPDATE
+  SET invoice_count  = s.invoice_count + EXCLUDED.invoice_count,
+      lifetime_spend = s.lifetime_spend + EXCLUDED.lifetime_spend,
+      first_visit    = LEAST(s.first_visit, EXCLUDED.first_visit),
+      last_visit     = GREATEST(s.last_visit, EXCLUDED.last_visit);
+$$;
+
+CREATE OR REPLACE FUNCTION track_user_invoice_summary() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+  IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.user_id IS NOT NULL THEN
+    PERFORM apply_user_invoice_summary(OLD.user_id, -1, -COALESCE(OLD.total_amount, 0), NULL);
+  END IF;
+  IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.user_id IS NOT NULL THEN
+    PERFORM apply_user_invoice_summary(NEW.user_id, 1, COALESCE(NEW.total_amount, 0), NEW."timestamp");
+  END IF;
+  RETURN NULL;
+END
+$$;
+
+DROP TRIGGER IF EXISTS user_invoice_summary ON invoices;
+CREATE TRIGGER user_invoice_summary
+  AFTER INSERT OR DELETE OR UPDATE OF user_id, total_amount ON invoices
+  FOR EACH ROW EXECUTE FUNCTION track_user_invoice_summary();
+
+-- Backfill from existing invoices (run before traffic, or re-run: it recomputes)
+INSERT INTO user_invoice_summary (user_id, invoice_count, lifetime_spend, first_visit, last_visit)
+SELECT user_id, count(*), COALESCE(sum(total_amount), 0), min("timestamp"), max("timestamp")
+FROM invoices
+WHERE user_id IS NOT NULL
+GROUP BY user_id
+ON CONFLICT (user_id) DO UPDATE
+SET invoice_count  = EXCLUDED.invoice_count,
+    lifetime_spend = EXCLUDED.lifetime_spend,
+    first_visit    = EXCLUDED.first_visit,
+    last_visit     = EXCLUDED.last_visit;
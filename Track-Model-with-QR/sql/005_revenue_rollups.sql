@@ -0,0 +1,62 @@
+-- Daily revenue rollup behind GET /stats/revenue (admin dashboard).
+-- Apply with: psql "$connectionURL" -f sql/005_revenue_rollups.sql
+--
+-- One row per (day, branch, status). Days are the invoice timestamp's date
+-- as stored. Invoices without a branch are counted under the all-zero UUID.
+
+CREATE TABLE IF NOT EXISTS revenue_daily (
+    day       DATE    NOT NULL,
+    branch_id UUID    NOT NULL,
+    status    TEXT    NOT NULL,
+    orders    BIGINT  NOT NULL DEFAULT 0,
+    revenue   NUMERIC NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, branch_id, status)
+);
+
+CREATE OR REPLACE FUNCTION apply_revenue_daily(_ts TIMESTAMPTZ, _branch UUID, _status TEXT,
+                                               _orders INTEGER, _revenue NUMERIC)
+RETURNS void LANGUAGE sql AS $$
+  INSERT INTO revenue_daily AS r (day, branch_id, status, orders, revenue)
+  VALUES (COALESCE(_ts, now())::date,
+          COALESCE(_branch, '00000000-0000-0000-0000-000000000000'),
+          COALESCE(_status, ''),
+          _orders, _revenue)
+  ON CONFLICT (day, branch_id, status) DO UPDATE
+  SET orders  = r.orders + EXCLUDED.orders,
+      revenue = r.revenue + EXCLUDED.revenue;
+$$;
+
+-- Same trigger pattern as user_invoice_summary (sql/004): every writer of
+-- invoices, including the web app's status updates, keeps the rollup current.
+CREATE OR REPLACE FUNCTION track_revenue_daily() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+  IF TG_OP IN ('UPDATE', 'DELETE') THEN
+    PERFORM apply_revenue_daily(OLD."timestamp", OLD.branch_id, OLD.status::text,
+                                -1, -COALESCE(OLD.total_amount, 0));
+  END IF;
+  IF TG_OP IN ('INSERT', 'UPDATE') THEN
+    PERFORM apply_revenue_daily(NEW."timestamp", NEW.branch_id, NEW.status::text,
+                                1, COALESCE(NEW.total_amount, 0));
+  END IF;
+  RETURN NULL;
+END
+$$;
+
+DROP TRIGGER IF EXISTS revenue_daily ON invoices;
+CREATE TRIGGER revenue_daily
+  AFTER INSERT OR DELETE OR UPDATE OF "timestamp", branch_id, status, total_amount ON invoices
+  FOR EACH ROW EXECUTE FUNCTION track_revenue_daily();
+
+-- Backfill (re-runnable: recomputes every bucket that has invoices)
+INSERT INTO revenue_daily (day, branch_id, status, orders, revenue)
+SELECT COALESCE("timestamp", now())::date,
+       COALESCE(branch_id, '00000000-0000-0000-0000-000000000000'),
+       COALESCE(status::text, ''),
+       count(*),
+       COALESCE(sum(total_amount), 0)
+FROM invoices
+GROUP BY 1, 2, 3
+ON CONFLICT (day, branch_id, status) DO UPDATE
+SET orders  = EXCLUDED.orders,
+    revenue = EXCLUDED.revenue;
@@ -0,0 +1,69 @@
+-- Normalized invoice lines for product-level analytics (GET /stats/products).
+-- Apply with: psql "$connectionURL" -f sql/006_invoice_lines.sql
+--
+-- Lines are written by an invoices trigger, inside the same transaction as
+-- the invoice: the API's single-statement create, /invoices/batch and
+-- invoices the web app inserts directly all get lines. invoice_ts and
+-- branch_id are copied from the invoice so time-range aggregates never
+-- touch invoices.
+
+CREATE TABLE IF NOT EXISTS invoice_lines (
+    invoice_id UUID    NOT NULL REFERENCES invoices(id) ON DELETE CASCADE,
+    line_no    INTEGER NOT NULL,
+    invoice_ts TIMESTAMPTZ NOT NULL,
+    branch_id  UUID,
+    product_id TEXT    NOT NULL,
+    qty        INTEGER NOT NULL,
+    unit_price NUMERIC NOT NULL,
+    PRIMARY KEY (invoice_id, line_no)
+);
+
+CREATE INDEX IF NOT EXISTS invoice_lines_product_ts_idx
+  ON invoice_lines (product_id, invoice_ts) INCLUDE (qty, unit_price);
+CREATE INDEX IF NOT EXISTS invoice_lines_ts_idx
+  ON invoice_lines (invoice_ts) INCLUDE (product_id, qty, unit_price);
+
+-- Accepts both JSON shapes in use: the API's {product_id, quantity, unit_price}
+-- and normalize_invoice_or_ticket_items' {product_id, qty} (priced from products).
+CREATE OR REPLACE FUNCTION write_invoice_lines() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+  IF TG_OP = 'UPDATE' THEN
+    DELETE FROM invoice_lines WHERE invoice_id = OLD.id;
+  END IF;
+
+  IF jsonb_typeof(NEW.products_and_quantities) = 'array' THEN
+    INSERT INTO invoice_lines (invoice_id, line_no, invoice_ts, branch_id, product_id, qty, unit_price)
+    SELECT NEW.id, e.ord, COALESCE(NEW."timestamp", now()), NEW.branch_id,
+           e.item ->> 'product_id',
+           COALESCE(e.item ->> 'quantity', e.item ->> 'qty')::int,
+           COALESCE((e.item ->> 'unit_price')::numeric, p.price, 0)
+    FROM jsonb_array_elements(NEW.products_and_quantities) WITH ORDINALITY AS e(item, ord)
+    LEFT JOIN products p ON p.id = e.item ->> 'product_id'
+    WHERE e.item ->> 'product_id' IS NOT NULL
+      AND COALESCE(e.item ->> 'quantity', e.item ->> 'qty') IS NOT NULL;
+  END IF;
+  RETURN NULL;
+END
+$$;
+
+DROP TRIGGER IF EXISTS invoice_lines ON invoices;
+CREATE TRIGGER invoice_lines
+  AFTER INSERT OR UPDATE OF products_and_quantities, "timestamp", branch_id ON invoices
+  FOR EACH ROW EXECUTE FUNCTION write_invoice_lines();
+
+-- Backfill invoices that have no lines yet
+INSERT INTO invoice_lines (invoice_id, line_no, invoice_ts, branch_id, product_id, qty, unit_price)
+SELECT i.id, e.ord, COALESCE(i."timestamp", now()), i.branch_id,
+       e.item ->> 'product_id',
+       COALESCE(e.item ->> 'quantity', e.item ->> 'qty')::int,
+       COALESCE((e.item ->> 'unit_price')::numeric, p.price, 0)
+FROM invoices i
+CROSS JOIN LATERAL jsonb_array_elements(
+    CASE WHEN jsonb_typeof(i.products_and_quantities) = 'array'
+         THEN i.products_and_quantities ELSE '[]'::jsonb END
+) WITH ORDINALITY AS e(item, ord)
+LEFT JOIN products p ON p.id = e.item ->> 'product_id'
+WHERE e.item ->> 'product_id' IS NOT NULL
+  AND COALESCE(e.item ->> 'quantity', e.item ->> 'qty') IS NOT NULL
+  AND NOT EXISTS (SELECT 1 FROM invoice_lines l WHERE l.invoice_id = i.id);
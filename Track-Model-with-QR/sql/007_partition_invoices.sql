@@ -0,0 +1,318 @@
+-- Monthly range partitioning of invoices (and invoice_lines) on "timestamp".
+-- Apply with: psql "$connectionURL" -f sql/007_partition_invoices.sql
+--
+-- Runs in one transaction holding ACCESS EXCLUSIVE on invoices, invoice_lines
+-- and tickets while rows are copied (roughly a minute per 10M invoices), so
+-- stop the API and run it in a quiet window. Afterwards:
+--   - invoices is partitioned by month (invoices_YYYY_MM, plus invoices_default
+--     for anything outside the created months); its primary key is (id, "timestamp")
+--   - invoice_lines is partitioned the same way on invoice_ts, so a month's
+--     lines live next to its invoices
+--   - idempotency keys move to invoice_idempotency_keys: a unique index on a
+--     partitioned table must contain the partition key, so invoices can no
+--     longer enforce them itself
+--   - tickets reference invoices by (invoice_id, invoice_ts), filled in by trigger
+--   - ensure_invoice_partitions(from, to) creates months ahead of time (scheduled
+--     monthly when pg_cron is installed); archive_invoice_month(month) detaches
+--     a month into the invoice_archive schema instead of a large DELETE
+-- The old tables are kept as invoices_unpartitioned / invoice_lines_unpartitioned
+-- (triggers disabled). Drop them once the new ones are verified:
+--   DROP TABLE invoices_unpartitioned, invoice_lines_unpartitioned CASCADE;
+--
+-- Not sub-partitioned by branch_id: with a handful of branches it would multiply
+-- the partition count without helping the per-user and per-month queries, and
+-- per-branch dashboards already read revenue_daily (sql/005).
+-- loadtest/partition_bench.py compares plans before and after on 10M invoices.
+
+BEGIN;
+
+SET LOCAL lock_timeout = '10s';
+LOCK TABLE invoices, invoice_lines, tickets IN ACCESS EXCLUSIVE MODE;
+
+ALTER TABLE invoices RENAME TO invoices_unpartitioned;
+ALTER TABLE invoice_lines RENAME TO invoice_lines_unpartitioned;
+ALTER TABLE invoices_unpartitioned DISABLE TRIGGER USER;
+
+-- Free the index names (invoices_pkey, invoices_user_ts_idx, ...) for the new tables
+DO $$
+DECLARE
+  r RECORD;
+BEGIN
+  FOR r IN
+    SELECT i.relname
+    FROM pg_index x
+    JOIN pg_class i ON i.oid = x.indexrelid
+    WHERE x.indrelid IN ('invoices_unpartitioned'::regclass, 'invoice_lines_unpartitioned'::regclass)
+  LOOP
+    EXECUTE format('ALTER INDEX %I RENAME TO %I', r.relname, left(r.relname, 50) || '_unpartitioned');
+  END LOOP;
+END
+$$;
+
+-- ---------- new tables
+
+CREATE TABLE invoices (
+    LIKE invoices_unpartitioned INCLUDING DEFAULTS INCLUDING CONSTRAINTS INCLUDING GENERATED INCLUDING COMMENTS
+) PARTITION BY RANGE ("timestamp");
+ALTER TABLE invoices ALTER COLUMN "timestamp" SET NOT NULL;
+ALTER TABLE invoices ADD PRIMARY KEY (id, "timestamp");
+CREATE TABLE invoices_default PARTITION OF invoices DEFAULT;
+
+-- Same index as sql/004, now one per partition
+CREATE INDEX invoices_user_ts_idx
+  ON invoices (user_id, "timestamp" DESC, id DESC)
+  INCLUDE (total_amount, status, branch_id);
+
+-- invoice_ts is a plain TIMESTAMP like invoices."timestamp", so the two compare
+-- exactly whatever the session time zone
+CREATE TABLE invoice_lines (
+    invoice_id UUID      NOT NULL,
+    line_no    INTEGER   NOT NULL,
+    invoice_ts TIMESTAMP NOT NULL,
+    branch_id  UUID,
+    product_id TEXT      NOT NULL,
+    qty        INTEGER   NOT NULL,
+    unit_price NUMERIC   NOT NULL,
+    PRIMARY KEY (invoice_id, invoice_ts, line_no)
+) PARTITION BY RANGE (invoice_ts);
+CREATE TABLE invoice_lines_default PARTITION OF invoice_lines DEFAULT;
+
+CREATE INDEX invoice_lines_product_ts_idx
+  ON invoice_lines (product_id, invoice_ts) INCLUDE (qty, unit_price);
+CREATE INDEX invoice_lines_ts_idx
+  ON invoice_lines (invoice_ts) INCLUDE (product_id, qty, unit_price);
+
+-- Claimed in the same statement that inserts the invoice (see api.py)
+CREATE TABLE invoice_idempotency_keys (
+    key        TEXT PRIMARY KEY,
+    invoice_id UUID        NOT NULL,
+    invoice_ts TIMESTAMP   NOT NULL,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+CREATE INDEX invoice_idempotency_keys_ts_idx ON invoice_idempotency_keys (invoice_ts);
+
+-- ---------- partition management
+
+-- Create the invoices and invoice_lines partitions for every month from _from
+-- through _to that does not exist yet. Returns how many months were added.
+-- Fails if invoices_default already holds rows for a month being created:
+-- keep months created ahead of time so the default partition stays empty.
+CREATE OR REPLACE FUNCTION ensure_invoice_partitions(_from DATE, _to DATE)
+RETURNS integer LANGUAGE plpgsql AS $$
+DECLARE
+  m     DATE := date_trunc('month', _from)::date;
+  added INTEGER := 0;
+BEGIN
+  WHILE m <= _to LOOP
+    IF to_regclass(format('public.invoices_%s', to_char(m, 'YYYY_MM'))) IS NULL THEN
+      EXECUTE format('CREATE TABLE public.%I PARTITION OF public.invoices FOR VALUES FROM (%L) TO (%L)',
+                     'invoices_' || to_char(m, 'YYYY_MM'), m, (m + interval '1 month')::date);
+      EXECUTE format('CREATE TABLE public.%I PARTITION OF public.invoice_lines FOR VALUES FROM (%L) TO (%L)',
+                     'invoice_lines_' || to_char(m, 'YYYY_MM'), m, (m + interval '1 month')::date);
+      added := added + 1;
+    END IF;
+    m := (m + interval '1 month')::date;
+  END LOOP;
+  RETURN added;
+END
+$$;
+
+CREATE SCHEMA IF NOT EXISTS invoice_archive;
+
+-- Move one month out of the live tables: a metadata-only detach instead of a
+-- DELETE of every row. The tables land in invoice_archive (pg_dump them and
+-- drop them from there). Fails while tickets still reference the month.
+-- user_invoice_summary and revenue_daily keep counting the archived invoices.
+CREATE OR REPLACE FUNCTION archive_invoice_month(_month DATE)
+RETURNS void LANGUAGE plpgsql AS $$
+DECLARE
+  lo     TIMESTAMP := date_trunc('month', _month);
+  suffix TEXT := to_char(_month, 'YYYY_MM');
+BEGIN
+  IF to_regclass('public.invoices_' || suffix) IS NULL THEN
+    RAISE EXCEPTION 'No invoices partition for %', suffix;
+  END IF;
+  EXECUTE format('ALTER TABLE public.invoice_lines DETACH PARTITION public.%I', 'invoice_lines_' || suffix);
+  EXECUTE format('ALTER TABLE public.%I SET SCHEMA invoice_archive', 'invoice_lines_' || suffix);
+  EXECUTE format('ALTER TABLE public.invoices DETACH PARTITION public.%I', 'invoices_' || suffix);
+  EXECUTE format('ALTER TABLE public.%I SET SCHEMA invoice_archive', 'invoices_' || suffix);
+  DELETE FROM invoice_idempotency_keys WHERE invoice_ts >= lo AND invoice_ts < lo + interval '1 month';
+END
+$$;
+
+-- Every month that has invoices, and three ahead
+SELECT ensure_invoice_partitions(
+  COALESCE((SELECT min("timestamp") FROM invoices_unpartitioned)::date, current_date),
+  (current_date + interval '3 months')::date
+);
+
+-- ---------- copy
+
+-- The column defaults to now(); rows without one go to invoices_default
+UPDATE invoices_unpartitioned SET "timestamp" = '1970-01-01' WHERE "timestamp" IS NULL;
+
+INSERT INTO invoices SELECT * FROM invoices_unpartitioned;
+
+INSERT INTO invoice_lines (invoice_id, line_no, invoice_ts, branch_id, product_id, qty, unit_price)
+SELECT l.invoice_id, l.line_no, i."timestamp", l.branch_id, l.product_id, l.qty, l.unit_price
+FROM invoice_lines_unpartitioned l
+JOIN invoices_unpartitioned i ON i.id = l.invoice_id;
+
+INSERT INTO invoice_idempotency_keys (key, invoice_id, invoice_ts)
+SELECT DISTINCT ON (idempotency_key) idempotency_key, id, "timestamp"
+FROM invoices_unpartitioned
+WHERE idempotency_key IS NOT NULL
+ORDER BY idempotency_key, "timestamp";
+
+-- ---------- constraints, triggers, access: carried over from the old table
+-- (after the copy, so the rollup triggers do not count every row twice)
+
+CREATE OR REPLACE FUNCTION write_invoice_lines() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+  IF TG_OP IN ('UPDATE', 'DELETE') THEN
+    -- invoice_ts pins the partition
+    DELETE FROM invoice_lines WHERE invoice_id = OLD.id AND invoice_ts = OLD."timestamp";
+  END IF;
+  IF TG_OP = 'DELETE' THEN
+    RETURN NULL;
+  END IF;
+
+  IF jsonb_typeof(NEW.products_and_quantities) = 'array' THEN
+    INSERT INTO invoice_lines (invoice_id, line_no, invoice_ts, branch_id, product_id, qty, unit_price)
+    SELECT NEW.id, e.ord, NEW."timestamp", NEW.branch_id,
+           e.item ->> 'product_id',
+           COALESCE(e.item ->> 'quantity', e.item ->> 'qty')::int,
+           COALESCE((e.item ->> 'unit_price')::numeric, p.price, 0)
+    FROM jsonb_array_elements(NEW.products_and_quantities) WITH ORDINALITY AS e(item, ord)
+    LEFT JOIN products p ON p.id = e.item ->> 'product_id'
+    WHERE e.item ->> 'product_id' IS NOT NULL
+      AND COALESCE(e.item ->> 'quantity', e.item ->> 'qty') IS NOT NULL;
+  END IF;
+  RETURN NULL;
+END
+$$;
+
+DO $$
+DECLARE
+  r RECORD;
+BEGIN
+  -- Foreign keys to users / branches / payment_methods (the web app embeds branches through them)
+  FOR r IN
+    SELECT conname, pg_get_constraintdef(oid) AS def
+    FROM pg_constraint
+    WHERE conrelid = 'invoices_unpartitioned'::regclass AND contype = 'f'
+  LOOP
+    EXECUTE format('ALTER TABLE invoices ADD CONSTRAINT %I %s', r.conname, r.def);
+  END LOOP;
+
+  -- user_invoice_summary, revenue_daily and any other user trigger; invoice_lines
+  -- is recreated below with DELETE handling (the old foreign key cascade)
+  FOR r IN
+    SELECT pg_get_triggerdef(oid) AS def
+    FROM pg_trigger
+    WHERE tgrelid = 'invoices_unpartitioned'::regclass AND NOT tgisinternal AND tgname <> 'invoice_lines'
+  LOOP
+    EXECUTE replace(r.def, ' ON public.invoices_unpartitioned ', ' ON public.invoices ');
+  END LOOP;
+
+  -- Row level security and policies
+  IF (SELECT relrowsecurity FROM pg_class WHERE oid = 'invoices_unpartitioned'::regclass) THEN
+    ALTER TABLE invoices ENABLE ROW LEVEL SECURITY;
+  END IF;
+  FOR r IN
+    SELECT * FROM pg_policies WHERE schemaname = 'public' AND tablename = 'invoices_unpartitioned'
+  LOOP
+    EXECUTE format('CREATE POLICY %I ON invoices AS %s FOR %s TO %s%s%s',
+                   r.policyname, r.permissive, r.cmd,
+                   (SELECT string_agg(quote_ident(x), ', ') FROM unnest(r.roles) AS x),
+                   COALESCE(' USING (' || r.qual || ')', ''),
+                   COALESCE(' WITH CHECK (' || r.with_check || ')', ''));
+  END LOOP;
+
+  -- Grants (anon / authenticated / service_role on Supabase)
+  FOR r IN
+    SELECT n.new_name, a.privilege_type,
+           CASE WHEN a.grantee = 0 THEN 'PUBLIC' ELSE quote_ident(pg_get_userbyid(a.grantee)) END AS grantee
+    FROM (VALUES ('invoices_unpartitioned', 'invoices'),
+                 ('invoice_lines_unpartitioned', 'invoice_lines')) AS n(old_name, new_name)
+    JOIN pg_class c ON c.oid = to_regclass(n.old_name)
+    CROSS JOIN LATERAL aclexplode(c.relacl) AS a
+    WHERE a.grantee <> c.relowner
+  LOOP
+    EXECUTE format('GRANT %s ON %I TO %s', r.privilege_type, r.new_name, r.grantee);
+  END LOOP;
+END
+$$;
+
+CREATE TRIGGER invoice_lines
+  AFTER INSERT OR DELETE OR UPDATE OF products_and_quantities, "timestamp", branch_id ON invoices
+  FOR EACH ROW EXECUTE FUNCTION write_invoice_lines();
+
+-- ---------- tickets
+
+-- A foreign key to a partitioned table must cover its primary key, so tickets
+-- carry the invoice's timestamp too. The web app only sends invoice_id; this
+-- trigger fills invoice_ts (and reports unknown invoices as the old key did).
+ALTER TABLE tickets ADD COLUMN IF NOT EXISTS invoice_ts TIMESTAMP;
+
+CREATE OR REPLACE FUNCTION set_ticket_invoice_ts() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+  IF NEW.invoice_id IS NULL THEN
+    NEW.invoice_ts := NULL;
+    RETURN NEW;
+  END IF;
+  SELECT "timestamp" INTO NEW.invoice_ts FROM invoices WHERE id = NEW.invoice_id;
+  IF NOT FOUND THEN
+    RAISE foreign_key_violation USING MESSAGE = format('invoice %s does not exist', NEW.invoice_id);
+  END IF;
+  RETURN NEW;
+END
+$$;
+
+DROP TRIGGER IF EXISTS ticket_invoice_ts ON tickets;
+CREATE TRIGGER ticket_invoice_ts
+  BEFORE INSERT OR UPDATE OF invoice_id ON tickets
+  FOR EACH ROW EXECUTE FUNCTION set_ticket_invoice_ts();
+
+UPDATE tickets t
+SET invoice_ts = i."timestamp"
+FROM invoices i
+WHERE i.id = t.invoice_id;
+
+DO $$
+DECLARE
+  r RECORD;
+BEGIN
+  FOR r IN
+    SELECT conname FROM pg_constraint
+    WHERE conrelid = 'tickets'::regclass AND confrelid = 'invoices_unpartitioned'::regclass
+  LOOP
+    EXECUTE format('ALTER TABLE tickets DROP CONSTRAINT %I', r.conname);
+  END LOOP;
+END
+$$;
+
+-- Same name PostgREST resolves tickets -> invoices embeds through
+ALTER TABLE tickets
+  ADD CONSTRAINT tickets_invoice_id_fkey FOREIGN KEY (invoice_id, invoice_ts)
+  REFERENCES invoices (id, "timestamp") ON UPDATE CASCADE;
+
+COMMIT;
+
+ANALYZE invoices;
+ANALYZE invoice_lines;
+ANALYZE invoice_idempotency_keys;
+
+-- Keep three months of partitions ahead (Supabase: enable pg_cron under Database > Extensions)
+DO $$
+BEGIN
+  IF EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_cron') THEN
+    PERFORM cron.schedule(
+      'ensure-invoice-partitions', '0 3 1 * *',
+      $job$SELECT ensure_invoice_partitions(current_date, (current_date + interval '3 months')::date)$job$
+    );
+  END IF;
+END
+$$;
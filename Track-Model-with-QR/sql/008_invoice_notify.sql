@@ -0,0 +1,42 @@
+-- Announce new invoices (and status changes) to api.py's InvoiceFeed, which
+-- fans them out to the admin pages over GET /invoices/stream.
+-- Apply with: psql "$connectionURL" -f sql/008_invoice_notify.sql
+--
+-- Payload (well under NOTIFY's 8000-byte limit, whatever the basket size):
+--   {"seq", "op": "INSERT" | "UPDATE", "id", "user_id", "branch_id", "timestamp",
+--    "total_amount", "status", "items_count"}
+-- seq numbers every change once, and is the SSE event id: the same on every
+-- API worker and never reused, even when an invoice returns to an earlier status.
+-- Notifications are sent at commit, so a rolled-back invoice is never announced.
+
+CREATE SEQUENCE IF NOT EXISTS invoice_events_seq;
+
+CREATE OR REPLACE FUNCTION notify_invoices_changed() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+  -- row_to_json: no padding spaces, unlike json_build_object
+  PERFORM pg_notify('invoices_changed', (
+    SELECT row_to_json(e)::text FROM (
+      SELECT nextval('invoice_events_seq') AS seq, TG_OP AS op, NEW.id, NEW.user_id, NEW.branch_id, NEW."timestamp",
+             NEW.total_amount, NEW.status,
+             CASE WHEN jsonb_typeof(NEW.products_and_quantities) = 'array' THEN
+               (SELECT COALESCE(sum(COALESCE(i ->> 'quantity', i ->> 'qty')::int), 0)
+                  FROM jsonb_array_elements(NEW.products_and_quantities) AS i)
+             END AS items_count
+    ) e
+  ));
+  RETURN NULL;
+END
+$$;
+
+-- On the partitioned parent (sql/007), so every current and future partition fires it
+DROP TRIGGER IF EXISTS invoices_created ON invoices;
+CREATE TRIGGER invoices_created
+  AFTER INSERT ON invoices
+  FOR EACH ROW EXECUTE FUNCTION notify_invoices_changed();
+
+DROP TRIGGER IF EXISTS invoices_status_changed ON invoices;
+CREATE TRIGGER invoices_status_changed
+  AFTER UPDATE OF status ON invoices
+  FOR EACH ROW WHEN (OLD.status IS DISTINCT FROM NEW.status)
+  EXECUTE FUNCTION notify_invoices_changed();
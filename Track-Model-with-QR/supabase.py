@@ -1,7 +1,13 @@
 import os
+import time
+import uuid
 from pathlib import Path
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv, find_dotenv
 import psycopg2
+import psycopg
+from psycopg_pool import AsyncConnectionPool
+import asyncio
 
 dotenv_path = find_dotenv(usecwd=True) or str(Path(__file__).with_name(".env"))
 load_dotenv(dotenv_path)
@@ -10,20 +16,263 @@ def _env(key: str, default: str = "") -> str:
     val = os.getenv(key, default)
     return (val or "").strip()
 
-def get_connection():
+POOL_MIN = int(_env("DB_POOL_MIN", "1"))
+POOL_MAX = int(_env("DB_POOL_MAX", "10"))
+POOL_TIMEOUT_S = float(_env("DB_POOL_TIMEOUT_S", "10"))      # wait for a free connection
+POOL_RECYCLE_S = float(_env("DB_POOL_RECYCLE_S", "1800"))    # reopen connections older than this
+POOL_PING_AFTER_S = float(_env("DB_POOL_PING_AFTER_S", "30"))  # SELECT 1 if idle longer than this
+# The transaction-mode pooler hands each transaction to any server connection, where a
+# statement psycopg prepared on another one does not exist: server-side prepares stay
+# off unless DB_PREPARE_THRESHOLD is set (e.g. 5 on the session pooler or direct host)
+PREPARE_THRESHOLD = int(_env("DB_PREPARE_THRESHOLD")) if _env("DB_PREPARE_THRESHOLD") else None
+# LISTEN needs a session that stays put: the transaction-mode pooler cannot hold one,
+# so point this at the session pooler or the direct host (defaults to connectionURL)
+LISTEN_URL_ENV = "DB_LISTEN_URL"
+# Optional streaming replica for read-only endpoints (unset = everything goes to connectionURL)
+REPLICA_URL_ENV = "DB_REPLICA_URL"
+REPLICA_MAX_LAG_S = float(_env("DB_REPLICA_MAX_LAG_S", "0"))  # >0: use the primary while the replica lags more
+REPLICA_POLL_S = float(_env("DB_REPLICA_POLL_S", "1"))        # how often replay position / lag are sampled
+READ_YOUR_WRITES_S = 60.0   # forget a user's last write LSN after this long
+
+def _dsn() -> str:
     host = _env("DB_HOST")
-    port = _env("DB_PORT", "5432")
-    name = _env("DB_NAME")
-    user = _env("DB_USER")
-    pw   = _env("DB_PASS")
     fullstring = _env("connectionURL")
 
     # Fail fast if host is missing; prevents accidental localhost fallback
-    if not host or host.lower() in ("localhost", "127.0.0.1", "::1"):
+    # (DB_ALLOW_LOCAL=1 opts in, e.g. for loadtest/ against a throwaway Postgres)
+    local_ok = _env("DB_ALLOW_LOCAL") == "1"
+    if not host or (host.lower() in ("localhost", "127.0.0.1", "::1") and not local_ok):
         raise RuntimeError(
             f"Invalid DB_HOST={host!r}. Check your .env is loaded and points to the Pooler host."
         )
+    return fullstring
+
+def get_connection():
+    """
+    A new, unpooled connection. Fine for one-off scripts (audit.py);
+    request handlers should use async_connection() instead.
+    """
+    return psycopg2.connect(_dsn())
+
+
+# =========================
+# Async pool (FastAPI handlers)
+# =========================
+_async_pool: AsyncConnectionPool | None = None
+_async_returned: dict[int, float] = {}  # id(conn) -> time last put back
+
+async def _async_check(conn: psycopg.AsyncConnection):
+    """
+    Checkout health check: only pay a round-trip when the connection sat idle
+    long enough to have been dropped. The pool itself handles max_lifetime
+    recycling and broken-connection discards.
+    """
+    idle_since = _async_returned.get(id(conn))
+    if idle_since is not None and time.monotonic() - idle_since > POOL_PING_AFTER_S:
+        await conn.execute("SELECT 1;")
+        await conn.rollback()
+
+async def _async_reset(conn: psycopg.AsyncConnection):
+    _async_returned[id(conn)] = time.monotonic()
+
+async def open_async_pool() -> AsyncConnectionPool:
+    """
+    Open the process-wide async pool; call once from the app's lifespan.
+    """
+    global _async_pool
+    if _async_pool is None:
+        _async_pool = AsyncConnectionPool(
+            _dsn(),
+            min_size=POOL_MIN,
+            max_size=POOL_MAX,
+            timeout=POOL_TIMEOUT_S,
+            max_lifetime=POOL_RECYCLE_S,
+            check=_async_check,
+            reset=_async_reset,
+            kwargs={"prepare_threshold": PREPARE_THRESHOLD},
+            open=False,
+        )
+        await _async_pool.open(wait=True)
+        await _open_replica_pool()
+    return _async_pool
+
+async def close_async_pool():
+    global _async_pool
+    await _close_replica_pool()
+    if _async_pool is not None:
+        await _async_pool.close()
+        _async_pool = None
+        _async_returned.clear()
+
+@asynccontextmanager
+async def async_connection():
+    """
+    Check a connection out of the process-wide async pool:
+
+        async with async_connection() as conn:
+            cur = await conn.execute(...)
+
+    Commits on normal exit, rolls back on error.
+    """
+    if _async_pool is None:
+        raise RuntimeError("Async pool not open; call open_async_pool() first")
+    async with _async_pool.connection() as conn:
+        yield conn
+
+async def open_listen_connection() -> psycopg.AsyncConnection:
+    """
+    A dedicated autocommit connection for LISTEN, outside the pool so a
+    long-lived listener never holds a request slot.
+    """
+    return await psycopg.AsyncConnection.connect(_env(LISTEN_URL_ENV) or _dsn(), autocommit=True)
+
+
+# =========================
+# Read replica routing
+# =========================
+_replica_pool: AsyncConnectionPool | None = None
+_replica_poller: asyncio.Task | None = None
+_replica_lsn = 0                      # last sampled replay position
+_replica_lag_s = float("inf")         # last sampled lag; inf = unknown / unreachable
+_replica_sampled_at = 0.0
+_user_write_lsn: dict[str, tuple[int, float]] = {}   # _user_key(user_id) -> (commit LSN, time written)
+_routed = {"replica": 0, "primary_lag": 0, "primary_own_write": 0, "primary_no_replica": 0}
+
+REPLICA_STATE_SQL = """
+    SELECT CASE WHEN pg_is_in_recovery() THEN pg_last_wal_replay_lsn()
+                ELSE pg_current_wal_lsn() END::text AS lsn,
+           CASE WHEN NOT pg_is_in_recovery()
+                  OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                ELSE extract(epoch FROM now() - pg_last_xact_replay_timestamp())
+           END AS lag_s;
+"""
+
+def _lsn(text: str) -> int:
+    hi, lo = text.split("/")
+    return (int(hi, 16) << 32) | int(lo, 16)
+
+async def _open_replica_pool():
+    global _replica_pool, _replica_poller
+    url = _env(REPLICA_URL_ENV)
+    if not url or _replica_pool is not None:
+        return
+    _replica_pool = AsyncConnectionPool(
+        url,
+        min_size=POOL_MIN,
+        max_size=POOL_MAX,
+        timeout=POOL_TIMEOUT_S,
+        max_lifetime=POOL_RECYCLE_S,
+        check=_async_check,
+        reset=_async_reset,
+        kwargs={"prepare_threshold": PREPARE_THRESHOLD},
+        open=False,
+    )
+    # Don't block startup on the replica: reads use the primary until it answers
+    await _replica_pool.open(wait=False)
+    _replica_poller = asyncio.create_task(_poll_replica())
+
+async def _close_replica_pool():
+    global _replica_pool, _replica_poller, _replica_lag_s
+    if _replica_poller is not None:
+        _replica_poller.cancel()
+        try:
+            await _replica_poller
+        except asyncio.CancelledError:
+            pass
+        _replica_poller = None
+    if _replica_pool is not None:
+        await _replica_pool.close()
+        _replica_pool = None
+    _replica_lag_s = float("inf")
+    _user_write_lsn.clear()
+
+async def _poll_replica():
+    """
+    Sample the replica's replay LSN and lag every REPLICA_POLL_S so routing
+    decisions cost no round-trip. Any failure marks the replica unusable
+    until the next good sample.
+    """
+    global _replica_lsn, _replica_lag_s, _replica_sampled_at
+    while True:
+        try:
+            async with _replica_pool.connection(timeout=REPLICA_POLL_S * 2) as conn:
+                cur = await conn.execute(REPLICA_STATE_SQL)
+                lsn, lag_s = await cur.fetchone()
+            _replica_lsn, _replica_lag_s = _lsn(lsn), float(lag_s)
+            _replica_sampled_at = time.monotonic()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            if _replica_lag_s != float("inf"):
+                print(f"[db] Replica unavailable, reading from primary: {e}")
+            _replica_lag_s = float("inf")
+        await asyncio.sleep(REPLICA_POLL_S)
+
+def _user_key(user_id) -> str:
+    # The same user as a UUID, or spelled in upper case / without dashes, is one key
+    try:
+        return str(uuid.UUID(str(user_id)))
+    except ValueError:
+        return str(user_id)
+
+def _replica_route(user_id: str | None) -> str:
+    if _replica_pool is None:
+        return "primary_no_replica"
+    now = time.monotonic()
+    stale = now - _replica_sampled_at > REPLICA_POLL_S * 3
+    if stale or _replica_lag_s == float("inf") or (REPLICA_MAX_LAG_S > 0 and _replica_lag_s > REPLICA_MAX_LAG_S):
+        return "primary_lag"
+    if user_id is not None:
+        key = _user_key(user_id)
+        written = _user_write_lsn.get(key)
+        if written is not None:
+            lsn, at = written
+            if now - at > READ_YOUR_WRITES_S or lsn <= _replica_lsn:
+                _user_write_lsn.pop(key, None)  # replica has caught up with it
+            else:
+                return "primary_own_write"
+    return "replica"
+
+@asynccontextmanager
+async def read_connection(user_id: str | None = None):
+    """
+    Like async_connection(), for read-only queries: served by the replica
+    (DB_REPLICA_URL) unless there is none, it is unreachable or lagging
+    more than DB_REPLICA_MAX_LAG_S, or user_id committed a write (see
+    note_write()) that the replica has not replayed yet.
+    """
+    if _async_pool is None:
+        raise RuntimeError("Async pool not open; call open_async_pool() first")
+    route = _replica_route(user_id)
+    _routed[route] += 1
+    pool = _replica_pool if route == "replica" else _async_pool
+    async with pool.connection() as conn:
+        yield conn
 
-    return psycopg2.connect(fullstring)
+async def note_write(conn: psycopg.AsyncConnection, user_ids):
+    """
+    Commit conn's transaction and remember its WAL position for each user, so
+    their next read_connection() waits for the replica to replay it (read
+    your writes). Costs one round-trip, and only when a replica is configured.
+    Positions are per process: run one worker, or pin users to a worker.
+    """
+    if _replica_pool is None:
+        return
+    await conn.commit()
+    cur = await conn.execute("SELECT pg_current_wal_lsn()::text;")
+    lsn = _lsn((await cur.fetchone())[0])
+    now = time.monotonic()
+    for user_id in user_ids:
+        _user_write_lsn[_user_key(user_id)] = (lsn, now)
+    if len(_user_write_lsn) > 10000:
+        for k in [k for k, (_, at) in _user_write_lsn.items() if now - at > READ_YOUR_WRITES_S]:
+            del _user_write_lsn[k]
 
-get_connection()
\ No newline at end of file
+def replica_status() -> dict:
+    return {
+        "configured": _replica_pool is not None,
+        "lag_s": None if _replica_lag_s == float("inf") else round(_replica_lag_s, 3),
+        "max_lag_s": REPLICA_MAX_LAG_S or None,
+        "pending_own_writes": len(_user_write_lsn),
+        "routed": dict(_routed),
+    }
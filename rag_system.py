@@ -19,6 +19,25 @@ from supabase import create_client, Client
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
+RECENT_INVOICES = int(os.getenv("RAG_RECENT_INVOICES", "10"))  # invoices listed in answers
+
+# Arabic names by product/class name, used until (or when) detector_classes cannot
+# be read; same list as Track-Model-with-QR/class_map.py seeds display_name with
+DEFAULT_DISPLAY_NAMES = {
+    'Almarai_juice': 'عصير المراعي',
+    'alrabie_juice': 'عصير الربيع',
+    'Nadec_Mlik': 'حليب نادك',
+    'Sun_top': 'صن توب',
+    'barni': 'بارني',
+    'biskrem': 'بسكريم',
+    'loacker': 'لويكر',
+    'oreos': 'أوريو',
+    'galaxy': 'جالكسي',
+    'green_skittles': 'سكيتلز أخضر',
+    'kit_kat': 'كيت كات',
+    'pink_skittles': 'سكيتلز وردي',
+    'protein_bar': 'بروتين بار',
+}
 
 @dataclass
 class RAGConfig:
@@ -42,6 +61,7 @@ class SupabaseRAG:
         self.vector_store = None
         self.chain = None
         self.memory = None
+        self._display_names: Optional[Dict[str, str]] = None  # class_name -> Arabic, loaded on first use
         self._initialize()
 
     def _initialize(self):
@@ -212,22 +232,16 @@ class SupabaseRAG:
 
     def translate_product_name(self, name: str) -> str:
         """Translate product name from English to Arabic"""
-        translations = {
-            'Almarai_juice': 'عصير المراعي',
-            'alrabie_juice': 'عصير الربيع',
-            'Nadec_Mlik': 'حليب نادك',
-            'Sun_top': 'صن توب',
-            'barni': 'بارني',
-            'biskrem': 'بسكريم',
-            'loacker': 'لويكر',
-            'oreos': 'أوريو',
-            'galaxy': 'جالكسي',
-            'green_skittles': 'سكيتلز أخضر',
-            'kit_kat': 'كيت كات',
-            'pink_skittles': 'سكيتلز وردي',
-            'protein_bar': 'بروتين بار'
-        }
-        return translations.get(name, name)
+        if self._display_names is None:
+            # Same display names the vision nodes get (detector_classes, see class_map.py)
+            names = dict(DEFAULT_DISPLAY_NAMES)
+            try:
+                rows = self.supabase.table("detector_classes").select("class_name, display_name").execute().data or []
+                names.update({r["class_name"]: r["display_name"] for r in rows if r.get("display_name")})
+            except Exception as e:
+                logger.error(f"Error loading display names: {e}")
+            self._display_names = names
+        return self._display_names.get(name, name)
 
     def format_products(self, products: List[Dict], show_prices: bool = True) -> str:
         """Format products for display"""
@@ -597,7 +611,8 @@ class SupabaseRAG:
             if any(k in q_lower for k in ["فواتيري", "فواتيري", "invoices", "invoice", "كم عدد فواتيري", "عرض فواتيري", "فواتيري"]):
                 if user_id:
                     data = await self.load_database_data(user_id)
-                    invoice_count = len(data['invoices'])
+                    summary = data.get('invoice_summary')
+                    invoice_count = summary['invoice_count'] if summary else len(data['invoices'])
                     if invoice_count > 0:
                         return {
                             "answer": f"لديك {invoice_count} فواتير:\n{self.format_invoices(data['invoices'])}",
@@ -675,13 +690,18 @@ class SupabaseRAG:
             data: Dict[str, Any] = {}
             data['products'] = self.supabase.table("products").select("*").execute().data or []
             data['branches'] = self.supabase.table("branches").select("*").execute().data or []
-            q = self.supabase.table("invoices").select("*")
+            # Latest invoices only; totals come from user_invoice_summary instead of counting them all
+            q = self.supabase.table("invoices").select("id, timestamp, total_amount, status")
             if user_id: q = q.eq("user_id", user_id)
-            data['invoices'] = q.execute().data or []
+            data['invoices'] = q.order("timestamp", desc=True).limit(RECENT_INVOICES).execute().data or []
+            data['invoice_summary'] = None
+            if user_id:
+                rows = self.supabase.table("user_invoice_summary").select("*").eq("user_id", user_id).execute().data
+                data['invoice_summary'] = rows[0] if rows else None
             return data
         except Exception as e:
             logger.error(f"Error loading DB: {e}")
-            return {"products": [], "branches": [], "invoices": []}
+            return {"products": [], "branches": [], "invoices": [], "invoice_summary": None}
 
     async def add_knowledge_base(self, knowledge_data: List[Dict[str, Any]]) -> bool:
         """Add knowledge base documents to the system"""